@@ -1,42 +1,25 @@
-import ollama
 import json
+from llm_client import chat_json
+from model_router import PLANNER_MODEL
+from tracing import traced, annotate
+from llm_cache import LRUCache, normalize_text, state_fingerprint
+from prompt_context import (build_history_context, build_previous_context, build_past_runs_context,
+                            build_messages, state_lists, report_prompt, truncate)
 
+plan_cache = LRUCache("plans")
 
-def linux_step_planning(user_message, current_path, conversation_history=None, container_state=None):
-    """Generate planning steps using Ollama with state awareness"""
-
-    history_context = ""
-    if conversation_history:
-        recent_messages = conversation_history[-6:]
-        history_entries = [f"- {msg['role']}: {msg['content']}"
-                           for msg in recent_messages if 'role' in msg]
-        if history_entries:
-            history_context = f"Recent conversation:\n{chr(10).join(history_entries)}\n\n"
-
-    # Build container state context
-    state_context = ""
-    if container_state:
-        state_context = f"""
-CURRENT CONTAINER STATE:
-- Existing directories: {', '.join(container_state.get('directories', [])) or 'none'}
-- Existing files: {', '.join(container_state.get('files', [])) or 'none'}
-- Installed Python packages: {', '.join(container_state.get('python_packages', [])) or 'none'}
-"""
-
-    system_prompt = f"""You are a Linux action planner for Ubuntu Docker container (root access).
-Current directory: '{current_path}'
-
-{history_context}{state_context}
+# Shared by every planner call and never formatted, so its tokens stay cached on the server
+PLANNER_PREFIX = """You are a Linux action planner and error recovery specialist for an Ubuntu Docker container (root access).
+Each message starts with its task, TASK: PLAN or TASK: RECOVERY, followed by the current context.
 
-Task: Break down this request into clear, actionable steps: '{user_message}'
-
-IMPORTANT STATE-AWARE RULES:
-- Do NOT create directories/files that already exist (check CURRENT CONTAINER STATE)
+STATE-AWARE RULES:
+- Do NOT create directories/files that already exist (check the container state)
 - For Python packages (pytest, requests, etc.), use pip3, NOT apt-get
 - For system packages (python3-pip, git, curl), use apt-get
-- Avoid interactive editors (nano, vim) - use echo commands for file content
+- Avoid interactive editors (nano, vim) and echo - plan file content as a "Create [file] with [content]" step, which is written as a file
 - Be specific about file paths (e.g., src/main.py not just main.py)
 
+TASK: PLAN - break the request into clear, actionable steps.
 PLANNING RULES:
 - For simple single commands (ls, pwd, which), create ONE step only
 - For Python package installations, use "Install [package] using pip3"
@@ -44,37 +27,90 @@ PLANNING RULES:
 - For file creation with content, use "Create [file] with [content]"
 - For navigation, use "Navigate to [directory]"
 - Skip steps for things that already exist
-- Output ONLY valid JSON: {{"linuxcommand": ["step1", "step2", ...]}}
+- Optionally add "depends_on": one list per step with the numbers of earlier steps it needs
+- Output ONLY valid JSON: {"linuxcommand": ["step1", "step2", ...], "depends_on": [[], [1], ...]}
+
+PLANNING EXAMPLES:
+"install pytest using pip" → {"linuxcommand": ["Install python3-pip system package", "Install pytest using pip3"], "depends_on": [[], [1]]}
+"create src and tests folders" → {"linuxcommand": ["Create src directory", "Create tests directory"], "depends_on": [[], []]}
+"create main.py with add function" → {"linuxcommand": ["Create src/main.py with add function"]}
+"run pytest tests" → {"linuxcommand": ["Run pytest on tests directory"]}
+"check if pytest exists" → {"linuxcommand": ["Check if pytest is installed"]}
+
+TASK: RECOVERY - analyze the error and create INTELLIGENT recovery steps.
+CRITICAL ERROR PATTERNS & CORRECT SOLUTIONS:
+1. "pytest: command not found" → Install pytest using pip3 (NOT apt-get)
+2. "pip3: command not found" → Install python3-pip system package first
+3. "python3-venv not available" → Install python3-venv system package
+4. "nano: command not found" → Use a "Create [file] with [content]" step instead of interactive editors
+5. "Too many errors from stdin" → Command needs non-interactive approach
+6. "No such file or directory" → Create missing directories/files
+7. "E: Unable to locate package [python-package]" → Use pip3, not apt-get
+
+INTELLIGENT RECOVERY RULES:
+- Python packages (pytest, requests, flask, etc.) → Use pip3 install [package]
+- System packages (python3-pip, git, curl, etc.) → Use apt-get install [package]
+- For file editing errors → Use a "Create [file] with [content]" step to write the content
+- Check if pip3 is installed before trying to install Python packages
+- Don't repeat failed approaches - learn from the error
+- Output ONLY JSON: {"recovery_steps": ["fix1", "fix2", ...]}
+
+RECOVERY EXAMPLES:
+Error "pytest: command not found" → {"recovery_steps": ["Install pytest using pip3"]}
+Error "pip3: command not found" → {"recovery_steps": ["Install python3-pip system package", "Install pytest using pip3"]}
+Error "nano main.py failed" → {"recovery_steps": ["Create main.py with the intended content"]}
+Error "E: Unable to locate package pytest" → {"recovery_steps": ["Install pytest using pip3 instead of apt-get"]}"""
 
-EXAMPLES:
-"install pytest using pip" → {{"linuxcommand": ["Install python3-pip system package", "Install pytest using pip3"]}}
-"create main.py with add function" → {{"linuxcommand": ["Create src/main.py with add function"]}}
-"run pytest tests" → {{"linuxcommand": ["Run pytest on tests directory"]}}
-"check if pytest exists" → {{"linuxcommand": ["Check if pytest is installed"]}}"""
+
+@traced("linux_step_planning")
+def linux_step_planning(user_message, current_path, conversation_history=None, container_state=None,
+                        past_runs=None):
+    """Generate planning steps using Ollama with state awareness"""
+
+    cache_key = plan_cache_key(user_message, current_path, container_state)
+    cached = plan_cache.get(cache_key)
+    if cached:
+        print("💾 Plan from cache")
+        annotate(source="cache")
+        if isinstance(cached, list):
+            return {"linuxcommand": list(cached), "depends_on": None}
+        return dict(cached)
+
+    history_context = build_history_context(conversation_history)
+    past_runs_context = build_past_runs_context(past_runs)
+
+    state_context = ""
+    if container_state:
+        lists = state_lists(container_state, query=user_message)
+        state_context = f"""CURRENT CONTAINER STATE:
+- Existing directories: {lists['directories']}
+- Existing files: {lists['files']}
+- Installed Python packages: {lists['python_packages']}
+"""
+
+    # the static prefix comes first so the server can reuse its cached tokens; what changes goes last
+    context = f"""TASK: PLAN
+{history_context}{past_runs_context}{state_context}
+Current directory: '{current_path}'
+Break down this request into clear, actionable steps: '{user_message}'"""
+
+    report_prompt("Planning", PLANNER_PREFIX + context)
 
     try:
-        response = ollama.chat(
-            model='deepseek-r1:8b-0528-qwen3-fp16',
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
+        parsed = chat_json(
+            model=PLANNER_MODEL,
+            messages=build_messages(PLANNER_PREFIX, context),
+            keys=("linuxcommand",),
             format="json",
             options={"temperature": 0.1, "top_p": 0.9}
         )
-
-        content = response.get('message', {}).get('content', '').strip()
-
-        if '{' in content:
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            content = content[start:end]
-
-        parsed = json.loads(content)
         commands = parsed.get("linuxcommand", [])
 
         if isinstance(commands, list) and all(isinstance(cmd, str) and cmd.strip() for cmd in commands):
-            return {"linuxcommand": [cmd.strip() for cmd in commands]}
+            plan = {"linuxcommand": [cmd.strip() for cmd in commands],
+                    "depends_on": parsed.get("depends_on")}
+            plan_cache.put(cache_key, plan)
+            return plan
         else:
             print("❌ Invalid command format in plan")
             return None
@@ -87,81 +123,54 @@ EXAMPLES:
         return None
 
 
+def plan_cache_key(user_message, current_path, container_state):
+    return ["plan", normalize_text(user_message), current_path, state_fingerprint(container_state)]
+
+
+def forget_plan(user_message, current_path, container_state):
+    """Drop a cached plan that turned out not to work"""
+    plan_cache.invalidate(plan_cache_key(user_message, current_path, container_state))
+
+
+@traced("create_error_recovery_plan")
 def create_error_recovery_plan(error_info, original_request, step_results, current_time):
     """Create an intelligent recovery plan to fix the error"""
 
     # Build context from what was done before the error
-    previous_context = ""
-    if step_results:
-        previous_context = "\nPrevious successful steps:\n"
-        for result in step_results:
-            previous_context += f"- {result['step']}: {result['command']} → {result['result']}\n"
+    previous_context = build_previous_context(step_results, header="Previous successful steps")
 
-    # Build container state context
     state_context = ""
     container_state = error_info.get('container_state', {})
     if container_state:
-        state_context = f"""
-CONTAINER STATE:
-- Python packages installed: {', '.join(container_state.get('python_packages', [])) or 'none'}
-- Directories: {', '.join(container_state.get('directories', [])) or 'none'}
-- Files: {', '.join(container_state.get('files', [])) or 'none'}
+        query = f"{original_request} {error_info['failed_step']} {error_info['failed_command']} {error_info['error_message']}"
+        lists = state_lists(container_state, query=query)
+        state_context = f"""CONTAINER STATE:
+- Python packages installed: {lists['python_packages']}
+- Directories: {lists['directories']}
+- Files: {lists['files']}
 """
 
-    system_prompt = f"""You are an intelligent error recovery specialist for Linux Ubuntu container.
-
+    context = f"""TASK: RECOVERY
+ORIGINAL REQUEST: "{original_request}"
+{previous_context}{state_context}
 ERROR ANALYSIS:
+- Failed step: {error_info['failed_step']}
 - Failed command: {error_info['failed_command']}
-- Error message: {error_info['error_message']}
 - Exit code: {error_info['exit_code']}
-- Failed step: {error_info['failed_step']}
+- Error message: {truncate(error_info['error_message'], 1200)}
 - Current path: {error_info['current_path']}
-- Time: {current_time}
-{state_context}
-ORIGINAL REQUEST: "{original_request}"
-{previous_context}
+- Time: {current_time}"""
 
-TASK: Analyze the error and create INTELLIGENT recovery steps.
-
-CRITICAL ERROR PATTERNS & CORRECT SOLUTIONS:
-1. "pytest: command not found" → Install pytest using pip3 (NOT apt-get)
-2. "pip3: command not found" → Install python3-pip system package first
-3. "python3-venv not available" → Install python3-venv system package
-4. "nano: command not found" → Use echo commands instead of interactive editors
-5. "Too many errors from stdin" → Command needs non-interactive approach
-6. "No such file or directory" → Create missing directories/files
-7. "E: Unable to locate package [python-package]" → Use pip3, not apt-get
-
-INTELLIGENT RECOVERY RULES:
-- Python packages (pytest, requests, flask, etc.) → Use pip3 install [package]
-- System packages (python3-pip, git, curl, etc.) → Use apt-get install [package]
-- For file editing errors → Use echo commands to write content
-- Check if pip3 is installed before trying to install Python packages
-- Don't repeat failed approaches - learn from the error
-- Output ONLY JSON: {{"recovery_steps": ["fix1", "fix2", ...]}}
-
-SMART EXAMPLES:
-Error "pytest: command not found" → {{"recovery_steps": ["Install pytest using pip3"]}}
-Error "pip3: command not found" → {{"recovery_steps": ["Install python3-pip system package", "Install pytest using pip3"]}}
-Error "nano main.py failed" → {{"recovery_steps": ["Create main.py using echo command"]}}
-Error "E: Unable to locate package pytest" → {{"recovery_steps": ["Install pytest using pip3 instead of apt-get"]}}"""
+    report_prompt("Recovery", PLANNER_PREFIX + context)
 
     try:
-        response = ollama.chat(
-            model='deepseek-r1:8b-0528-qwen3-fp16',
-            messages=[{"role": "user", "content": system_prompt}],
+        parsed = chat_json(
+            model=PLANNER_MODEL,
+            messages=build_messages(PLANNER_PREFIX, context),
+            keys=("recovery_steps",),
             format="json",
             options={"temperature": 0.2, "top_p": 0.9}
         )
-
-        content = response.get('message', {}).get('content', '').strip()
-
-        if '{' in content:
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            content = content[start:end]
-
-        parsed = json.loads(content)
         recovery_steps = parsed.get("recovery_steps", [])
 
         if isinstance(recovery_steps, list) and all(isinstance(step, str) and step.strip() for step in recovery_steps):
@@ -1,121 +1,266 @@
-import ollama
 import json
+import posixpath
+import re
+import shlex
+from llm_client import chat_json
+from model_router import GENERATOR_MODEL
+from tracing import traced, annotate
+from command_rules import translate_step
+from file_writes import parse_write_action, is_write_action, command_text
+from llm_cache import LRUCache, normalize_text, state_fingerprint
+from prompt_context import build_previous_context, build_messages, state_lists, report_prompt
+from state_index import has_entry, state_index
 
+command_cache = LRUCache("commands", max_entries=1024)
+PLAIN_PACKAGE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._+-]*$")
 
-def linux_command(original_request, current_step, step_number, total_steps, all_steps,
-                  previous_results, current_path, user_login, current_time, container_state=None):
-    """Generate Linux command with full context and intelligence"""
 
-    # Build context from previous steps
-    previous_context = ""
-    if previous_results:
-        previous_context = "\nPrevious steps completed:\n"
-        for result in previous_results:
-            previous_context += f"- {result['step']}: {result['command']} → {result['result']}\n"
+COMMAND_RULES = """CRITICAL INTELLIGENCE RULES:
+1. For Python packages (pytest, requests, flask, etc.) → Use pip3 install [package]
+2. For system packages (python3-pip, git, curl, etc.) → Use apt-get install [package]
+3. For file creation with content → Use a write_files action (NOT echo, nano or vim)
+4. For directory navigation → Use exact paths from previous steps
+5. Check container state - don't create existing files/directories
+6. Ensure pip3 is available before installing Python packages"""
+
+GENERATION_RULES = """- Use apt-get not apt for system packages
+- Add DEBIAN_FRONTEND=noninteractive for apt-get installs
+- Use mkdir -p for directories (but check if they exist first)
+- Create files with content as {"write_files": [{"path": "file", "content": "text", "mode": "644"}]}, never interactive editors
+- Use pip3 for Python packages, apt-get for system packages"""
+
+# Shared by every generator call and never formatted, so its tokens stay cached on the server
+GENERATOR_PREFIX = f"""You generate Linux commands for an Ubuntu container (root access).
+Each message starts with its task, TASK: ONE COMMAND or TASK: ALL COMMANDS, followed by the current context.
+
+{COMMAND_RULES}
+
+COMMAND GENERATION RULES:
+{GENERATION_RULES}
+
+TASK: ONE COMMAND - a single command for the current step.
+- Output JSON only: {{"linuxcommand": "command"}}, or {{"write_files": [...]}} for a file-creation step
+EXAMPLES:
+"Install pytest using pip3" → {{"linuxcommand": "pip3 install pytest"}}
+"Install python3-pip system package" → {{"linuxcommand": "DEBIAN_FRONTEND=noninteractive apt-get install -y python3-pip"}}
+"Create src/main.py with add function" → {{"write_files": [{{"path": "src/main.py", "content": "def add(a, b):\\n    return a + b\\n", "mode": "644"}}]}}
+"Run pytest on tests directory" → {{"linuxcommand": "python3 -m pytest tests/"}}
+"Check if pytest is installed" → {{"linuxcommand": "pip3 show pytest"}}
+"Create project directory" (if src exists) → {{"linuxcommand": "echo 'Directory src already exists'"}}
+"Navigate to project directory" → {{"linuxcommand": "cd testpy"}}
+
+TASK: ALL COMMANDS - one command for EVERY plan step, for the whole plan at once.
+The commands run one after the other in the same shell. Assume every earlier step,
+including any "cd", has succeeded when writing a later command.
+- Output JSON only: {{"linuxcommands": ["command for step 1", "command for step 2", ...]}}
+- A file-creation step may be a {{"write_files": [...]}} object instead of a command string
+- Exactly one command per plan step, in plan order
+- Keep the given command for steps that already show one
+EXAMPLE:
+Plan "1. Install python3-pip system package 2. Create src/main.py with add function 3. Navigate to src"
+→ {{"linuxcommands": ["DEBIAN_FRONTEND=noninteractive apt-get install -y python3-pip", {{"write_files": [{{"path": "src/main.py", "content": "def add(a, b):\\n    return a + b\\n", "mode": "644"}}]}}, "cd src"]}}"""
+
 
-    # Build container state context
+def build_state_context(container_state, query=None):
+    """Describe what already exists in the container, entries named in query first"""
     state_context = ""
     if container_state:
+        lists = state_lists(container_state, query=query)
         state_context = f"""
 CONTAINER STATE AWARENESS:
-- Existing directories: {', '.join(container_state.get('directories', [])) or 'none'}
-- Existing files: {', '.join(container_state.get('files', [])) or 'none'}
-- Python packages installed: {', '.join(container_state.get('python_packages', [])) or 'none'}
+- Existing directories: {lists['directories']}
+- Existing files: {lists['files']}
+- Python packages installed: {lists['python_packages']}
 """
+    return state_context
+
+
+@traced("linux_command")
+def linux_command(original_request, current_step, step_number, total_steps, all_steps,
+                  previous_results, current_path, user_login, current_time, container_state=None,
+                  verbose=True, model=GENERATOR_MODEL):
+    """Generate Linux command with full context and intelligence"""
+
+    # Templated steps are translated directly, the model is only asked for the rest
+    rule, cmd = translate_step(current_step, container_state)
+    if cmd:
+        cmd = optimize_command_intelligently(cmd, container_state)
+        annotate(source="rule", rule=rule)
+        if verbose:
+            print(f"⚡ Command ({rule}): {cmd}")
+        return cmd
+
+    cache_key = ["step", normalize_text(current_step), current_path, state_fingerprint(container_state)]
+    cached = command_cache.get(cache_key)
+    if cached:
+        annotate(source="cache")
+        if verbose:
+            print(f"💾 Command from cache: {command_text(cached)}")
+        return cached
+
+    previous_context = build_previous_context(previous_results)
+    state_context = build_state_context(container_state, query=f"{original_request} {current_step}")
 
     # Build full plan overview
     all_steps_text = "\n".join([f"{i + 1}. {step}" for i, step in enumerate(all_steps)])
 
-    # Create comprehensive prompt
-    prompt = f"""Generate ONE INTELLIGENT Linux command for Ubuntu container.
+    # static prefix first, then the plan (shared by every step of it), then what changes per step
+    context = f"""TASK: ONE COMMAND for the current step.
 
 ORIGINAL USER REQUEST: "{original_request}"
 
 FULL PLAN:
 {all_steps_text}
-
+{state_context}{previous_context}
 CURRENT CONTEXT:
 - Current directory: {current_path}
 - Current step: {step_number}/{total_steps}
 - Current step description: "{current_step}"
-- Date/Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {current_time}
 - Current User's Login: {user_login}
-{state_context}{previous_context}
-
-CRITICAL INTELLIGENCE RULES:
-1. For Python packages (pytest, requests, flask, etc.) → Use pip3 install [package]
-2. For system packages (python3-pip, git, curl, etc.) → Use apt-get install [package]
-3. For file creation with content → Use echo 'content' > filename (NOT nano/vim)
-4. For directory navigation → Use exact paths from previous steps
-5. Check container state - don't create existing files/directories
-6. Ensure pip3 is available before installing Python packages
-
-COMMAND GENERATION RULES:
-- Output JSON only: {{"linuxcommand": "command"}}
-- Use apt-get not apt for system packages
-- Add DEBIAN_FRONTEND=noninteractive for apt-get installs
-- Use mkdir -p for directories (but check if they exist first)
-- Use echo commands for file content, never interactive editors
-- Use pip3 for Python packages, apt-get for system packages
+- Date/Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {current_time}"""
 
-INTELLIGENT EXAMPLES:
-"Install pytest using pip3" → {{"linuxcommand": "pip3 install pytest"}}
-"Install python3-pip system package" → {{"linuxcommand": "DEBIAN_FRONTEND=noninteractive apt-get install -y python3-pip"}}
-"Create src/main.py with add function" → {{"linuxcommand": "echo 'def add(a, b):\\n    return a + b' > src/main.py"}}
-"Run pytest on tests directory" → {{"linuxcommand": "python3 -m pytest tests/"}}
-"Check if pytest is installed" → {{"linuxcommand": "pip3 show pytest"}}
-"Create project directory" (if src exists) → {{"linuxcommand": "echo 'Directory src already exists'"}}
-"Navigate to project directory" → {{"linuxcommand": "cd testpy"}}"""
+    if verbose:
+        report_prompt("Command", GENERATOR_PREFIX + context)
 
     try:
-        response = ollama.chat(
-            model='qwen2.5-coder:7b',
-            messages=[{"role": "user", "content": prompt}],
+        data = chat_json(
+            model=model,
+            messages=build_messages(GENERATOR_PREFIX, context),
+            keys=("linuxcommand", "write_files"),
             format="json",
             options={"temperature": 0.1, "top_p": 0.9}
         )
+        cmd = parse_write_action(data)
+        if cmd is None and isinstance(data.get("linuxcommand"), dict):
+            cmd = parse_write_action(data["linuxcommand"])
+        if cmd is None:
+            cmd = str(data.get("linuxcommand") or "").strip()
 
-        content = response.get('message', {}).get('content', '').strip()
+        if cmd:
+            # Apply intelligent command optimizations
+            cmd = optimize_command_intelligently(cmd, container_state)
+            command_cache.put(cache_key, cmd)
+            if verbose:
+                print(f"🤖 Command: {command_text(cmd)}")
+            return cmd
+        else:
+            if verbose:
+                print("❌ Empty command in response")
+            return None
+
+    except json.JSONDecodeError as e:
+        if verbose:
+            print(f"❌ JSON parsing error: {e}")
+        return None
+    except Exception as e:
+        if verbose:
+            print(f"❌ Command generation error: {e}")
+        return None
 
-        # Extract JSON from response
-        if '{' in content:
-            start = content.find('{')
-            end = content.rfind('}') + 1
-            content = content[start:end]
 
-        data = json.loads(content)
-        cmd = data.get("linuxcommand", "").strip()
+@traced("linux_commands_batch")
+def linux_commands_batch(original_request, all_steps, previous_results, current_path,
+                         user_login, current_time, container_state=None):
+    """Generate the commands for a whole plan in a single model call"""
 
+    commands = []
+    missing = []
+    for i, step in enumerate(all_steps):
+        rule, cmd = translate_step(step, container_state)
         if cmd:
-            # Apply intelligent command optimizations
             cmd = optimize_command_intelligently(cmd, container_state)
-            print(f"🤖 Command: {cmd}")
-            return cmd
         else:
-            print("❌ Empty command in response")
+            missing.append(i)
+        commands.append(cmd)
+
+    if not missing:
+        print(f"⚡ All {len(all_steps)} commands from fast-path rules")
+        return commands
+
+    cache_key = ["batch", [normalize_text(step) for step in all_steps], current_path,
+                 state_fingerprint(container_state)]
+    cached = command_cache.get(cache_key)
+    if cached:
+        print(f"💾 {len(all_steps)} commands from cache")
+        return list(cached)
+
+    previous_context = build_previous_context(previous_results)
+    state_context = build_state_context(container_state, query=" ".join([original_request] + all_steps))
+    all_steps_text = "\n".join(
+        f"{i + 1}. {step}" + (f"  (command: {commands[i]})" if commands[i] else "")
+        for i, step in enumerate(all_steps)
+    )
+
+    context = f"""TASK: ALL COMMANDS for this plan.
+
+ORIGINAL USER REQUEST: "{original_request}"
+
+FULL PLAN:
+{all_steps_text}
+{state_context}{previous_context}
+CURRENT CONTEXT:
+- Current directory when step 1 starts: {current_path}
+- Current User's Login: {user_login}
+- Date/Time (UTC - YYYY-MM-DD HH:MM:SS formatted): {current_time}
+
+Output exactly {len(all_steps)} commands in plan order."""
+
+    report_prompt("Batch command", GENERATOR_PREFIX + context)
+
+    try:
+        data = chat_json(
+            model=GENERATOR_MODEL,
+            messages=build_messages(GENERATOR_PREFIX, context),
+            keys=("linuxcommands",),
+            format="json",
+            options={"temperature": 0.1, "top_p": 0.9}
+        )
+        generated = data.get("linuxcommands", [])
+
+        if not isinstance(generated, list) or len(generated) != len(all_steps):
+            print("❌ Batched commands don't match the plan, generating per step")
             return None
 
+        for i in missing:
+            cmd = generated[i].strip() if isinstance(generated[i], str) else parse_write_action(generated[i])
+            commands[i] = optimize_command_intelligently(cmd, container_state) if cmd else None
+
+        print(f"🤖 Generated {len(missing)} of {len(all_steps)} commands in one call")
+        if all(commands):
+            command_cache.put(cache_key, commands)
+        return commands
+
     except json.JSONDecodeError as e:
-        print(f"❌ JSON parsing error: {e}")
+        print(f"❌ Batch JSON parsing error: {e}")
         return None
     except Exception as e:
-        print(f"❌ Command generation error: {e}")
+        print(f"❌ Batch command generation error: {e}")
         return None
 
 
+def forget_command(cmd):
+    """Drop every cached answer that produced a command which failed"""
+    return command_cache.invalidate_where(
+        lambda value: value == cmd or (isinstance(value, list) and cmd in value)
+    )
+
+
 def optimize_command_intelligently(cmd, container_state=None):
     """Apply intelligent optimizations to commands"""
 
+    if is_write_action(cmd):
+        return cmd
+
     # Skip if trying to create existing directories
     if container_state and cmd.startswith('mkdir -p '):
         dir_name = cmd.replace('mkdir -p ', '').strip()
-        if dir_name in container_state.get('directories', []):
+        if has_entry(container_state, dir_name, "d"):
             return f"echo 'Directory {dir_name} already exists'"
 
     # Skip if trying to create existing files
     if container_state and cmd.startswith('touch '):
         file_name = cmd.replace('touch ', '').strip()
-        if file_name in container_state.get('files', []):
+        if has_entry(container_state, file_name, "f"):
             return f"echo 'File {file_name} already exists'"
 
     # Replace apt with apt-get for scripting
@@ -141,6 +286,40 @@ def optimize_command_intelligently(cmd, container_state=None):
         python_packages = ['pytest', 'requests', 'flask', 'django', 'numpy', 'pandas']
         for pkg in python_packages:
             if pkg in cmd:
-                return f"pip3 install {pkg}"
+                cmd = f"pip3 install {pkg}"
+                break
+
+    # Skip installs of packages the index already has
+    installed = already_installed(cmd, container_state)
+    if installed:
+        return f"echo 'Already installed: {' '.join(installed)}'"
+
+    return cmd
 
-    return cmd
\ No newline at end of file
+
+def already_installed(cmd, container_state):
+    """Packages of a plain pip3/apt-get install when every one of them is installed, else None"""
+    index = state_index(container_state)
+    if index is None or any(op in cmd for op in (';', '&', '|', '>', '<', '`', '$(')):
+        return None
+    try:
+        words = shlex.split(cmd)
+    except ValueError:
+        return None
+    while words and '=' in words[0] and not words[0].startswith('-'):
+        words = words[1:]
+    if len(words) < 3 or words[1] != 'install':
+        return None
+
+    verb, args = posixpath.basename(words[0]), words[2:]
+    if verb in ('pip', 'pip3'):
+        # flags (-r, --upgrade, ...) and version pins change what gets installed
+        if any(not PLAIN_PACKAGE.match(arg) for arg in args):
+            return None
+        return args if all(index.has_python_package(arg) for arg in args) else None
+    if verb == 'apt-get':
+        packages = [arg for arg in args if arg not in ('-y', '--yes', '-q', '--no-install-recommends')]
+        if not packages or any(not PLAIN_PACKAGE.match(arg) for arg in packages):
+            return None
+        return packages if all(index.has_system_package(arg) for arg in packages) else None
+    return None
\ No newline at end of file
@@ -0,0 +1,213 @@
+import argparse
+import contextvars
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from main import (container_pool, handle_request, state_tracker, get_current_time, print_run_stats,
+                  warm_up_models, REFRESH_BASE_IMAGE)
+from startup import Startup
+from shell_session import close_session
+from container_pool import close_pools
+from llm_scheduler import current_session
+from tracing import span
+from output_buffer import RoutedStdout, routed_output
+
+BATCH_WORKERS = int(os.environ.get("OLLAMACONTROL_BATCH_WORKERS", "2"))
+
+
+def load_groups(path):
+    """Requests from a JSONL file grouped by "session"; a group runs in order on one container.
+
+    Each line needs "request" (or "input"); "id" defaults to the line number
+    and entries without a "session" run on their own container.
+    """
+    groups = OrderedDict()
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            request = (item.get("request") or item.get("input") or "").strip()
+            if not request:
+                print(f"⚠️ Line {line_number}: no request, skipped")
+                continue
+            entry_id = str(item.get("id", line_number))
+            session = str(item.get("session", entry_id))
+            groups.setdefault(session, []).append({"id": entry_id, "session": session, "request": request})
+    return groups
+
+
+def completed_sessions(results_path, groups):
+    """Sessions whose entries all have results; partial sessions are dropped so they rerun from scratch"""
+    if not os.path.exists(results_path):
+        return set()
+
+    results = []
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                # the last line of an interrupted run may be cut short
+                continue
+
+    done = {result.get("id") for result in results}
+    complete = {name for name, entries in groups.items() if all(e["id"] in done for e in entries)}
+    kept = [result for result in results if result.get("session") in complete]
+    if len(kept) != len(results):
+        tmp_path = f"{results_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for result in kept:
+                f.write(json.dumps(result) + "\n")
+        os.replace(tmp_path, results_path)
+    return complete
+
+
+class BatchRunner:
+    """Replays request groups across a few containers and appends one result line per request"""
+
+    def __init__(self, pool, results_path, workers=BATCH_WORKERS):
+        self.pool = pool
+        self.results_path = results_path
+        self.workers = workers
+        self.stopping = threading.Event()
+        self.counts = {"entries": 0, "succeeded": 0}
+        self._write_lock = threading.Lock()
+
+    def run(self, groups):
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [executor.submit(contextvars.copy_context().run, self.run_group, name, entries)
+                   for name, entries in groups.items()]
+        try:
+            for future in futures:
+                future.result()
+        except KeyboardInterrupt:
+            self.stopping.set()
+            print("\n🛑 Stopping after the running requests; run again with the same output to resume")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+    def run_group(self, name, entries):
+        if self.stopping.is_set():
+            return
+        current_session.set(name)
+        container = self.pool.acquire()
+        current_path, messages = "/", []
+        try:
+            for entry in entries:
+                if self.stopping.is_set():
+                    return
+                result, current_path = self.run_entry(container, entry, current_path, messages)
+                self.write(result)
+        except Exception as e:
+            print(f"❌ Session {name} aborted: {e}")
+        finally:
+            try:
+                close_session(container)
+                container.stop()
+            except Exception as e:
+                print(f"⚠️ Error stopping container: {e}")
+
+    def run_entry(self, container, entry, current_path, messages):
+        buffer = io.StringIO()
+        token = routed_output.set(buffer)
+        record, success, error = {}, False, None
+        started = time.perf_counter()
+        try:
+            with span("request", input=entry["request"], session=entry["session"]) as request_span:
+                try:
+                    current_path, success = handle_request(container, entry["request"], current_path,
+                                                           messages, record)
+                except Exception as e:
+                    state_tracker(container).invalidate()
+                    error = str(e)
+                    print(f"❌ Unexpected error: {e}")
+        finally:
+            routed_output.reset(token)
+
+        phases = defaultdict(float)
+        for finished in request_span.finished:
+            phases[finished.name] += finished.duration
+        duration = time.perf_counter() - started
+        print(f"{'✅' if success else '❌'} [{entry['id']}] {entry['request']} ({duration:.1f}s)")
+
+        return {
+            "id": entry["id"],
+            "session": entry["session"],
+            "request": entry["request"],
+            "success": success,
+            "error": error,
+            "path": current_path,
+            "plan": record.get("plan"),
+            "depends_on": record.get("depends_on"),
+            "steps": [{"step": r["step"], "command": r["command"], "output": r["output"]}
+                      for r in record.get("steps", [])],
+            "timings": {"total_s": round(duration, 3),
+                        "phases_s": {name: round(total, 3) for name, total in phases.items()}},
+            "container": container.name,
+            "finished_at": get_current_time(),
+            "log": buffer.getvalue()
+        }, current_path
+
+    def write(self, result):
+        with self._write_lock:
+            with open(self.results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+            self.counts["entries"] += 1
+            self.counts["succeeded"] += result["success"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run OllamaControl requests from a JSONL file")
+    parser.add_argument("input", help="JSONL file with one {\"request\": ...} per line")
+    parser.add_argument("--output", help="results JSONL (default: <input>.results.jsonl)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="containers used in parallel")
+    parser.add_argument("--fresh", action="store_true", help="ignore existing results instead of resuming")
+    parser.add_argument("--check", action="store_true", help="only validate the input file")
+    args = parser.parse_args()
+
+    results_path = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    try:
+        groups = load_groups(args.input)
+    except (OSError, ValueError) as e:
+        print(f"❌ Cannot read {args.input}: {e}")
+        sys.exit(1)
+    requests = sum(len(e) for e in groups.values())
+    if args.check:
+        # resuming rewrites the results file, so a check stops before touching it
+        print(f"📦 {requests} requests in {len(groups)} sessions")
+        return
+    if args.fresh and os.path.exists(results_path):
+        os.remove(results_path)
+    done = completed_sessions(results_path, groups)
+    pending = OrderedDict((name, entries) for name, entries in groups.items() if name not in done)
+    print(f"📦 {requests} requests in {len(groups)} sessions, "
+          f"{len(groups) - len(pending)} sessions already done")
+
+    sys.stdout = RoutedStdout(sys.stdout)
+    started = time.perf_counter()
+    runner = None
+    try:
+        startup = Startup()
+        warm_up_models(startup)
+        startup.start("Containers", container_pool, REFRESH_BASE_IMAGE, args.workers)
+        runner = BatchRunner(startup.wait("Containers"), results_path, args.workers)
+        runner.run(pending)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_pools()
+        if runner:
+            print(f"\n📊 {runner.counts['succeeded']}/{runner.counts['entries']} requests succeeded "
+                  f"in {time.perf_counter() - started:.1f}s, results in {results_path}")
+        print_run_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,665 @@
+"""Benchmark the request pipeline end to end without a GPU or a Docker daemon.
+
+A local HTTP server stands in for Ollama (canned answers, injected latency) and
+FakeContainer simulates a small Ubuntu filesystem behind exec_run.
+
+    python benchmark.py --iterations 5 --planner-latency 0.4 --generator-latency 0.1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import posixpath
+import re
+import shlex
+import tarfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import docker
+
+DEFAULT_WORKLOAD = [
+    {
+        "request": "install pytest",
+        "plan": ["Install python3-pip system package", "Install pytest using pip3"],
+        "depends_on": [[], [1]],
+    },
+    {
+        "request": "create a project with src/main.py containing an add function",
+        "plan": ["Create src directory", "Create src/main.py with add function", "Create tests directory"],
+        "depends_on": [[], [1], []],
+        "commands": {
+            "Create src directory": "mkdir -p src",
+            "Create src/main.py with add function": {"write_files": [
+                {"path": "src/main.py", "content": "def add(a, b):\n    return a + b\n", "mode": "644"}
+            ]},
+            "Create tests directory": "mkdir -p tests",
+        },
+    },
+    {
+        "request": "run pytest tests",
+        "plan": ["Run pytest on tests directory"],
+    },
+    {
+        "request": "show the files here",
+        "plan": ["List files in current directory"],
+        "commands": {"List files in current directory": "ls"},
+    },
+    {
+        "request": "start the flask app",
+        "plan": ["Create app.py with a flask app", "Start the flask app"],
+        "commands": {
+            "Create app.py with a flask app": "echo 'from flask import Flask' > app.py",
+            "Start the flask app": "flask --version",
+        },
+    },
+    {
+        "request": "write notes into docs/notes.txt",
+        "plan": ["Write notes to docs/notes.txt"],
+        "commands": {"Write notes to docs/notes.txt": "echo 'notes' > docs/notes.txt"},
+        "recovery": ["Create docs directory"],
+        "recovery_commands": {"Create docs directory": "mkdir -p docs"},
+    },
+]
+
+SHELL_BUILTINS = {"cd", "command", "export", "which", "compgen", "if", "then", "fi", "for", "do", "done"}
+BASE_BINARIES = {"bash", "sh", "ls", "cat", "echo", "printf", "mkdir", "touch", "rm", "cp", "mv",
+                 "pwd", "find", "head", "sed", "grep", "sleep", "true", "false", "apt-get",
+                 "dpkg", "dpkg-query", "timeout", "python3", "tee", "wc", "date", "whoami", "env"}
+
+
+class FakeContainer:
+    """Simulated container: an in-memory filesystem and package set behind exec_run"""
+
+    def __init__(self, exec_latency=0.01, install_latency=0.05, name="bench"):
+        self.name = name
+        self.id = f"fake-{name}"
+        self.exec_latency = exec_latency
+        self.install_latency = install_latency
+        self.dirs = {"/", "/root", "/tmp", "/etc", "/usr", "/var"}
+        self.files = {}
+        self.apt_packages = set()
+        self.pip_packages = set()
+        # change time per path, for find -newerct
+        self.changed = {}
+        self.exec_count = 0
+
+    def exec_run(self, cmd, demux=False, **kwargs):
+        self.exec_count += 1
+        time.sleep(self.exec_latency)
+
+        words = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+        script = words[-1] if "-c" in words else " ".join(words)
+        out, err = io.StringIO(), io.StringIO()
+        exit_code = self._run_script(script, ["/"], out, err)
+        stdout, stderr = out.getvalue().encode(), err.getvalue().encode()
+        if demux:
+            return exit_code, (stdout or None, stderr or None)
+        return exit_code, stdout + stderr
+
+    def put_archive(self, path, data):
+        self.exec_count += 1
+        time.sleep(self.exec_latency)
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            for member in tar.getmembers():
+                target = self._path([path], member.name)
+                if member.isdir():
+                    self.dirs.add(target)
+                elif posixpath.dirname(target) not in self.dirs:
+                    return False
+                else:
+                    self.files[target] = tar.extractfile(member).read().decode()
+                self._changed(target)
+        return True
+
+    def get_archive(self, path):
+        if path not in self.files and path not in self.dirs:
+            raise docker.errors.NotFound(f"Could not find the file {path} in container")
+        base = posixpath.dirname(path)
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for name in sorted(p for p in self.dirs if p == path or p.startswith(path + "/")):
+                info = tarfile.TarInfo(posixpath.relpath(name, base))
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            for name, content in sorted(self.files.items()):
+                if name == path or name.startswith(path + "/"):
+                    data = content.encode()
+                    info = tarfile.TarInfo(posixpath.relpath(name, base))
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+        return iter([buffer.getvalue()]), {"name": posixpath.basename(path)}
+
+    # -- shell simulation -------------------------------------------------
+
+    def _run_script(self, script, cwd, out, err):
+        try:
+            lexer = shlex.shlex(script, posix=True, punctuation_chars=True)
+            lexer.whitespace_split = True
+            tokens = list(lexer)
+        except ValueError as e:
+            err.write(f"bash: syntax error: {e}\n")
+            return 2
+
+        exit_code, operator, pipeline, words = 0, ";", [], []
+        for token in tokens + [";"]:
+            if token not in (";", "&&", "||", "|"):
+                words.append(token)
+                continue
+            pipeline.append(words)
+            words = []
+            if token == "|":
+                continue
+            if operator == ";" or (operator == "&&" and exit_code == 0) or (operator == "||" and exit_code != 0):
+                exit_code = self._run_pipeline(pipeline, cwd, out, err)
+            pipeline, operator = [], token
+        return exit_code
+
+    def _run_pipeline(self, pipeline, cwd, out, err):
+        first = io.StringIO()
+        exit_code = self._run_simple(pipeline[0], cwd, first, err)
+        text = first.getvalue()
+        for stage in pipeline[1:]:
+            if stage and stage[0] == "sed" and len(stage) > 1 and stage[1].startswith("s/^/"):
+                prefix = stage[1][4:stage[1].index("/", 4)].replace("\\t", "\t")
+                text = "".join(prefix + line + "\n" for line in text.splitlines())
+        out.write(text)
+        return exit_code
+
+    def _path(self, cwd, path):
+        return posixpath.normpath(posixpath.join(cwd[0], path))
+
+    def _changed(self, path):
+        now = time.time()
+        self.changed[path] = now
+        self.changed[posixpath.dirname(path)] = now
+
+    def _binaries(self):
+        binaries = set(BASE_BINARIES)
+        if "python3-pip" in self.apt_packages:
+            binaries |= {"pip3", "pip"}
+        binaries |= self.pip_packages & {"pytest", "flask", "black"}
+        binaries |= self.apt_packages
+        return binaries
+
+    def _run_simple(self, words, cwd, out, err):
+        while words and re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[0]):
+            words = words[1:]
+        if not words:
+            return 0
+
+        redirect = None
+        args = []
+        i = 0
+        while i < len(words):
+            if words[i] in (">", ">>") and i + 1 < len(words):
+                redirect = (words[i], words[i + 1])
+                i += 2
+            elif words[i] in ("2", "<") and i + 1 < len(words) and words[i + 1] in (">", "<", ">&"):
+                i += 3
+            else:
+                args.append(words[i])
+                i += 1
+
+        target = out
+        if redirect and redirect[1] != "/dev/null":
+            path = self._path(cwd, redirect[1])
+            if posixpath.dirname(path) not in self.dirs:
+                err.write(f"bash: line 1: {redirect[1]}: No such file or directory\n")
+                return 1
+            target = io.StringIO()
+        elif redirect:
+            target = io.StringIO()
+
+        verb, rest = args[0], args[1:]
+        handler = getattr(self, f"_cmd_{verb.replace('-', '_')}", None)
+        if verb not in self._binaries() and verb not in SHELL_BUILTINS:
+            err.write(f"bash: line 1: {verb}: command not found\n")
+            return 127
+        exit_code = handler(rest, cwd, target, err) if handler else 0
+
+        if redirect and redirect[1] != "/dev/null":
+            path = self._path(cwd, redirect[1])
+            previous = self.files.get(path, "") if redirect[0] == ">>" else ""
+            self.files[path] = previous + target.getvalue()
+            self._changed(path)
+        return exit_code
+
+    def _cmd_cd(self, args, cwd, out, err):
+        path = self._path(cwd, args[-1] if args and args[-1] != "--" else "/root")
+        if path not in self.dirs:
+            err.write(f"bash: line 1: cd: {args[-1]}: No such file or directory\n")
+            return 1
+        cwd[0] = path
+        return 0
+
+    def _cmd_pwd(self, args, cwd, out, err):
+        out.write(cwd[0] + "\n")
+        return 0
+
+    def _cmd_echo(self, args, cwd, out, err):
+        out.write(" ".join(a for a in args if a not in ("-e", "-n")).replace("\\n", "\n") + "\n")
+        return 0
+
+    _cmd_printf = _cmd_echo
+
+    def _cmd_true(self, args, cwd, out, err):
+        return 0
+
+    def _cmd_false(self, args, cwd, out, err):
+        return 1
+
+    def _cmd_mkdir(self, args, cwd, out, err):
+        for arg in (a for a in args if not a.startswith("-")):
+            path = self._path(cwd, arg)
+            if "-p" not in args and posixpath.dirname(path) not in self.dirs:
+                err.write(f"mkdir: cannot create directory '{arg}': No such file or directory\n")
+                return 1
+            while path not in self.dirs:
+                self.dirs.add(path)
+                self._changed(path)
+                path = posixpath.dirname(path)
+        return 0
+
+    def _cmd_touch(self, args, cwd, out, err):
+        for arg in args:
+            self.files.setdefault(self._path(cwd, arg), "")
+            self._changed(self._path(cwd, arg))
+        return 0
+
+    def _cmd_rm(self, args, cwd, out, err):
+        for arg in (a for a in args if not a.startswith("-")):
+            path = self._path(cwd, arg)
+            self.files = {p: c for p, c in self.files.items() if p != path and not p.startswith(path + "/")}
+            self.dirs = {d for d in self.dirs if d != path and not d.startswith(path + "/")} | {"/"}
+            self._changed(path)
+        return 0
+
+    def _cmd_ls(self, args, cwd, out, err):
+        prefix = cwd[0].rstrip("/") + "/"
+        names = {p[len(prefix):].split("/")[0] for p in list(self.dirs) + list(self.files)
+                 if p.startswith(prefix) and p != prefix}
+        out.write("".join(f"{name}\n" for name in sorted(names)))
+        return 0
+
+    def _cmd_cat(self, args, cwd, out, err):
+        for arg in args:
+            out.write(self.files.get(self._path(cwd, arg), ""))
+        return 0
+
+    def _cmd_find(self, args, cwd, out, err):
+        roots = []
+        while args and not args[0].startswith("-") and args[0] != "(":
+            roots.append(args.pop(0))
+
+        def option(name, default=None):
+            return args[args.index(name) + 1] if name in args else default
+
+        mindepth, maxdepth = int(option("-mindepth", 0)), int(option("-maxdepth", 99))
+        newer = float(option("-newerct", "@-1")[1:])
+        pruned = [args[i + 1] for i, arg in enumerate(args) if arg == "-path"]
+        fmt = option("-printf", "%y\\t%p\\n").replace("\\t", "\t").replace("\\n", "\n")
+        entries = [(p, "d") for p in self.dirs] + [(p, "f") for p in self.files]
+        for root in roots:
+            base = self._path(cwd, root)
+            for path, kind in sorted(entries):
+                if path != base and not path.startswith(base.rstrip("/") + "/"):
+                    continue
+                if any(path == p or path.startswith(p + "/") for p in pruned):
+                    continue
+                rel = posixpath.relpath(path, base)
+                level = 0 if rel == "." else rel.count("/") + 1
+                if not mindepth <= level <= maxdepth or self.changed.get(path, 0) <= newer:
+                    continue
+                size = len(self.files.get(path, "")) if kind == "f" else 4096
+                out.write(fmt.replace("%y", kind).replace("%s", str(size))
+                          .replace("%T@", f"{self.changed.get(path, 0):.6f}")
+                          .replace("%P", rel).replace("%p", posixpath.normpath(posixpath.join(root, rel))))
+        return 0
+
+    def _cmd_date(self, args, cwd, out, err):
+        fmt = next((a[1:] for a in args if a.startswith("+")), "%s")
+        out.write(fmt.replace("%t", "\t").replace("%s", str(int(time.time()))) + "\n")
+        return 0
+
+    def _cmd_dpkg_query(self, args, cwd, out, err):
+        out.write("".join(f"{p}\n" for p in sorted(self.apt_packages | {"bash", "coreutils"})))
+        return 0
+
+    def _cmd_command(self, args, cwd, out, err):
+        name = args[-1]
+        if name in self._binaries():
+            out.write(f"/usr/bin/{name}\n")
+            return 0
+        return 1
+
+    _cmd_which = _cmd_command
+
+    def _cmd_compgen(self, args, cwd, out, err):
+        out.write("".join(f"{name}\n" for name in sorted(self._binaries() | SHELL_BUILTINS)))
+        return 0
+
+    def _cmd_export(self, args, cwd, out, err):
+        return 0
+
+    def _cmd_sleep(self, args, cwd, out, err):
+        return 0
+
+    def _cmd_apt_get(self, args, cwd, out, err):
+        time.sleep(self.install_latency)
+        if "install" in args:
+            packages = [a for a in args[args.index("install") + 1:] if not a.startswith("-")]
+            for package in packages:
+                if package in ("pytest", "flask", "requests"):
+                    err.write(f"E: Unable to locate package {package}\n")
+                    return 100
+            self.apt_packages.update(packages)
+        return 0
+
+    def _cmd_pip3(self, args, cwd, out, err):
+        if args and args[0] == "install":
+            time.sleep(self.install_latency)
+            self.pip_packages.update(a.split("==")[0] for a in args[1:] if not a.startswith("-"))
+            return 0
+        if args and args[0] == "show":
+            missing = [a for a in args[1:] if a not in self.pip_packages]
+            if missing:
+                err.write(f"WARNING: Package(s) not found: {', '.join(missing)}\n")
+                return 1
+            out.write(f"Name: {args[1]}\n")
+            return 0
+        if args and args[0] == "list":
+            out.write("".join(f"{p}==1.0\n" for p in sorted(self.pip_packages)))
+        return 0
+
+    _cmd_pip = _cmd_pip3
+
+    def _cmd_python3(self, args, cwd, out, err):
+        if args[:2] == ["-m", "pytest"] or args[:2] == ["-m", "pip"]:
+            module = args[1]
+            if module == "pip":
+                return self._cmd_pip3(args[2:], cwd, out, err)
+            if "pytest" not in self.pip_packages:
+                err.write("/usr/bin/python3: No module named pytest\n")
+                return 1
+            out.write("no tests ran in 0.01s\n")
+            return 5 if not any(p.startswith(self._path(cwd, args[2]) if len(args) > 2 else cwd[0])
+                                and p.endswith(".py") for p in self.files) else 0
+        return 0
+
+    def _cmd_pytest(self, args, cwd, out, err):
+        return self._cmd_python3(["-m", "pytest"] + args, cwd, out, err)
+
+    def _cmd_flask(self, args, cwd, out, err):
+        out.write("Flask 3.0.0\n")
+        return 0
+
+
+class FakeOllama:
+    """Local /api/chat endpoint answering from the workload script"""
+
+    CHUNK_LATENCY = 0.001
+    TRAILING_CHUNKS = 40
+
+    def __init__(self, workload, planner_latency, generator_latency):
+        self.plans = {item["request"]: item["plan"] for item in workload}
+        self.dependencies = {item["request"]: item.get("depends_on") for item in workload}
+        self.commands = {}
+        self.recoveries = {}
+        for item in workload:
+            self.commands.update(item.get("commands", {}))
+            self.commands.update(item.get("recovery_commands", {}))
+            for step in item["plan"]:
+                if item.get("recovery"):
+                    self.recoveries[step] = item["recovery"]
+        self.latency = {"planner": planner_latency, "generator": generator_latency}
+        self.calls = defaultdict(int)
+        self.prompt_chars = defaultdict(list)
+        self.cached_chars = defaultdict(list)
+        self.last_prompt = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if body.get("stream"):
+                    self.stream(fake.answer(body))
+                    return
+                response = fake.answer(body)
+                # a non-streamed reply still waits for every chunk, padding included
+                time.sleep(fake.CHUNK_LATENCY * (len(fake.chunks(response)) - 1))
+                payload = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, response):
+                pieces = fake.chunks(response)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                try:
+                    for piece in pieces:
+                        part = {"model": response["model"], "message": {"role": "assistant", "content": piece},
+                                "done": False}
+                        self.wfile.write(json.dumps(part).encode() + b"\n")
+                        self.wfile.flush()
+                        time.sleep(fake.CHUNK_LATENCY)
+                    final = dict(response, message={"role": "assistant", "content": ""})
+                    self.wfile.write(json.dumps(final).encode() + b"\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client stopped reading once it had its JSON
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def chunks(self, response):
+        """A few characters per chunk, then the trailing whitespace JSON mode tends to pad with"""
+        content = response["message"]["content"]
+        return [content[i:i + 4] for i in range(0, len(content), 4)] + ["\n"] * self.TRAILING_CHUNKS
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    def answer(self, body):
+        prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+        task = body["messages"][-1]["content"]
+        model = body.get("model", "")
+        with self._lock:
+            # like Ollama, only the part after the prefix shared with this model's last prompt is evaluated
+            cached = len(os.path.commonprefix([prompt, self.last_prompt.get(model, "")]))
+            self.last_prompt[model] = prompt
+            self.calls[model] += 1
+            self.prompt_chars[model].append(len(prompt))
+            self.cached_chars[model].append(cached)
+
+        if body["messages"][-1].get("role") == "system":
+            # warm-up call: loads the model and its prompt prefix
+            content = {}
+        elif task.startswith("TASK: PLAN"):
+            time.sleep(self.latency["planner"])
+            request = re.search(r"actionable steps: '(.*)'$", task, re.M).group(1)
+            content = {"linuxcommand": self.plans.get(request, ["List files in current directory"]),
+                       "depends_on": self.dependencies.get(request)}
+        elif task.startswith("TASK: RECOVERY"):
+            time.sleep(self.latency["planner"])
+            step = re.search(r"- Failed step: (.*)", task).group(1).strip()
+            content = {"recovery_steps": self.recoveries.get(step, [])}
+        elif task.startswith("TASK: ALL COMMANDS"):
+            time.sleep(self.latency["generator"])
+            steps = re.findall(r"^\d+\. (.*?)(?:  \(command: .*\))?$",
+                               task.split("FULL PLAN:")[1].split("CURRENT CONTEXT:")[0], re.M)
+            content = {"linuxcommands": [self.commands.get(step, "echo ok") for step in steps]}
+        else:
+            time.sleep(self.latency["generator"])
+            step = re.search(r'Current step description: "(.*)"', task).group(1)
+            content = {"linuxcommand": self.commands.get(step, "echo ok")}
+
+        prompt_tokens = (len(prompt) - cached) // 4 + 1
+        return {
+            "model": model,
+            "created_at": "2025-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": json.dumps(content)},
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": len(json.dumps(content)) // 4 + 1,
+        }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[phase].append(time.perf_counter() - started)
+        return timed
+
+
+def run_benchmark(workload, iterations, planner_latency, generator_latency, exec_latency,
+                  install_latency, use_cache, verbose):
+    os.environ["OLLAMACONTROL_DISK_CACHE"] = "0"
+    fake_ollama = FakeOllama(workload, planner_latency, generator_latency)
+    os.environ["OLLAMA_HOST"] = fake_ollama.start()
+
+    # loaded up front (after OLLAMA_HOST is set) so the first timed request is not charged for it
+    import ollama  # noqa: F401
+    import main
+    import container_state
+    from Masterai import plan_cache
+    from Ollama_model import command_cache
+
+    timer = PhaseTimer()
+    main.linux_step_planning = timer.wrap("planning", main.linux_step_planning)
+    main.linux_command = timer.wrap("generation", main.linux_command)
+    main.linux_commands_batch = timer.wrap("generation", main.linux_commands_batch)
+    main.execute_step = timer.wrap("exec", main.execute_step)
+    main.attempt_error_recovery = timer.wrap("recovery", main.attempt_error_recovery)
+    for method in ("current", "snapshot", "refresh", "update"):
+        original = getattr(container_state.ContainerStateTracker, method)
+        setattr(container_state.ContainerStateTracker, method, timer.wrap("state probe", original))
+
+    request_times = []
+    successes = 0
+    execs = 0
+    try:
+        for iteration in range(iterations):
+            if not use_cache:
+                plan_cache.invalidate()
+                command_cache.invalidate()
+            container = FakeContainer(exec_latency, install_latency, name=f"bench{iteration}")
+            current_path = "/root"
+            messages = []
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                for item in workload:
+                    started = time.perf_counter()
+                    messages.append({"role": "user", "content": item["request"]})
+                    state = main.state_tracker(container).current(current_path)
+                    plan = main.linux_step_planning(item["request"], current_path, messages, state)
+                    if plan:
+                        success, current_path = main.execute_plan_with_recovery(
+                            container, plan["linuxcommand"], item["request"], current_path, [], messages, state,
+                            dependencies=plan.get("depends_on")
+                        )
+                        successes += success
+                    request_times.append(time.perf_counter() - started)
+            execs += container.exec_count
+    finally:
+        fake_ollama.stop()
+
+    return {
+        "requests": len(request_times),
+        "successes": successes,
+        "container_execs": execs,
+        "request": summarize(request_times),
+        "phases": {phase: summarize(values) for phase, values in timer.samples.items()},
+        "model_calls": dict(fake_ollama.calls),
+        "prompt_tokens": {model: summarize([c / 4 for c in chars], scale=1)
+                          for model, chars in fake_ollama.prompt_chars.items()},
+        "prompt_cached_share": {model: round(sum(fake_ollama.cached_chars[model]) / max(sum(chars), 1), 3)
+                                for model, chars in fake_ollama.prompt_chars.items()},
+    }
+
+
+def summarize(values, scale=1000):
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values) * scale, 2) if values else 0.0,
+        "p50": round(percentile(values, 50) * scale, 2),
+        "p90": round(percentile(values, 90) * scale, 2),
+        "p99": round(percentile(values, 99) * scale, 2),
+    }
+
+
+def print_report(report):
+    print(f"\n📊 {report['requests']} requests, {report['successes']} succeeded, "
+          f"{report['container_execs']} container execs")
+    print(f"{'phase':<14}{'count':>7}{'mean ms':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+    rows = [("request", report["request"])] + sorted(report["phases"].items())
+    for name, row in rows:
+        print(f"{name:<14}{row['count']:>7}{row['mean']:>10}{row['p50']:>10}{row['p90']:>10}{row['p99']:>10}")
+    print("\n🤖 Model calls:")
+    for model, count in sorted(report["model_calls"].items()):
+        tokens = report["prompt_tokens"][model]
+        print(f"  {model}: {count} calls, prompt ~{tokens['mean']:.0f} tokens mean, ~{tokens['p99']:.0f} p99, "
+              f"{report['prompt_cached_share'][model]:.0%} reusable from the previous prompt's prefix")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline with fake Ollama and Docker")
+    parser.add_argument("--workload", help="JSONL file, one {request, plan, commands} object per line")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--planner-latency", type=float, default=0.2, help="seconds per planner call")
+    parser.add_argument("--generator-latency", type=float, default=0.05, help="seconds per generator call")
+    parser.add_argument("--exec-latency", type=float, default=0.005, help="seconds per container exec")
+    parser.add_argument("--install-latency", type=float, default=0.05, help="seconds per apt/pip install")
+    parser.add_argument("--cache", action="store_true", help="keep plan/command caches across iterations")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args()
+
+    workload = DEFAULT_WORKLOAD
+    if args.workload:
+        with open(args.workload, encoding="utf-8") as f:
+            workload = [json.loads(line) for line in f if line.strip()]
+
+    report = run_benchmark(workload, args.iterations, args.planner_latency, args.generator_latency,
+                           args.exec_latency, args.install_latency, args.cache, args.verbose)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
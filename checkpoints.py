@@ -0,0 +1,278 @@
+import atexit
+import os
+import posixpath
+import re
+import shlex
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from container_state import simple_commands, FILE_VERBS, READ_ONLY_VERBS, SYSTEM_DIRS
+from tracing import traced, annotate
+
+USE_CHECKPOINTS = os.environ.get("OLLAMACONTROL_CHECKPOINTS", "1") != "0"
+CHECKPOINT_MAX_BYTES = int(os.environ.get("OLLAMACONTROL_CHECKPOINT_MAX_MB", "64")) * 1024 * 1024
+CHECKPOINT_CACHE_BYTES = int(os.environ.get("OLLAMACONTROL_CHECKPOINT_CACHE_MB", "512")) * 1024 * 1024
+
+# Where pip3 puts packages when running as root
+DIST_PACKAGES = "/usr/local/lib/python3*/dist-packages"
+PIP_VALUE_OPTIONS = {"-i", "--index-url", "--extra-index-url", "-f", "--find-links", "--trusted-host",
+                     "--timeout", "--retries", "--proxy", "--cache-dir", "--progress-bar"}
+# Options that install from files or into other places, so what changes cannot be told
+PIP_UNKNOWN_OPTIONS = {"-r", "--requirement", "-e", "--editable", "-t", "--target", "--prefix",
+                       "--root", "--user", "-c", "--constraint"}
+# Edit existing files in place; the value is how many leading positional arguments are not files
+IN_PLACE_VERBS = {"chmod": 1, "chown": 1, "chgrp": 1, "truncate": 0, "sed": 1}
+PIP_READ_ONLY = {"list", "show", "freeze", "check", "--version", "-V"}
+REDIRECTS = {">", ">>", ">|", "&>", "&>>"}
+
+
+def checkpoint_paths(command, current_path, run):
+    """Absolute paths a step may change, or None when they cannot be told (e.g. apt-get).
+
+    Paths ending in a * pattern stand for entries the step may create;
+    restoring removes whatever matches them.
+    """
+    commands = simple_commands(command)
+    if commands is None:
+        return None
+
+    paths, packages = set(), set()
+    for words, _ in commands:
+        while words and (re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[0]) or words[0] == "sudo"):
+            words = words[1:]
+
+        args = []
+        i = 0
+        while i < len(words):
+            if words[i] in REDIRECTS and i + 1 < len(words):
+                paths.add(words[i + 1])
+                i += 2
+                continue
+            args.append(words[i])
+            i += 1
+        if not args:
+            continue
+
+        verb = posixpath.basename(args[0])
+        pip_args = pip_arguments(args)
+        if pip_args is not None:
+            if pip_args[:1] and pip_args[0] in PIP_READ_ONLY:
+                continue
+            names = pip_packages(pip_args[1:]) if pip_args[:1] in (["install"], ["uninstall"]) else None
+            if names is None:
+                return None
+            packages.update(names)
+        elif verb in IN_PLACE_VERBS:
+            targets = edited_files(verb, args[1:])
+            if targets is None:
+                return None
+            paths.update(targets)
+        elif verb in FILE_VERBS:
+            paths.update(a for a in args[1:] if not a.startswith("-"))
+        elif verb not in READ_ONLY_VERBS:
+            return None
+
+    paths = {posixpath.normpath(posixpath.join(current_path, p)) for p in paths
+             if not p.isdigit() and not p.startswith("/dev/")}
+    if any(path == "/" or path.strip("/") in SYSTEM_DIRS or path == current_path for path in paths):
+        # whole system directories, or the working tree itself, are too big to copy before every step
+        return None
+    if packages:
+        paths.update(package_paths(packages, run))
+    return sorted(paths) or None
+
+
+def pip_arguments(args):
+    """pip's own arguments when args run pip, otherwise None"""
+    if posixpath.basename(args[0]) in ("pip", "pip3"):
+        return args[1:]
+    if posixpath.basename(args[0]) in ("python", "python3") and args[1:3] == ["-m", "pip"]:
+        return args[3:]
+    return None
+
+
+def pip_packages(args):
+    """Project names pip is asked to install or remove, or None when they cannot be told"""
+    names = set()
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+            continue
+        option = arg.split("=", 1)[0]
+        if option in PIP_UNKNOWN_OPTIONS:
+            return None
+        if option in PIP_VALUE_OPTIONS:
+            skip = "=" not in arg
+            continue
+        if arg.startswith("-"):
+            continue
+        name = re.split(r"[\[<>=!~;@ ]", arg, 1)[0]
+        if not re.match(r"^[A-Za-z0-9][A-Za-z0-9._-]*$", name):
+            # paths, URLs and archives
+            return None
+        names.add(name)
+    return names
+
+
+def edited_files(verb, args):
+    """Files an in-place editor rewrites, or None when its arguments cannot be read"""
+    if verb == "sed" and not any(a.startswith("-i") or a.startswith("--in-place") for a in args):
+        return set()
+    positional, scripts = [], 0
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+            continue
+        if arg in ("-e", "--expression", "-f", "--file", "-s", "--size", "--reference"):
+            scripts += arg in ("-e", "--expression", "-f", "--file")
+            skip = True
+            continue
+        if arg.startswith("-") and not (verb == "chmod" and re.match(r"^-[rwxXst]+$", arg)):
+            continue
+        positional.append(arg)
+    leading = 0 if scripts else IN_PLACE_VERBS[verb]
+    return set(positional[leading:])
+
+
+def package_paths(names, run):
+    """Existing dist-packages entries for names, plus patterns for the ones pip may create"""
+    patterns = set()
+    for name in names:
+        for variant in {name, name.lower(), re.sub(r"[-.]+", "_", name), re.sub(r"[-.]+", "_", name).lower()}:
+            patterns.update([variant, f"{variant}.py", f"{variant}-*.dist-info", f"{variant}-*.egg-info"])
+    globs = " ".join(f"{DIST_PACKAGES}/{p}" for p in sorted(patterns))
+    script = (f"for p in {DIST_PACKAGES}; do [ -d \"$p\" ] && printf 'D\\t%s\\n' \"$p\"; done; "
+              f"for p in {globs}; do [ -e \"$p\" ] && printf 'E\\t%s\\n' \"$p\"; done")
+    _, out, _ = run(script)
+
+    paths = set()
+    for line in out.splitlines():
+        kind, _, path = line.partition("\t")
+        if kind == "E":
+            paths.add(path)
+        elif kind == "D":
+            paths.update(f"{path}/{p}" for p in patterns)
+    return paths
+
+
+def shell_path(path):
+    """path quoted for the shell, leaving a trailing * pattern free to match"""
+    directory, name = posixpath.split(path)
+    if "*" in name:
+        return f"{shlex.quote(directory)}/{name}"
+    return shlex.quote(path)
+
+
+class CheckpointStore:
+    """Tar snapshots of the paths a step may change, spilled to disk within a byte budget"""
+
+    def __init__(self, max_bytes=CHECKPOINT_CACHE_BYTES, max_checkpoint_bytes=CHECKPOINT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_checkpoint_bytes = max_checkpoint_bytes
+        self.directory = None
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @traced("checkpoint")
+    def create(self, container, paths):
+        checkpoint = {"id": uuid.uuid4().hex[:12], "container": getattr(container, "id", id(container)),
+                      "paths": {}, "bytes": 0}
+        try:
+            for path in paths:
+                checkpoint["paths"][path] = self._save(container, path, checkpoint)
+        except Exception as e:
+            self._delete(checkpoint)
+            print(f"⚠️ No checkpoint: {e}")
+            return None
+
+        annotate(paths=len(paths), bytes=checkpoint["bytes"])
+        with self._lock:
+            self._entries[checkpoint["id"]] = checkpoint
+            self._total += checkpoint["bytes"]
+            self._evict()
+        return checkpoint
+
+    @traced("rollback")
+    def restore(self, container, checkpoint, run):
+        with self._lock:
+            if checkpoint["id"] not in self._entries:
+                print("⚠️ Checkpoint was evicted, cannot roll back")
+                return False
+            self._entries.move_to_end(checkpoint["id"])
+
+        paths = list(checkpoint["paths"])
+        exit_code, _, err = run("rm -rf -- " + " ".join(shell_path(p) for p in paths))
+        if exit_code != 0:
+            print(f"⚠️ Rollback failed: {err}")
+            return False
+        try:
+            for path, filename in checkpoint["paths"].items():
+                if filename is None:
+                    continue
+                with open(filename, "rb") as f:
+                    if not container.put_archive(posixpath.dirname(path) or "/", f.read()):
+                        raise RuntimeError(f"put_archive rejected {path}")
+        except Exception as e:
+            print(f"⚠️ Rollback failed: {e}")
+            return False
+        return True
+
+    def discard(self, checkpoint):
+        with self._lock:
+            if self._entries.pop(checkpoint["id"], None):
+                self._total -= checkpoint["bytes"]
+        self._delete(checkpoint)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+            directory, self.directory = self.directory, None
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _save(self, container, path, checkpoint):
+        import docker
+        if "*" in posixpath.basename(path):
+            return None
+        try:
+            stream, _ = container.get_archive(path)
+        except docker.errors.NotFound:
+            # restoring means removing whatever the step created here
+            return None
+
+        with self._lock:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="ollamacontrol-checkpoints-")
+        filename = os.path.join(self.directory, f"{checkpoint['id']}-{len(checkpoint['paths'])}.tar")
+        checkpoint["paths"][path] = filename
+        with open(filename, "wb") as f:
+            for chunk in stream:
+                checkpoint["bytes"] += len(chunk)
+                if checkpoint["bytes"] > self.max_checkpoint_bytes:
+                    raise RuntimeError(f"{path} is larger than {self.max_checkpoint_bytes // (1024 * 1024)} MB")
+                f.write(chunk)
+        return filename
+
+    def _delete(self, checkpoint):
+        for filename in checkpoint["paths"].values():
+            if filename:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def _evict(self):
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            _, oldest = self._entries.popitem(last=False)
+            self._total -= oldest["bytes"]
+            self._delete(oldest)
+
+
+checkpoints = CheckpointStore()
+atexit.register(checkpoints.clear)
@@ -0,0 +1,287 @@
+import os
+import posixpath
+import re
+import shlex
+import shutil
+import subprocess
+from collections import Counter
+from container_state import simple_commands, shell_tokens, PACKAGE_COMMAND, READ_ONLY_VERBS, OPERATORS
+from file_writes import is_write_action
+from recovery_kb import install_commands, ENSURE_PIP, PYTHON_TOOLS
+from state_index import state_index
+from tracing import traced, annotate
+
+USE_COMMAND_CHECK = os.environ.get("OLLAMACONTROL_COMMAND_CHECK", "1") != "0"
+BASH = shutil.which("bash")
+SYNTAX_CHECK_TIMEOUT = 5
+# Names models reach for that Ubuntu only ships under another name
+ALTERNATIVES = {"python": "python3", "pip": "pip3"}
+# Words that can stand before a command without being one
+LEADING_WORDS = {"if", "then", "else", "elif", "do", "while", "until", "!", "time", "{", "sudo"}
+# Past these the commands may not run, or run in a loop or subshell, so paths are not followed
+COMPOUND_WORDS = {"if", "then", "else", "elif", "fi", "do", "done", "while", "until", "for", "case",
+                  "esac", "select", "function", "{", "}", "!", "[["}
+PUNCTUATION = "();<>|&"
+REDIRECTS = {">", ">>", ">|", "&>"}
+
+check_hits = Counter()
+
+
+@traced("command_check")
+def check_command(cmd, current_path, container_state):
+    """Catch what would obviously fail before cmd runs.
+
+    Returns (command, prerequisites, problem): the command with the mistakes
+    that have a known fix corrected, commands that must run before it, and
+    why it should be regenerated instead (it does not parse, or cds into a
+    directory that does not exist).
+    """
+    if not USE_COMMAND_CHECK or is_write_action(cmd):
+        return cmd, [], None
+
+    error = syntax_error(cmd)
+    if error:
+        check_hits["syntax"] += 1
+        annotate(problem="syntax")
+        return cmd, [], f"bash -n: {error}"
+
+    index = state_index(container_state)
+    if index is None:
+        return cmd, [], None
+
+    cmd = fix_command_names(cmd, index)
+    cmd, prerequisites, problem = find_prerequisites(cmd, current_path, index)
+    if problem:
+        annotate(problem="cd_missing")
+        return cmd, [], problem
+    if prerequisites:
+        annotate(prerequisites=len(prerequisites))
+    return cmd, prerequisites, None
+
+
+def syntax_error(cmd):
+    """bash -n's complaint about cmd; it only parses, so it runs here instead of in the container"""
+    if not BASH:
+        return None
+    try:
+        result = subprocess.run([BASH, "-n"], input=cmd, capture_output=True, text=True,
+                                timeout=SYNTAX_CHECK_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode == 0:
+        return None
+    # the local bash's path and stdin line numbers mean nothing to the model
+    error = re.sub(r"^\S*bash: (?:line \d+: )?", "", result.stderr.strip(), flags=re.MULTILINE)
+    return error or f"bash -n exited with {result.returncode}"
+
+
+def fix_command_names(cmd, index):
+    """Drop sudo and swap python/pip for python3/pip3 when only the latter exist.
+
+    Only unquoted command words are rewritten; sudo with options is left alone.
+    """
+    if not index.executables:
+        return cmd
+    commands = command_words(cmd)
+    if not commands:
+        return cmd
+
+    edits = []
+    for words in commands:
+        i = 0
+        while i < len(words) and (words[i][0] in LEADING_WORDS - {"sudo"}
+                                  or re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[i][0])):
+            i += 1
+        if i < len(words) and words[i][0] == "sudo" and not index.has_executable("sudo"):
+            if i + 1 == len(words) or words[i + 1][0].startswith("-") or not plain(cmd, words[i]):
+                continue
+            edits.append((words[i][1], words[i + 1][1], ""))
+            check_hits["sudo"] += 1
+            i += 1
+        if i == len(words) or not plain(cmd, words[i]):
+            continue
+        alternative = ALTERNATIVES.get(words[i][0])
+        if alternative and not index.has_executable(words[i][0]) and index.has_executable(alternative):
+            edits.append((words[i][1], words[i][2], alternative))
+            check_hits["alternative"] += 1
+
+    for start, end, text in reversed(edits):
+        cmd = cmd[:start] + text + cmd[end:]
+    return cmd
+
+
+def command_words(cmd):
+    """The words of each simple command as (word, start, end), end excluded, None when they cannot be placed"""
+    tokens = shell_tokens(cmd)
+    spans = token_spans(cmd)
+    if tokens is None or spans is None or len(tokens) != len(spans):
+        return None
+
+    commands, simple = [], []
+    for token, (start, end) in zip(tokens + [";"], spans + [(len(cmd), len(cmd))]):
+        if token in OPERATORS:
+            commands.append(simple)
+            simple = []
+        else:
+            simple.append((token, start, end))
+    return commands
+
+
+def token_spans(cmd):
+    """Where each token shlex finds in cmd starts and ends"""
+    spans = []
+    i = 0
+    while i < len(cmd):
+        if cmd[i].isspace():
+            i += 1
+        elif cmd[i] == "#":
+            newline = cmd.find("\n", i)
+            i = len(cmd) if newline == -1 else newline
+        elif cmd[i] in PUNCTUATION:
+            start = i
+            while i < len(cmd) and cmd[i] in PUNCTUATION:
+                i += 1
+            spans.append((start, i))
+        else:
+            start = i
+            while i < len(cmd) and not cmd[i].isspace() and cmd[i] not in PUNCTUATION:
+                if cmd[i] == "\\":
+                    i += 2
+                elif cmd[i] in "'\"":
+                    close = i + 1
+                    while close < len(cmd) and cmd[close] != cmd[i]:
+                        close += 2 if cmd[i] == '"' and cmd[close] == "\\" else 1
+                    if close >= len(cmd):
+                        return None
+                    i = close + 1
+                else:
+                    i += 1
+            spans.append((start, min(i, len(cmd))))
+    return spans
+
+
+def plain(cmd, word):
+    """Whether a word is written without quotes or escapes"""
+    text, start, end = word
+    return cmd[start:end] == text
+
+
+def find_prerequisites(cmd, current_path, index):
+    """Walk the command line tracking its directory.
+
+    Returns the command with cd targets fixed, what to run first, and why it
+    should be regenerated when it cds into a directory that does not exist.
+    """
+    commands = simple_commands(cmd)
+    if not commands:
+        return cmd, [], None
+
+    prerequisites = []
+    cwd, created = current_path, set()
+    check_commands = True
+    # after a failed step the index may not show what the container holds
+    check_paths = not index.stale
+    for words, operator in commands:
+        if operator in ("(", ")") or (words and words[0] in COMPOUND_WORDS):
+            # a subshell, condition or loop decides whether and where what follows runs
+            check_paths = False
+        while words and (words[0] in LEADING_WORDS or re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[0])):
+            words = words[1:]
+        if not words:
+            continue
+        # a failure followed by || is handled by the command itself
+        guarded = operator == "||"
+        verb = words[0]
+
+        if check_commands and not guarded:
+            prerequisites += missing_command(words, index)
+        if PACKAGE_COMMAND.search(f" {' '.join(words)} ") or verb in ("export", "source", "."):
+            # whatever it installs or puts on PATH is not in the index yet
+            check_commands = False
+
+        if not check_paths:
+            continue
+        if verb == "cd":
+            target = words[1] if len(words) > 1 else None
+            if not target or re.search(r"[$~*?`]", target) or target.startswith("-"):
+                check_paths = False
+                continue
+            full = posixpath.normpath(posixpath.join(cwd, target))
+            if full in created or index.exists(full, "d"):
+                cwd = full
+                continue
+            inside = full.startswith(current_path.rstrip("/") + "/")
+            if guarded or index.truncated or not index.covers(full) or not inside:
+                # outside the working tree a miss may only mean the index has not caught up
+                check_paths = False
+                continue
+            candidates = [p for p in index.named(posixpath.basename(full), "d")
+                          if p.startswith(current_path.rstrip("/") + "/")]
+            if len(candidates) == 1:
+                # the model got the name right but not where it lives
+                fixed = posixpath.relpath(candidates[0], cwd)
+                cmd = re.sub(rf"(\bcd\s+){re.escape(target)}(?=\s|$|[;&|)])",
+                             lambda m: m.group(1) + shlex.quote(fixed), cmd, count=1)
+                check_hits["cd_path"] += 1
+                cwd = candidates[0]
+            else:
+                # creating it would run the rest of the step in an empty directory
+                check_hits["cd_missing"] += 1
+                return cmd, [], f"cd: {target}: no such directory under {cwd}"
+            continue
+
+        for i, word in enumerate(words[:-1]):
+            target = words[i + 1]
+            if word not in REDIRECTS or "/" not in target or target.startswith("/dev/") or "$" in target:
+                continue
+            parent = posixpath.dirname(posixpath.normpath(posixpath.join(cwd, target)))
+            if parent in created or index.exists(parent, "d") or not index.covers(parent) or index.truncated:
+                continue
+            prerequisites.append(f"mkdir -p {shlex.quote(relative_to(parent, current_path))}")
+            check_hits["redirect_missing"] += 1
+            created.add(parent)
+
+        if verb == "mkdir":
+            for arg in (a for a in words[1:] if not a.startswith("-")):
+                path = posixpath.normpath(posixpath.join(cwd, arg))
+                while path not in ("/", "") and path not in created:
+                    created.add(path)
+                    path = posixpath.dirname(path)
+        elif verb not in READ_ONLY_VERBS:
+            # it may create or move anything, so later paths cannot be judged from the index
+            check_paths = False
+
+    return cmd, list(dict.fromkeys(prerequisites)), None
+
+
+def missing_command(words, index):
+    """Commands that install what words[0] (or the module run with python3 -m) needs but lacks"""
+    verb = words[0]
+    if "/" in verb:
+        # scripts run by path are not looked up on PATH
+        return []
+    module = words[2] if verb in ("python3", "python") and len(words) > 2 and words[1] == "-m" else None
+
+    name = "pip3" if module == "pip" else verb
+    if not index.has_executable(name):
+        commands = install_commands(name)
+    elif index.executables and module in PYTHON_TOOLS and not index.has_python_package(module):
+        commands = install_commands(module)
+    else:
+        return []
+    if not commands:
+        return []
+    check_hits["missing_command"] += 1
+    return [c for c in commands if not (c == ENSURE_PIP and index.has_executable("pip3"))]
+
+
+def relative_to(path, current_path):
+    if path == current_path:
+        return "."
+    if path.startswith(current_path.rstrip("/") + "/"):
+        return posixpath.relpath(path, current_path)
+    return path
+
+
+def check_stats():
+    return dict(check_hits)
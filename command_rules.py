@@ -0,0 +1,155 @@
+import re
+import shlex
+from collections import Counter
+from state_index import has_entry
+
+PACKAGE = r"[A-Za-z0-9][A-Za-z0-9._+\-]*(?:[=<>!~]=?[A-Za-z0-9.*]+)?"
+PACKAGE_LIST = rf"{PACKAGE}(?:\s*(?:,|\band\b|&)\s*{PACKAGE})*"
+PATH = r"[A-Za-z0-9_./~\-]+"
+KIND = r"(?:python |pip )?(?:package|library|module)s?"
+# Words planners use for a role rather than a package name; steps naming these go to the model
+ROLE_WORDS = {"python", "python3", "pip", "pip3", "required", "requirement", "requirements",
+              "dependencies", "dependency", "deps", "packages", "package", "libraries", "library",
+              "modules", "module", "system", "necessary", "needed", "all", "project", "the"}
+HOME = "/root"
+
+rule_hits = Counter()
+llm_fallbacks = 0
+
+
+def _packages(text):
+    """Package names in text, or None when one of them is a role word like "requirements" """
+    packages = [p for p in re.split(r"\s*(?:,|\band\b|&)\s*", text) if p]
+    if any(re.split(r"[=<>!~]", p, 1)[0].lower() in ROLE_WORDS for p in packages):
+        return None
+    return packages
+
+
+def _pip_install(match, container_state):
+    packages = _packages(match["packages"])
+    if not packages:
+        return None
+    return "pip3 install " + " ".join(shlex.quote(p) for p in packages)
+
+
+def _apt_install(match, container_state):
+    packages = _packages(match["packages"])
+    if not packages:
+        return None
+    return "DEBIAN_FRONTEND=noninteractive apt-get install -y " + " ".join(shlex.quote(p) for p in packages)
+
+
+def _navigate(match, container_state):
+    path = match["path"].rstrip("/") or "/"
+    # handle_cd quotes its target, so the shell would not expand ~
+    if path == "~" or path.startswith("~/"):
+        path = HOME + path[1:]
+    elif path.startswith("~"):
+        return None
+    known = path.startswith(("/", "..")) or has_entry(container_state, path, "d")
+    # "Navigate to project directory" names a role, not a path; leave those to the model
+    if not known:
+        return None
+    return f"cd {path}"
+
+
+def _check_installed(match, container_state):
+    name = shlex.quote(match["name"])
+    return f"command -v {name} || pip3 show {name}"
+
+
+def _run_pytest(match, container_state):
+    path = match["path"]
+    if not path:
+        return "python3 -m pytest"
+    path = path.rstrip("/") or "/"
+    if not (path.endswith(".py") or has_entry(container_state, path, "f")):
+        path += "/"
+    return f"python3 -m pytest {shlex.quote(path)}"
+
+
+RULES = [
+    ("pip_install", rf"install (?:the )?(?:{KIND} )?(?P<packages>{PACKAGE_LIST})(?: {KIND})?"
+                    rf" (?:using|with|via) pip3?(?: instead of apt(?:-get)?)?", _pip_install),
+    ("apt_install", rf"install (?:the )?(?P<packages>{PACKAGE_LIST}) system packages?", _apt_install),
+    ("navigate", rf"(?:navigate|change directory|go|move|cd) (?:in)?to (?:the )?(?P<path>{PATH})"
+                 rf"(?: directory| folder)?", _navigate),
+    ("check_installed", rf"check (?:if|whether) (?P<name>{PACKAGE}) is installed", _check_installed),
+    ("run_pytest", rf"run (?:the )?(?:tests with )?pytest(?: tests)?(?: (?:on|in|for) (?:the )?"
+                   rf"(?P<path>{PATH})(?: directory| folder)?)?", _run_pytest),
+]
+
+COMPILED_RULES = [(name, re.compile(rf"^{pattern}$", re.IGNORECASE), build)
+                  for name, pattern, build in RULES]
+
+
+def translate_step(step, container_state=None):
+    """Turn a templated plan step into a shell command without asking the model"""
+    global llm_fallbacks
+
+    text = " ".join(step.strip().rstrip(".").split())
+    for name, pattern, build in COMPILED_RULES:
+        match = pattern.match(text)
+        if not match:
+            continue
+        cmd = build(match, container_state)
+        if cmd:
+            rule_hits[name] += 1
+            return name, cmd
+
+    llm_fallbacks += 1
+    return None, None
+
+
+INSTALL_STEPS = {
+    "pip_install": "Install {} using pip3",
+    "apt_install": "Install {} system packages",
+}
+
+
+def coalesce_installs(steps, depends_on=None):
+    """Merge runs of consecutive pip or apt install steps into one step per package manager.
+
+    depends_on is renumbered for the merged steps when it is a list of
+    lists; anything else is returned unchanged.
+    """
+    patterns = {name: pattern for name, pattern, _ in COMPILED_RULES if name in INSTALL_STEPS}
+    groups = []
+    for index, step in enumerate(steps):
+        text = " ".join(step.strip().rstrip(".").split())
+        kind, packages = None, None
+        for name, pattern in patterns.items():
+            match = pattern.match(text)
+            packages = _packages(match["packages"]) if match else None
+            if packages:
+                kind = name
+                break
+
+        if kind and groups and groups[-1]["kind"] == kind:
+            groups[-1]["members"].append(index)
+            groups[-1]["packages"].extend(p for p in packages if p not in groups[-1]["packages"])
+        else:
+            groups.append({"kind": kind, "members": [index], "packages": packages or [], "step": step})
+
+    if len(groups) == len(steps):
+        return list(steps), depends_on
+
+    merged = [INSTALL_STEPS[g["kind"]].format(", ".join(g["packages"])) if len(g["members"]) > 1
+              else g["step"] for g in groups]
+
+    valid = isinstance(depends_on, list) and len(depends_on) == len(steps) and all(
+        isinstance(entry, list) and all(isinstance(n, int) and 1 <= n <= len(steps) for n in entry)
+        for entry in depends_on)
+    if not valid:
+        return merged, depends_on
+
+    group_of = {index: number for number, g in enumerate(groups, 1) for index in g["members"]}
+    remapped = []
+    for number, g in enumerate(groups, 1):
+        parents = {group_of[n - 1] for index in g["members"] for n in depends_on[index]}
+        remapped.append(sorted(parents - {number}))
+    return merged, remapped
+
+
+def rule_stats():
+    return {"hits": dict(rule_hits), "llm_fallbacks": llm_fallbacks}
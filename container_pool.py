@@ -0,0 +1,83 @@
+import threading
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ContainerPool:
+    """Keeps a few started containers ready so a new session doesn't wait on docker run"""
+
+    def __init__(self, client, image, size, run_options=None):
+        self.client = client
+        self.image = image
+        self.size = size
+        self.run_options = run_options or {}
+        self._ready = []
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._closed = False
+
+    def acquire(self):
+        with self._lock:
+            container = self._ready.pop(0) if self._ready else None
+
+        if container is None:
+            container = self._start()
+        self.refill()
+        return container
+
+    def refill(self):
+        with self._lock:
+            if self._refilling or self._closed or len(self._ready) >= self.size:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._ready = self._ready, []
+        for container in idle:
+            try:
+                container.stop()
+            except Exception as e:
+                print(f"⚠️ Error stopping pooled container: {e}")
+
+    def _start(self):
+        return self.client.containers.run(
+            self.image, "sleep infinity", tty=True, detach=True, remove=True, **self.run_options
+        )
+
+    def _refill(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._closed or len(self._ready) >= self.size:
+                        return
+                container = self._start()
+                with self._lock:
+                    if self._closed:
+                        break
+                    self._ready.append(container)
+            container.stop()
+        except Exception as e:
+            print(f"⚠️ Warm pool refill failed: {e}")
+        finally:
+            with self._lock:
+                self._refilling = False
+
+
+def get_pool(client, image, size, run_options=None):
+    with _pools_lock:
+        pool = _pools.get(image)
+        if pool is None:
+            pool = _pools[image] = ContainerPool(client, image, size, run_options)
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,319 @@
+import os
+import posixpath
+import re
+import shlex
+import threading
+from tracing import traced, annotate
+from state_index import StateIndex, package_key
+
+STATE_MAX_DEPTH = 3
+STATE_MAX_ENTRIES = 500
+# Cap on entries one probe adds to the index, so a huge tree cannot stall a step
+INDEX_MAX_ENTRIES = int(os.environ.get("OLLAMACONTROL_INDEX_MAX_ENTRIES", "50000"))
+ENTRY_FORMAT = "%y\\t%s\\t%T@\\t%p\\n"
+
+# Pruned when the walk starts at the filesystem root
+SYSTEM_DIRS = ["proc", "sys", "dev", "run", "boot", "usr", "lib", "lib32", "lib64",
+               "libx32", "bin", "sbin", "etc", "var", "snap"]
+
+PACKAGE_COMMAND = re.compile(r"(^|[\s;&|])(pip3?|python3?\s+-m\s+pip|apt-get|apt|dpkg)\s")
+FILE_VERBS = {"mkdir", "touch", "rm", "rmdir", "cp", "mv", "ln", "tee", "install", "write_files"}
+READ_ONLY_VERBS = {"ls", "cat", "pwd", "which", "echo", "printf", "grep", "head", "tail",
+                   "wc", "whoami", "date", "env", "printenv", "find", "stat", "file", "du",
+                   "df", "uname", "id", "true", "false", "test", "[", "sed", "chmod",
+                   "chown", "command", "type", "cd", "export", "diff", "sort", "uniq",
+                   "pip3", "pip", "apt-get", "apt", "dpkg"}
+OPERATORS = {";", "&&", "||", "|", "&", "(", ")"}
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+class ContainerStateTracker:
+    """Keeps an index of the container's files and packages current with one probe per step.
+
+    The first probe walks the whole working tree; later steps re-walk only the
+    paths a command touches, or ask find for what changed since the last probe.
+    """
+
+    def __init__(self, run):
+        self._run = run
+        self.path = None
+        self.index = StateIndex(pruned=SYSTEM_DIRS)
+        self._stale = False
+
+    def current(self, current_path):
+        if self._stale or not self.index.covers(current_path):
+            return self.refresh(current_path)
+        self.path = current_path
+        return self.state()
+
+    @traced("state_snapshot")
+    def snapshot(self, current_path):
+        script = "; ".join([self._clock_script(), self._walk_script([current_path]),
+                            self._packages_script()])
+        _, out, _ = self._run(script, current_path)
+        probe = self._parse(out)
+
+        self.index.add_root(current_path)
+        for path, kind, size, mtime in probe["entries"]:
+            self.index.add(path, kind, size, mtime)
+        self.index.truncated = len(probe["entries"]) >= INDEX_MAX_ENTRIES
+        self.index.probed_at = probe["clock"]
+        self._set_packages(probe)
+        self.path = current_path
+        self._stale = False
+        self.index.stale = False
+        annotate(entries=len(self.index.entries))
+        return self.state()
+
+    @traced("state_refresh")
+    def refresh(self, current_path, packages=True):
+        """Bring the index up to date with whatever changed since the last probe.
+
+        Packages are re-listed only when packages is true or the state is stale.
+        """
+        if not self.index.covers(current_path) or self.index.probed_at is None:
+            return self.snapshot(current_path)
+
+        packages = packages or self._stale
+        parts = [self._clock_script(),
+                 self._walk_script(self.index.roots, newer_than=self.index.probed_at)]
+        if packages:
+            parts.append(self._packages_script())
+        _, out, _ = self._run("; ".join(parts), current_path)
+        probe = self._parse(out)
+        changed_dirs = []
+        for path, kind, size, mtime in probe["entries"]:
+            if kind == "d" and self.index.exists(path, "d"):
+                # a directory's mtime moves exactly when entries are added, removed or renamed in it
+                if self.index.entries[path][2] != mtime:
+                    changed_dirs.append(path)
+            else:
+                self.index.remove_tree(path)
+            self.index.add(path, kind, size, mtime)
+
+        if changed_dirs:
+            listing = " ".join(shlex.quote(p) for p in changed_dirs)
+            _, out, _ = self._run(f"find {listing} -mindepth 1 -maxdepth 1 -printf '{ENTRY_FORMAT}' 2>/dev/null",
+                                  current_path)
+            listed = self._parse(out)["entries"]
+            present = {path for path, _, _, _ in listed}
+            for directory in changed_dirs:
+                for name in self.index.listdir(directory):
+                    if posixpath.join(directory, name) not in present:
+                        self.index.remove_tree(posixpath.join(directory, name))
+            moved_in = [path for path, kind, _, _ in listed if kind == "d" and not self.index.exists(path)]
+            for path, kind, size, mtime in listed:
+                self.index.add(path, kind, size, mtime)
+            if moved_in:
+                # moved or extracted directories keep their old change times, so walk them whole
+                self._rewalk(moved_in, current_path)
+
+        self.index.probed_at = probe["clock"]
+        if packages:
+            self._set_packages(probe)
+        self.path = current_path
+        self._stale = False
+        self.index.stale = False
+        annotate(changed=len(probe["entries"]))
+        return self.state()
+
+    @traced("state_update")
+    def update(self, command, current_path):
+        if self._stale or not self.index.covers(current_path):
+            return self.refresh(current_path)
+        self.path = current_path
+
+        refresh_packages = bool(PACKAGE_COMMAND.search(f" {command} "))
+        targets = touched_paths(command, current_path)
+        if targets is None:
+            return self.refresh(current_path, packages=refresh_packages)
+
+        # paths outside the index are not tracked; new ones are walked from their first unindexed parent
+        paths = set()
+        for path in (t for t in targets if self.index.covers(t)):
+            while (path != "/" and self.index.covers(posixpath.dirname(path))
+                   and not self.index.exists(posixpath.dirname(path))):
+                path = posixpath.dirname(path)
+            paths.add(path)
+        targets = sorted(paths)
+        if not targets and not refresh_packages:
+            return self.state()
+
+        if targets:
+            self._rewalk(targets, current_path, packages=refresh_packages)
+        else:
+            _, out, _ = self._run(self._packages_script(), current_path)
+            self._set_packages(self._parse(out))
+        return self.state()
+
+    def invalidate(self):
+        self._stale = True
+        self.index.stale = True
+
+    def state(self):
+        listed = sorted(self.index.walk(self.path, STATE_MAX_DEPTH))[:STATE_MAX_ENTRIES]
+        return {
+            "directories": [p for p, kind in listed if kind == "d"],
+            "files": [p for p, kind in listed if kind == "f"],
+            "python_packages": sorted(self.index.python_packages.values()),
+            # ignored by state_fingerprint; for lookups beyond the lists above
+            "path": self.path,
+            "index": self.index
+        }
+
+    def _rewalk(self, paths, current_path, packages=False):
+        # the parents too: creating or removing the paths changed their mtimes
+        parents = sorted({posixpath.dirname(path) for path in paths} - set(paths))
+        parts = [self._walk_script(paths),
+                 f"find {' '.join(shlex.quote(p) for p in parents)} -maxdepth 0 -printf '{ENTRY_FORMAT}' 2>/dev/null"]
+        if packages:
+            parts.append(self._packages_script())
+        _, out, _ = self._run("; ".join(parts), current_path)
+        probe = self._parse(out)
+        for path in paths:
+            self.index.remove_tree(path)
+        for path, kind, size, mtime in probe["entries"]:
+            self.index.add(path, kind, size, mtime)
+        if packages:
+            self._set_packages(probe)
+
+    def _set_packages(self, probe):
+        self.index.python_packages = {package_key(name): name for name in probe["python_packages"]}
+        self.index.system_packages = set(probe["system_packages"])
+        self.index.executables = set(probe["executables"])
+
+    def _clock_script(self):
+        return "date '+T%t%s'"
+
+    def _walk_script(self, roots, newer_than=None):
+        # -newerct rather than mtime: extracting or moving files keeps their mtime but not their ctime
+        newer = f"-newerct @{int(newer_than) - 1} " if newer_than else ""
+        walks = []
+        for root in roots:
+            prune = ""
+            if root == "/":
+                paths = " -o ".join(f"-path /{d}" for d in SYSTEM_DIRS)
+                prune = f"\\( {paths} \\) -prune -o "
+            walks.append(f"find {shlex.quote(root)} {prune}{newer}-printf '{ENTRY_FORMAT}' 2>/dev/null "
+                         f"| head -n {INDEX_MAX_ENTRIES}")
+        return "; ".join(walks)
+
+    def _packages_script(self):
+        return ("command -v pip3 >/dev/null 2>&1 && pip3 list --format=freeze "
+                "--disable-pip-version-check 2>/dev/null | sed 's/^/P\\t/'; "
+                "dpkg-query -W -f='${Package}\\n' 2>/dev/null | sed 's/^/A\\t/'; "
+                "compgen -c 2>/dev/null | sed 's/^/X\\t/'")
+
+    def _parse(self, out):
+        probe = {"entries": [], "python_packages": [], "system_packages": [], "executables": [],
+                 "clock": None}
+        for line in out.split('\n'):
+            fields = line.split('\t', 3)
+            if len(fields) == 4 and len(fields[0]) == 1:
+                kind, size, mtime, path = fields
+                try:
+                    probe["entries"].append((posixpath.normpath(path), kind, int(size), float(mtime)))
+                except ValueError:
+                    continue
+            elif len(fields) == 2 and fields[0] == "P" and '==' in fields[1]:
+                probe["python_packages"].append(fields[1].split('==')[0].lower())
+            elif len(fields) == 2 and fields[0] == "A" and fields[1]:
+                probe["system_packages"].append(fields[1].split(':')[0].lower())
+            elif len(fields) == 2 and fields[0] == "X" and fields[1]:
+                probe["executables"].append(fields[1])
+            elif len(fields) == 2 and fields[0] == "T" and fields[1].isdigit():
+                probe["clock"] = float(fields[1])
+        return probe
+
+
+def shell_tokens(command):
+    """Words and operators of a command line with quotes removed, None when it does not lex"""
+    if not isinstance(command, str):
+        # shlex reads stdin when handed None
+        return None
+    try:
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        return list(lexer)
+    except ValueError:
+        return None
+
+
+def simple_commands(command):
+    """(words, operator after them) for each simple command in a command line, None when it does not lex"""
+    tokens = shell_tokens(command)
+    if tokens is None:
+        return None
+
+    commands, simple = [], []
+    for token in tokens + [";"]:
+        if token not in OPERATORS:
+            simple.append(token)
+            continue
+        commands.append((simple, token))
+        simple = []
+    return commands
+
+
+def touched_paths(command, current_path):
+    """Absolute paths a command may create or remove.
+
+    Targets under current_path are reported as their top-level entry there,
+    others as the path itself. Returns [] when the command cannot change
+    any listing and None when it cannot be told, in which case the caller
+    should re-walk everything.
+    """
+    commands = simple_commands(command)
+    if commands is None:
+        return None
+
+    targets = set()
+    for words, _ in commands:
+        while words and (re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[0]) or words[0] == "sudo"):
+            words = words[1:]
+        if not words:
+            continue
+
+        args = []
+        i = 0
+        while i < len(words):
+            if words[i] in (">", ">>", ">|", "&>") and i + 1 < len(words):
+                targets.add(words[i + 1])
+                i += 2
+                continue
+            args.append(words[i])
+            i += 1
+
+        verb = posixpath.basename(args[0]) if args else ""
+        if verb in FILE_VERBS:
+            targets.update(a for a in args[1:] if not a.startswith('-'))
+        elif verb and verb not in READ_ONLY_VERBS:
+            return None
+
+    paths = set()
+    for target in targets:
+        if target.isdigit() or target == "/dev/null":
+            continue
+        if target.startswith("~") or "$" in target:
+            # expanded by the shell, so where it points is not known here
+            return None
+        full = posixpath.normpath(posixpath.join(current_path, target))
+        rel = posixpath.relpath(full, current_path)
+        if rel == "." or full == "/":
+            return None
+        if rel.startswith(".."):
+            paths.add(full)
+        else:
+            paths.add(posixpath.join(current_path, rel.split("/", 1)[0]))
+    return sorted(paths)
+
+
+def get_tracker(container, run):
+    key = getattr(container, "id", id(container))
+    with _trackers_lock:
+        tracker = _trackers.get(key)
+        if tracker is None:
+            tracker = _trackers[key] = ContainerStateTracker(run)
+        return tracker
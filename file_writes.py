@@ -0,0 +1,106 @@
+import io
+import posixpath
+import shlex
+import tarfile
+import time
+
+DEFAULT_MODE = "644"
+
+
+def parse_write_action(data):
+    """{"write_files": [{"path", "content", "mode"}]} from model output, or None when malformed"""
+    files = data.get("write_files") if isinstance(data, dict) else None
+    if isinstance(files, dict):
+        files = [files]
+    if not isinstance(files, list) or not files:
+        return None
+
+    normalized = []
+    for entry in files:
+        if not isinstance(entry, dict):
+            return None
+        path, content = entry.get("path"), entry.get("content", "")
+        mode = parse_mode(entry.get("mode"))
+        if not isinstance(path, str) or not path.strip() or not isinstance(content, str) or not mode:
+            return None
+        normalized.append({"path": path.strip(), "content": content, "mode": mode})
+    return {"write_files": normalized}
+
+
+def parse_mode(mode):
+    """Octal permission bits as a string; 755, "755" and "0o755" all give "755" """
+    if mode is None or mode == "":
+        return DEFAULT_MODE
+    try:
+        value = int(str(mode).lower().replace("0o", ""), 8)
+    except ValueError:
+        return None
+    return f"{value:o}" if 0 < value <= 0o7777 else None
+
+
+def is_write_action(cmd):
+    return isinstance(cmd, dict) and "write_files" in cmd
+
+
+def command_text(cmd):
+    """The shell-style line shown to the user and fed to history and state tracking"""
+    if is_write_action(cmd):
+        return "write_files " + " ".join(shlex.quote(f["path"]) for f in cmd["write_files"])
+    return cmd
+
+
+def resolve(path, current_path):
+    if path == "~" or path.startswith("~/"):
+        path = "/root" + path[1:]
+    return posixpath.normpath(posixpath.join(current_path, path))
+
+
+def build_archive(files, current_path):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for entry in files:
+            data = entry["content"].encode()
+            info = tarfile.TarInfo(resolve(entry["path"], current_path).lstrip("/"))
+            info.size = len(data)
+            info.mode = int(entry["mode"], 8)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def read_file(container, path):
+    stream, _ = container.get_archive(path)
+    with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+        member = tar.next()
+        handle = tar.extractfile(member) if member else None
+        return handle.read() if handle else None
+
+
+def write_files(container, action, current_path, run):
+    """Push every file in one put_archive call and read each back to check it landed.
+
+    run(command) executes a shell command in the container; it is only used
+    to create missing parent directories. Returns (exit_code, stdout, stderr)
+    like exec_cmd.
+    """
+    files = action["write_files"]
+    paths = [resolve(entry["path"], current_path) for entry in files]
+
+    parents = sorted({posixpath.dirname(path) for path in paths} - {"/"})
+    if parents:
+        exit_code, out, err = run("mkdir -p -- " + " ".join(shlex.quote(p) for p in parents))
+        if exit_code != 0:
+            return exit_code, out, err
+
+    try:
+        if not container.put_archive("/", build_archive(files, current_path)):
+            return 1, "", "put_archive was rejected by the Docker daemon"
+        mismatched = [path for path, entry in zip(paths, files)
+                      if read_file(container, path) != entry["content"].encode()]
+    except Exception as e:
+        return 1, "", f"File write failed: {e}"
+
+    if mismatched:
+        return 1, "", "Content check failed for " + ", ".join(mismatched)
+    return 0, "\n".join(f"{path} ({len(entry['content'].encode())} bytes)"
+                        for path, entry in zip(paths, files)), ""
@@ -0,0 +1,177 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from llm_cache import CACHE_DIR, USE_DISK_CACHE, normalize_text
+from tracing import traced
+
+HISTORY_DB = os.environ.get("OLLAMACONTROL_HISTORY_DB",
+                            os.path.join(CACHE_DIR, "history.sqlite3") if USE_DISK_CACHE else ":memory:")
+SIMILAR_RUNS = 3
+# Partial matches are re-ranked from this many of the newest candidates, which keeps lookups
+# in the low milliseconds however large the table gets
+CANDIDATE_ROWS = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    session TEXT,
+    container TEXT,
+    request TEXT NOT NULL,
+    path TEXT,
+    plan TEXT,
+    commands TEXT,
+    success INTEGER NOT NULL,
+    duration REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_session ON runs (session, id);
+CREATE INDEX IF NOT EXISTS runs_success ON runs (success, id);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    position INTEGER NOT NULL,
+    step TEXT,
+    command TEXT,
+    output TEXT,
+    PRIMARY KEY (run_id, position)
+);
+"""
+
+# Only successful runs are indexed, they are the only ones worth retrieving
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS runs_fts USING fts5(request, content='runs', content_rowid='id');
+CREATE VIRTUAL TABLE IF NOT EXISTS runs_vocab USING fts5vocab(runs_fts, 'row');
+CREATE TRIGGER IF NOT EXISTS runs_fts_insert AFTER INSERT ON runs WHEN new.success = 1 BEGIN
+    INSERT INTO runs_fts (rowid, request) VALUES (new.id, new.request);
+END;
+"""
+
+
+STOP_WORDS = {"the", "and", "in", "to", "of", "an", "with", "for", "on", "into", "using", "my",
+              "it", "then", "all", "some", "this", "that", "from", "is", "be", "me", "please"}
+
+
+def words(text):
+    return [w for w in re.findall(r"[a-z0-9_]+", normalize_text(text)) if len(w) > 1 and w not in STOP_WORDS]
+
+
+class HistoryStore:
+    """Every request with its plan, commands, outputs and outcome, searchable by wording.
+
+    The database is opened on first use, so importing this module touches no files.
+    """
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.full_text = False
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # callers hold self._lock
+        if self._db is not None:
+            return self._db
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        with db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            try:
+                db.executescript(FTS_SCHEMA)
+                self.full_text = True
+            except sqlite3.OperationalError:
+                self.full_text = False
+        self._db = db
+        return db
+
+    def record(self, session, container, request, path, plan, step_results, success, duration=None):
+        commands = [r["command"] for r in step_results if not r["step"].startswith("Recovery:")]
+        with self._lock, self._open():
+            run_id = self._db.execute(
+                "INSERT INTO runs (session, container, request, path, plan, commands, success, duration, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (session, container, request, path, json.dumps(plan), json.dumps(commands),
+                 int(bool(success)), duration, time.time())
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO steps (run_id, position, step, command, output) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, i, r["step"], r["command"], r.get("output", "")) for i, r in enumerate(step_results)]
+            )
+        return run_id
+
+    @traced("history_lookup")
+    def similar_successes(self, request, limit=SIMILAR_RUNS):
+        """Past successful runs whose request reads most like this one, best first"""
+        terms = list(dict.fromkeys(words(request)))
+        if not terms:
+            return []
+
+        with self._lock:
+            self._open()
+            if self.full_text:
+                placeholders = ",".join("?" * len(terms))
+                frequency = dict(self._db.execute(
+                    f"SELECT term, doc FROM runs_vocab WHERE term IN ({placeholders})", terms
+                ))
+                # words no stored request contains can't match anything, so they don't count
+                terms = sorted((t for t in terms if t in frequency), key=frequency.get)
+                indexed = self._db.execute("SELECT max(id) FROM runs").fetchone()[0] or 0
+                weights = {t: math.log((indexed + 1) / (frequency[t] + 1)) + 1 for t in terms}
+
+                # runs containing every word first, then the newest runs for each word, rarest first
+                ids = [row[0] for row in self._db.execute(
+                    "SELECT rowid FROM runs_fts WHERE runs_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (" AND ".join(f'"{t}"' for t in terms), limit * 4)
+                )] if len(terms) > 1 else []
+                for term in terms:
+                    ids += [row[0] for row in self._db.execute(
+                        "SELECT rowid FROM runs_fts WHERE runs_fts MATCH ? ORDER BY rowid DESC LIMIT ?",
+                        (f'"{term}"', CANDIDATE_ROWS // len(terms))
+                    )]
+                ids = list(dict.fromkeys(ids))
+                placeholders = ",".join("?" * len(ids))
+                rows = self._db.execute(
+                    f"SELECT id, request, path, commands FROM runs WHERE id IN ({placeholders})", ids
+                ).fetchall() if ids else []
+            else:
+                weights = {t: 1.0 for t in terms}
+                rows = self._db.execute(
+                    "SELECT id, request, path, commands FROM runs WHERE success = 1 ORDER BY id DESC LIMIT ?",
+                    (CANDIDATE_ROWS,)
+                ).fetchall()
+
+        # rare words count for more: "kubernetes" says more about a request than "install"
+        total = sum(weights.values())
+        if not total:
+            return []
+        scored = []
+        for run_id, past_request, path, commands in rows:
+            have = set(words(past_request))
+            score = sum(weight for term, weight in weights.items() if term in have) / total
+            if score > 0:
+                scored.append((score, -len(have), run_id, past_request, path, commands))
+        scored.sort(reverse=True)
+
+        runs, seen = [], set()
+        for _, _, _, past_request, path, commands in scored:
+            key = normalize_text(past_request)
+            if key in seen:
+                continue
+            seen.add(key)
+            runs.append({"request": past_request, "path": path, "commands": json.loads(commands)})
+            if len(runs) == limit:
+                break
+        return runs
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+history = HistoryStore()
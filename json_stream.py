@@ -0,0 +1,85 @@
+import json
+
+
+class JsonObjectScanner:
+    """Finds the first complete top-level JSON object with an expected key in streamed text.
+
+    Text is fed chunk by chunk; braces inside strings and <think> blocks are ignored,
+    and objects that parse but lack every expected key are skipped.
+    """
+
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.text = ""
+        self.result = None
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._thinking = False
+
+    def feed(self, chunk):
+        """Add text; returns the matching object once it is complete, None until then"""
+        if self.result is not None:
+            return self.result
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if self._thinking:
+                end = text.find("</think>", self._pos)
+                if end < 0:
+                    # keep a partial closing tag for the next chunk
+                    self._pos = max(self._pos, len(text) - len("</think>") + 1)
+                    return None
+                self._thinking = False
+                self._pos = end + len("</think>")
+                continue
+            if self._start is None:
+                if char == "<" and text.startswith("<think>", self._pos):
+                    self._thinking = True
+                    self._pos += len("<think>")
+                    continue
+                if char == "<" and "<think>".startswith(text[self._pos:]):
+                    return None
+                if char == "{":
+                    self._start, self._depth = self._pos, 1
+                self._pos += 1
+                continue
+
+            self._pos += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate, self._start = text[self._start:self._pos], None
+                    try:
+                        parsed = json.loads(candidate)
+                    except ValueError:
+                        continue
+                    if isinstance(parsed, dict) and any(key in parsed for key in self.keys):
+                        self.result = parsed
+                        return parsed
+        return None
+
+    def parse(self):
+        """The matching object, or the outermost {...} span of everything fed (raises on bad JSON)"""
+        if self.result is not None:
+            return self.result
+        content = self.text.strip()
+        if "</think>" in content:
+            content = content.split("</think>", 1)[1]
+        if '{' in content:
+            content = content[content.find('{'):content.rfind('}') + 1]
+        return json.loads(content)
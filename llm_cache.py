@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get("OLLAMACONTROL_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "ollamacontrol"))
+USE_DISK_CACHE = os.environ.get("OLLAMACONTROL_DISK_CACHE", "1") == "1"
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text.strip().lower()).rstrip(".!?")
+
+
+def state_fingerprint(container_state):
+    """Short hash of the parts of container_state the prompts show"""
+    if not container_state:
+        return "empty"
+    relevant = [sorted(container_state.get(key, []))
+                for key in ("directories", "files", "python_packages")]
+    return hashlib.sha1(json.dumps(relevant).encode()).hexdigest()[:12]
+
+
+def load_json(path, what):
+    """Contents of a JSON file written by save_json, or None when it is missing or unreadable"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable {what}: {e}")
+        return None
+
+
+def save_json(path, data, what, indent=None):
+    """Write data to path through a temporary file so readers never see half of it"""
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"⚠️ Could not save {what}: {e}")
+
+
+class LRUCache:
+    """Small LRU map of model answers, optionally mirrored to a JSON file"""
+
+    def __init__(self, name, max_entries=256, persist=USE_DISK_CACHE):
+        self.name = name
+        self.max_entries = max_entries
+        self.path = os.path.join(CACHE_DIR, f"{name}.json") if persist else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def get(self, key):
+        key = json.dumps(key)
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[json.dumps(key)] = value
+            self._entries.move_to_end(json.dumps(key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(json.dumps(key), None)
+            self._save()
+
+    def invalidate_where(self, predicate):
+        with self._lock:
+            stale = [k for k, v in self._entries.items() if predicate(v)]
+            for k in stale:
+                del self._entries[k]
+            if stale:
+                self._save()
+        return len(stale)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def _load(self):
+        entries = load_json(self.path, f"{self.name} cache")
+        if entries is not None:
+            self._entries = OrderedDict(entries)
+
+    def _save(self):
+        save_json(self.path, list(self._entries.items()), f"{self.name} cache")
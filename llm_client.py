@@ -0,0 +1,118 @@
+import os
+import time
+from tracing import span
+from llm_scheduler import scheduler
+from model_router import router
+from json_stream import JsonObjectScanner
+from prompt_context import estimate_tokens
+
+USE_STREAMING = os.environ.get("OLLAMACONTROL_STREAM", "1") != "0"
+# How long Ollama keeps a model (and its cached prompt prefix) loaded after a call
+KEEP_ALIVE = os.environ.get("OLLAMACONTROL_KEEP_ALIVE", "30m")
+# Report how much of each prompt Ollama served from its cache; calls are not streamed then,
+# since the token counts only arrive with the last chunk
+MEASURE_PROMPT_CACHE = os.environ.get("OLLAMACONTROL_PROMPT_CACHE_STATS", "0") == "1"
+
+
+def chat(model, messages, **kwargs):
+    """ollama.chat inside a span that keeps the token counts and durations Ollama reports"""
+    import ollama
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    with span("ollama.chat", model=model) as current:
+        with scheduler.slot(model) as waited:
+            started, ok = time.perf_counter(), False
+            try:
+                response = ollama.chat(model=model, messages=messages, **kwargs)
+                ok = True
+            finally:
+                router.record_call(model, time.perf_counter() - started, ok)
+        _record_stats(current, model, waited, response)
+        _record_prompt_cache(current, model, messages, response)
+        return response
+
+
+def chat_json(model, messages, keys, **kwargs):
+    """Stream a reply and stop generating once a JSON object with one of these keys is complete.
+
+    Raises json.JSONDecodeError when the reply holds no usable object, like json.loads would.
+    """
+    if not USE_STREAMING or MEASURE_PROMPT_CACHE:
+        response = chat(model, messages, **kwargs)
+        scanner = JsonObjectScanner(keys)
+        scanner.feed(response.get('message', {}).get('content', ''))
+        return scanner.parse()
+
+    import ollama
+    scanner = JsonObjectScanner(keys)
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    with span("ollama.chat", model=model, stream=True) as current:
+        with scheduler.slot(model) as waited:
+            started, ok = time.perf_counter(), False
+            first_token = parsed_at = None
+            chunks, last = 0, {}
+            stream = ollama.chat(model=model, messages=messages, stream=True, **kwargs)
+            try:
+                for part in stream:
+                    last = part
+                    message = part.get('message') or {}
+                    text = message.get('content') or ''
+                    if first_token is None and (text or message.get('thinking')):
+                        first_token = time.perf_counter() - started
+                    chunks += 1
+                    if text and scanner.feed(text) is not None:
+                        parsed_at = time.perf_counter() - started
+                        break
+                ok = True
+            finally:
+                # closing the stream drops the connection, which makes Ollama stop decoding
+                stream.close()
+                router.record_call(model, time.perf_counter() - started, ok)
+
+        _record_stats(current, model, waited, last)
+        _record_prompt_cache(current, model, messages, last)
+        current.attrs.update(
+            ttft_ms=first_token * 1000 if first_token is not None else None,
+            json_ms=parsed_at * 1000 if parsed_at is not None else None,
+            stopped_early=not last.get('done', False)
+        )
+        if not last.get('done', False):
+            # Ollama only reports counts in the final chunk; each streamed chunk is about one token
+            current.attrs["eval_tokens"] = chunks
+        if current.parent:
+            current.parent.attrs.update({k: current.attrs[k] for k in ("ttft_ms", "json_ms", "eval_tokens")})
+    return scanner.parse()
+
+
+def _record_stats(current, model, waited, response):
+    stats = {
+        "queue_ms": waited * 1000,
+        "prompt_tokens": response.get('prompt_eval_count'),
+        "eval_tokens": response.get('eval_count'),
+        "prompt_eval_ms": (response.get('prompt_eval_duration') or 0) / 1e6,
+        "eval_ms": (response.get('eval_duration') or 0) / 1e6,
+        "load_ms": (response.get('load_duration') or 0) / 1e6
+    }
+    current.attrs.update(stats)
+    if current.parent:
+        current.parent.attrs.update(model=model, **stats)
+
+
+def _record_prompt_cache(current, model, messages, response):
+    """Estimate how many prompt tokens Ollama reused: it only evaluates what its cache lacks"""
+    evaluated = response.get('prompt_eval_count')
+    if evaluated is None:
+        return
+    estimate = estimate_tokens("".join(m.get("content", "") for m in messages))
+    cached = max(estimate - evaluated, 0)
+    current.attrs.update(prompt_estimate=estimate, cached_tokens=cached)
+    if MEASURE_PROMPT_CACHE:
+        eval_ms = (response.get('prompt_eval_duration') or 0) / 1e6
+        print(f"🧮 {model}: evaluated {evaluated} of ~{estimate} prompt tokens in {eval_ms:.0f} ms, "
+              f"~{cached * 100 // max(estimate, 1)}% from cache")
+
+
+def warm_up(model, prefix):
+    """Load the model and evaluate its static prompt prefix so the first real call finds both cached"""
+    import ollama
+    ollama.chat(model=model, messages=[{"role": "system", "content": prefix}],
+                options={"num_predict": 1}, keep_alive=KEEP_ALIVE)
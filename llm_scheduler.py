@@ -0,0 +1,87 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+MODEL_CONCURRENCY = int(os.environ.get("OLLAMACONTROL_MODEL_CONCURRENCY", "1"))
+
+# Set by the server around each request so model calls can be shared fairly between sessions
+current_session = contextvars.ContextVar("ollamacontrol_session", default=None)
+
+
+class ModelScheduler:
+    """Caps concurrent calls per model and hands freed slots to waiting sessions in turn"""
+
+    def __init__(self, concurrency=MODEL_CONCURRENCY):
+        self.concurrency = max(concurrency, 1)
+        self._lock = threading.Lock()
+        self._running = {}
+        # model -> session -> waiters; the session served last moves to the back
+        self._waiting = {}
+
+    @contextmanager
+    def slot(self, model):
+        waited = self.acquire(model)
+        try:
+            yield waited
+        finally:
+            self.release(model)
+
+    def acquire(self, model):
+        with self._lock:
+            if self._running.get(model, 0) < self.concurrency and not self._waiting.get(model):
+                self._running[model] = self._running.get(model, 0) + 1
+                return 0.0
+            event = threading.Event()
+            queues = self._waiting.setdefault(model, OrderedDict())
+            queues.setdefault(current_session.get(), deque()).append(event)
+
+        started = time.perf_counter()
+        try:
+            event.wait()
+        except BaseException:
+            with self._lock:
+                handed_over = event.is_set()
+                if not handed_over:
+                    self._forget(model, event)
+            if handed_over:
+                self.release(model)
+            raise
+        return time.perf_counter() - started
+
+    def release(self, model):
+        with self._lock:
+            queues = self._waiting.get(model)
+            if not queues:
+                self._running[model] -= 1
+                return
+            session, waiters = next(iter(queues.items()))
+            event = waiters.popleft()
+            if waiters:
+                queues.move_to_end(session)
+            else:
+                del queues[session]
+            # the slot passes straight to the waiter, so the running count stays the same
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: {"running": self._running.get(model, 0),
+                        "waiting": sum(len(w) for w in self._waiting.get(model, {}).values())}
+                for model in set(self._running) | set(self._waiting)
+            }
+
+    def _forget(self, model, event):
+        queues = self._waiting.get(model, {})
+        for session, waiters in list(queues.items()):
+            if event in waiters:
+                waiters.remove(event)
+                if not waiters:
+                    del queues[session]
+                return
+
+
+scheduler = ModelScheduler()
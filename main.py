@@ -1,75 +1,142 @@
+import contextvars
+import argparse
+import hashlib
 import json
-import docker
+import os
+import time
 import shlex
 from datetime import datetime, timezone
-from Ollama_model import linux_command
-from Masterai import linux_step_planning, create_error_recovery_plan
+from concurrent.futures import ThreadPoolExecutor
+from Ollama_model import (linux_command, linux_commands_batch, optimize_command_intelligently,
+                          forget_command, command_cache, GENERATOR_PREFIX)
+from Masterai import linux_step_planning, create_error_recovery_plan, forget_plan, plan_cache, PLANNER_PREFIX
+from shell_session import get_session, close_session, ShellSessionError
+from container_state import get_tracker
+from command_rules import rule_stats, coalesce_installs
+from command_check import check_command, check_stats
+from recovery_kb import recovery_kb
+from tracing import span, traced, print_request_summary, start_metrics_server
+from container_pool import get_pool, close_pools
+from output_buffer import OutputBuffer
+from plan_dag import parse_dependencies, schedule_waves
+from file_writes import is_write_action, command_text, write_files
+from checkpoints import checkpoints, checkpoint_paths, USE_CHECKPOINTS
+from history_store import history
+from llm_scheduler import current_session
+from model_router import router, GENERATOR_MODEL, PLANNER_MODEL, SMALL_MODEL
+from llm_client import warm_up
+from startup import Startup
 
 UBUNTU_MIRROR = "http://mirror.csclub.uwaterloo.ca/ubuntu/"
 UBUNTU_VERSION = "jammy"
 DOCKER_IMAGE = "ubuntu:22.04"
 USER_LOGIN = "Felixcegep"
+USE_SHELL_SESSION = True
+BASE_IMAGE_REPOSITORY = "ollamacontrol-base"
+BASE_IMAGE_TTL = 7 * 24 * 3600
+REFRESH_BASE_IMAGE = os.environ.get("OLLAMACONTROL_REFRESH_IMAGE") == "1"
+WARM_POOL_SIZE = int(os.environ.get("OLLAMACONTROL_WARM_POOL", "1"))
+COMMAND_TIMEOUT = int(os.environ.get("OLLAMACONTROL_COMMAND_TIMEOUT", "600"))
+USE_BATCH_GENERATION = True
+USE_PIPELINING = True
+USE_PLAN_DAG = True
+MAX_PARALLEL_STEPS = 4
+USE_SHARED_PACKAGE_CACHE = os.environ.get("OLLAMACONTROL_SHARED_CACHE", "1") != "0"
+WARM_UP_MODELS = os.environ.get("OLLAMACONTROL_WARM_UP", "1") != "0"
+# Named volumes shared by every container so repeated installs come from local disk
+PACKAGE_CACHE_VOLUMES = {
+    "ollamacontrol-apt-archives": "/var/cache/apt/archives",
+    "ollamacontrol-pip-cache": "/root/.cache/pip",
+}
+# The shared apt archive volume itself, so every container's apt-get waits on the same lock and
+# apt-get clean cannot delete it
+APT_LOCK_FILE = "/var/cache/apt/archives"
+APT_LOCK_WAIT = 900
+MAX_HISTORY_MESSAGES = 50
+
+
+def warm_up_models(startup):
+    """Load the models and their prompt prefixes in the background while the container starts"""
+    if not WARM_UP_MODELS:
+        return
+    prefixes = {PLANNER_MODEL: PLANNER_PREFIX, GENERATOR_MODEL: GENERATOR_PREFIX}
+    if SMALL_MODEL:
+        prefixes[SMALL_MODEL] = GENERATOR_PREFIX
+    for model, prefix in prefixes.items():
+        startup.start(f"Model {model}", warm_up, model, prefix)
 
 
 def get_current_time():
     return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
 
 
-def exec_cmd(container, command, current_path="/"):
+@traced("exec_cmd", describe=lambda result: {"exit_code": result[0],
+                                               "output_bytes": len(result[1]) + len(result[2])})
+def exec_cmd(container, command, current_path="/", on_output=None, timeout=COMMAND_TIMEOUT,
+             use_session=USE_SHELL_SESSION):
+    session = get_session(container) if use_session else None
+    if session:
+        try:
+            return session.run(command, current_path, on_output=on_output, timeout=timeout)
+        except ShellSessionError as e:
+            close_session(container)
+            return -1, "", f"Shell session lost: {e}"
+
     full_cmd = f"cd {shlex.quote(current_path)} && {command}"
+    wrapper = f"timeout -k 5 {timeout} " if timeout else ""
     try:
         exit_code, (stdout, stderr) = container.exec_run(
-            f"bash -c {shlex.quote(full_cmd)}", demux=True
+            f"{wrapper}bash -c {shlex.quote(full_cmd)}", demux=True
         )
-        out = stdout.decode('utf-8').strip() if stdout else ""
-        err = stderr.decode('utf-8').strip() if stderr else ""
+        out_buffer, err_buffer = OutputBuffer(), OutputBuffer()
+        out_buffer.write(stdout or b"")
+        err_buffer.write(stderr or b"")
+        out, err = out_buffer.text(), err_buffer.text()
+        if on_output:
+            if out: on_output("stdout", out + "\n")
+            if err: on_output("stderr", err + "\n")
+        if timeout and exit_code == 124:
+            err = f"{err}\nCommand timed out after {timeout}s".strip()
         return exit_code, out, err
     except Exception as e:
         return -1, "", str(e)
 
 
-def check_container_state(container, current_path):
-    state = {"directories": [], "files": [], "python_packages": []}
-
-    # Check directories and files
-    exit_code, out, _ = exec_cmd(container, "find . -type d -name '*' 2>/dev/null | head -20", current_path)
-    if exit_code == 0 and out:
-        state["directories"] = [d.strip('./') for d in out.split('\n') if d.strip() and d != '.']
-
-    exit_code, out, _ = exec_cmd(container, "find . -type f -name '*' 2>/dev/null | head -20", current_path)
-    if exit_code == 0 and out:
-        state["files"] = [f.strip('./') for f in out.split('\n') if f.strip()]
+def state_tracker(container):
+    return get_tracker(container, lambda cmd, path: exec_cmd(container, cmd, path))
 
-    # Check Python packages if pip3 is available
-    exit_code, _, _ = exec_cmd(container, "which pip3", current_path)
-    if exit_code == 0:
-        exit_code, out, _ = exec_cmd(container, "pip3 list --format=freeze 2>/dev/null", current_path)
-        if exit_code == 0 and out:
-            state["python_packages"] = [pkg.split('==')[0].lower() for pkg in out.split('\n') if '==' in pkg]
-
-    return state
-
-
-def setup_container(container):
-    print("🔧 Setting up container...")
 
+def setup_commands():
     sources = f"""deb {UBUNTU_MIRROR} {UBUNTU_VERSION} main restricted universe multiverse
 deb {UBUNTU_MIRROR} {UBUNTU_VERSION}-updates main restricted universe multiverse
 deb {UBUNTU_MIRROR} {UBUNTU_VERSION}-backports main restricted universe multiverse
 deb {UBUNTU_MIRROR} {UBUNTU_VERSION}-security main restricted universe multiverse"""
 
-    setup_commands = [
+    return [
         f"echo {shlex.quote(sources)} > /etc/apt/sources.list",
         "rm -f /etc/apt/sources.list.d/* || true",
         "echo 'DEBIAN_FRONTEND=noninteractive' >> /etc/environment",
+        # the image's docker-clean hook would empty the shared apt archive after every install
+        "rm -f /etc/apt/apt.conf.d/docker-clean",
+        "echo 'Binary::apt::APT::Keep-Downloaded-Packages \"true\";' > /etc/apt/apt.conf.d/keep-cache",
+        # apt takes the shared archive's lock without waiting, so apt runs one container at a time
+        "for tool in apt-get apt; do printf '#!/bin/sh\\nexec flock -w %s %s /usr/bin/%s \"$@\"\\n' "
+        f"{APT_LOCK_WAIT} {APT_LOCK_FILE} \"$tool\" > \"/usr/local/bin/$tool\" "
+        "&& chmod 755 \"/usr/local/bin/$tool\"; done",
         "DEBIAN_FRONTEND=noninteractive apt-get update -y",
         "DEBIAN_FRONTEND=noninteractive apt-get upgrade -y -o Dpkg::Options::=--force-confdef",
         "DEBIAN_FRONTEND=noninteractive apt-get autoremove -y && apt-get clean -y"
     ]
 
-    for i, cmd in enumerate(setup_commands, 1):
-        print(f"[{i}/{len(setup_commands)}] Running setup step...")
-        exit_code, _, err = exec_cmd(container, cmd)
+
+@traced("setup_container")
+def setup_container(container):
+    print("🔧 Setting up container...")
+
+    commands = setup_commands()
+    for i, cmd in enumerate(commands, 1):
+        print(f"[{i}/{len(commands)}] Running setup step...")
+        exit_code, _, err = exec_cmd(container, cmd, timeout=None)
         if exit_code != 0:
             print(f"❌ Setup failed: {err}")
             container.stop()
@@ -78,6 +145,55 @@ deb {UBUNTU_MIRROR} {UBUNTU_VERSION}-security main restricted universe multivers
     print("✅ Container setup complete")
 
 
+def base_image_tag():
+    key = json.dumps([UBUNTU_MIRROR, UBUNTU_VERSION, DOCKER_IMAGE, setup_commands()])
+    return f"{BASE_IMAGE_REPOSITORY}:{hashlib.sha256(key.encode()).hexdigest()[:12]}"
+
+
+def provisioned_image(client, refresh=False):
+    import docker
+    tag = base_image_tag()
+
+    if not refresh:
+        try:
+            image = client.images.get(tag)
+            age = time.time() - int((image.labels or {}).get("ollamacontrol.provisioned_at", "0"))
+            if age < BASE_IMAGE_TTL:
+                print(f"✅ Using provisioned image {tag}")
+                return tag
+            print(f"⌛ Provisioned image {tag} is older than the TTL, rebuilding")
+        except docker.errors.ImageNotFound:
+            print(f"📦 No provisioned image for this setup yet, building {tag}")
+
+    try:
+        client.images.get(DOCKER_IMAGE)
+        print(f"✅ Image {DOCKER_IMAGE} found locally")
+    except docker.errors.ImageNotFound:
+        print(f"📥 Pulling {DOCKER_IMAGE}...")
+        client.images.pull(DOCKER_IMAGE)
+        print(f"✅ Image {DOCKER_IMAGE} pulled successfully")
+
+    container = client.containers.run(
+        DOCKER_IMAGE, "sleep infinity", tty=True, detach=True, remove=True
+    )
+    try:
+        setup_container(container)
+        repository, _, version = tag.partition(":")
+        container.commit(repository=repository, tag=version, changes=[
+            f"LABEL ollamacontrol.provisioned_at={int(time.time())}",
+            'CMD ["sleep", "infinity"]'
+        ])
+        print(f"✅ Provisioned image {tag} saved")
+    finally:
+        close_session(container)
+        try:
+            container.stop()
+        except Exception:
+            pass
+
+    return tag
+
+
 def handle_cd(container, command, current_path):
     target = command[3:].strip()
 
@@ -98,29 +214,88 @@ def handle_cd(container, command, current_path):
         return current_path
 
 
-def execute_step(container, cmd, current_path):
+def execute_step(container, cmd, current_path, parallel=False):
+    if is_write_action(cmd):
+        return execute_file_write(container, cmd, current_path, parallel)
+
     if cmd.startswith("cd "):
         new_path = handle_cd(container, cmd, current_path)
         return {"success": True, "new_path": new_path, "output": "", "error": "",
                 "failed_command": cmd if new_path == current_path else ""}
 
+    if parallel:
+        # Steps running side by side get their own exec; the caller reports them once the wave is done
+        exit_code, out, err = exec_cmd(container, cmd, current_path, use_session=False)
+        if exit_code == 0:
+            return {"success": True, "new_path": current_path, "output": out, "error": ""}
+        return {"success": False, "new_path": current_path, "output": out,
+                "error": err or out, "exit_code": exit_code, "failed_command": cmd}
+
     print(f"⚙️ Running: {cmd}")
-    exit_code, out, err = exec_cmd(container, cmd, current_path)
+    streamed = []
+
+    def show_output(stream, text):
+        if not streamed:
+            print("🖥️ Output:")
+        streamed.append(text[-1])
+        print(text, end="", flush=True)
+
+    exit_code, out, err = exec_cmd(container, cmd, current_path, on_output=show_output)
+    if streamed and streamed[-1] != "\n":
+        print()
 
     if exit_code == 0:
-        if out: print(f"🖥️ Output:\n{out}")
-        if err: print(f"⚠️ Warnings:\n{err}")
-        if not out and not err: print("✅ OK")
+        if not streamed: print("✅ OK")
         return {"success": True, "new_path": current_path, "output": out, "error": ""}
     else:
         error_msg = err or out
-        print(f"❌ Failed (exit {exit_code}): {error_msg}")
+        print(f"❌ Failed (exit {exit_code})" if streamed else f"❌ Failed (exit {exit_code}): {error_msg}")
         return {"success": False, "new_path": current_path, "output": out,
                 "error": error_msg, "exit_code": exit_code, "failed_command": cmd}
 
 
+def execute_file_write(container, action, current_path, parallel=False):
+    text = command_text(action)
+    exit_code, out, err = write_files(
+        container, action, current_path,
+        lambda command: exec_cmd(container, command, current_path, use_session=USE_SHELL_SESSION and not parallel)
+    )
+    if not parallel:
+        print(f"📝 {text}: " + ("✅ OK" if exit_code == 0 else f"❌ Failed: {err}"))
+    if exit_code == 0:
+        return {"success": True, "new_path": current_path, "output": out, "error": ""}
+    return {"success": False, "new_path": current_path, "output": out,
+            "error": err, "exit_code": exit_code, "failed_command": text}
+
+
+def run_known_recovery(container, commands, signature, current_path, step_results):
+    print(f"📚 Known error ({signature}), running {len(commands)} stored recovery command(s)")
+    for step_index, recovery_cmd in enumerate(commands, 1):
+        print(f"\n🔧 [R{step_index}/{len(commands)}] {command_text(recovery_cmd)}")
+        recovery_result = execute_step(container, recovery_cmd, current_path)
+        current_path = recovery_result["new_path"]
+
+        if not recovery_result["success"]:
+            print(f"❌ Stored recovery step failed: {recovery_result['error']}")
+            return False
+
+        step_results.append({
+            "step": f"Recovery: {signature}",
+            "command": command_text(recovery_cmd),
+            "result": f"Executed '{command_text(recovery_cmd)}' successfully",
+            "output": recovery_result["output"]
+        })
+    return True
+
+
 def attempt_error_recovery(container, execution_result, user_input, failed_step,
-                           current_path, step_results, messages, container_state):
+                           current_path, step_results, messages, container_state, use_kb=True):
+    """Run recovery commands from the knowledge base or the model.
+
+    Returns None when recovery failed, otherwise {"signature", "commands"}:
+    the knowledge base signature that was used, or the model's commands so
+    the caller can store them once the retry shows they worked.
+    """
     error_info = {
         "failed_command": execution_result["failed_command"],
         "error_message": execution_result["error"],
@@ -130,6 +305,16 @@ def attempt_error_recovery(container, execution_result, user_input, failed_step,
         "container_state": container_state
     }
 
+    signature, known_commands = recovery_kb.lookup(
+        execution_result["error"], execution_result["exit_code"], execution_result["failed_command"]
+    ) if use_kb else (None, None)
+    if known_commands:
+        if run_known_recovery(container, known_commands, signature, current_path, step_results):
+            print("✅ Recovery completed from the knowledge base")
+            return {"signature": signature, "commands": None}
+        recovery_kb.record_outcome(signature, False)
+        print("📚 Stored recovery didn't work, asking the model")
+
     print("🤔 Analyzing error and creating recovery plan...")
     recovery_plan = create_error_recovery_plan(
         error_info=error_info,
@@ -140,7 +325,7 @@ def attempt_error_recovery(container, execution_result, user_input, failed_step,
 
     if not recovery_plan or not recovery_plan.get("recovery_steps"):
         print("❌ No recovery plan could be generated")
-        return False
+        return None
 
     recovery_steps = recovery_plan["recovery_steps"]
     print(f"\n🛠️ Recovery Plan ({len(recovery_steps)} steps):")
@@ -148,6 +333,7 @@ def attempt_error_recovery(container, execution_result, user_input, failed_step,
         print(f"  [R{i}] {step}")
 
     # Execute recovery steps
+    recovery_cmds = []
     for step_index, recovery_step in enumerate(recovery_steps, 1):
         print(f"\n🔧 [R{step_index}/{len(recovery_steps)}] {recovery_step}")
 
@@ -166,36 +352,188 @@ def attempt_error_recovery(container, execution_result, user_input, failed_step,
 
         if not recovery_cmd:
             print("❌ No recovery command generated")
-            return False
+            return None
 
         recovery_result = execute_step(container, recovery_cmd, current_path)
         current_path = recovery_result["new_path"]
 
         if not recovery_result["success"]:
             print(f"❌ Recovery step failed: {recovery_result['error']}")
-            return False
+            return None
 
+        recovery_cmds.append(recovery_cmd)
         step_results.append({
             "step": f"Recovery: {recovery_step}",
-            "command": recovery_cmd,
-            "result": f"Executed '{recovery_cmd}' successfully",
+            "command": command_text(recovery_cmd),
+            "result": f"Executed '{command_text(recovery_cmd)}' successfully",
             "output": recovery_result["output"]
         })
 
     print("✅ Recovery plan completed successfully")
-    return True
+    return {"signature": None, "commands": recovery_cmds}
+
+
+def record_step(step, cmd, execution_result, step_results, messages):
+    text = command_text(cmd)
+    step_results.append({
+        "step": step,
+        "command": text,
+        "result": f"Executed '{text}' successfully",
+        "output": execution_result["output"]
+    })
+    messages.append({"role": "assistant", "content": f"Executed '{text}' successfully"})
+
+
+def prepare_command(container, step, cmd, current_path, step_results, messages, container_state,
+                    regenerate=None):
+    """Fix what would obviously fail before cmd runs, rather than running it into a recovery plan.
+
+    regenerate(results) asks for a new command with the rejected one among the
+    results; without it a rejected command is run as it is.
+    """
+    checked, prerequisites, error = check_command(cmd, current_path, container_state)
+    if error and regenerate:
+        print(f"🔎 Rejected before running, regenerating: {error}")
+        forget_command(cmd)
+        rejected = step_results + [{
+            "step": step,
+            "command": command_text(cmd),
+            "result": f"Rejected before running, {error}",
+            "output": ""
+        }]
+        regenerated = regenerate(rejected)
+        if regenerated:
+            checked, prerequisites, _ = check_command(regenerated, current_path, container_state)
+    elif checked != cmd:
+        print(f"🔎 Fixed before running: {command_text(checked)}")
+
+    for prerequisite in prerequisites:
+        print(f"🧰 Missing prerequisite: {prerequisite}")
+        result = execute_step(container, prerequisite, current_path)
+        if not result["success"]:
+            # the step itself fails next and goes through the usual recovery
+            state_tracker(container).invalidate()
+            break
+        container_state = state_tracker(container).update(prerequisite, current_path)
+        record_step(f"Prerequisite: {prerequisite}", prerequisite, result, step_results, messages)
+    return checked, container_state
+
+
+def take_checkpoint(container, cmd, current_path):
+    text = command_text(cmd)
+    if not USE_CHECKPOINTS or text.startswith("cd "):
+        return None
+    paths = checkpoint_paths(text, current_path, lambda command: exec_cmd(container, command, current_path))
+    return checkpoints.create(container, paths) if paths else None
+
+
+def rollback(container, checkpoint):
+    if checkpoint and checkpoints.restore(container, checkpoint, lambda command: exec_cmd(container, command)):
+        print(f"⏪ Rolled back {len(checkpoint['paths'])} path(s) to before the failed step")
+        return True
+    return False
+
+
+def recover_and_retry(container, execution_result, user_input, step, cmd, current_path,
+                      step_results, messages, container_state, checkpoint=None):
+    state_tracker(container).invalidate()
+    forget_command(cmd)
+    # Recovery is planned against the state from before the step, so undo its partial changes first
+    rollback(container, checkpoint)
+    print("\n🔧 Attempting error recovery...")
+
+    # A stored recipe that runs but does not fix the step is reported, then the model gets a turn
+    for use_kb in (True, False):
+        recovery = attempt_error_recovery(container, execution_result, user_input, step, current_path,
+                                          step_results, messages, container_state, use_kb=use_kb)
+        if not recovery:
+            print("❌ Could not recover from error")
+            return False, current_path, container_state
+
+        container_state = state_tracker(container).refresh(current_path)
+        print(f"\n🔄 Retrying: {step}")
+        retry_result = execute_step(container, cmd, current_path)
+        if retry_result["success"]:
+            break
+
+        state_tracker(container).invalidate()
+        rollback(container, checkpoint)
+        if not recovery["signature"]:
+            print("❌ Recovery failed")
+            return False, retry_result["new_path"], container_state
+        recovery_kb.record_outcome(recovery["signature"], False)
+        print("📚 Stored recovery didn't fix the step, asking the model")
+
+    current_path = retry_result["new_path"]
+    if recovery["signature"]:
+        recovery_kb.record_outcome(recovery["signature"], True)
+    else:
+        recovery_kb.learn(execution_result["error"], execution_result["exit_code"],
+                          execution_result["failed_command"], recovery["commands"])
+    if checkpoint:
+        checkpoints.discard(checkpoint)
+    container_state = state_tracker(container).update(command_text(cmd), current_path)
+    record_step(step, cmd, retry_result, step_results, messages)
+    print("✅ Recovery successful")
+    return True, current_path, container_state
+
+
+def generate_step_command(user_input, steps, step_index, step_results, current_path,
+                          container_state, verbose=True, model=GENERATOR_MODEL):
+    return linux_command(
+        original_request=user_input,
+        current_step=steps[step_index - 1],
+        step_number=step_index,
+        total_steps=len(steps),
+        all_steps=steps,
+        previous_results=step_results,
+        current_path=current_path,
+        user_login=USER_LOGIN,
+        current_time=get_current_time(),
+        container_state=container_state,
+        verbose=verbose,
+        model=model
+    )
 
 
-def execute_plan_with_recovery(container, steps, user_input, current_path,
-                               step_results, messages, container_state):
-    for step_index, step in enumerate(steps, 1):
-        print(f"\n➡️ [{step_index}/{len(steps)}] {step}")
+def speculate_next_command(pipeline, user_input, steps, step_index, step, cmd,
+                           step_results, current_path, container_state):
+    # Assume the current step succeeds where it is and generate the next one meanwhile
+    assumed_results = step_results + [{
+        "step": step,
+        "command": command_text(cmd),
+        "result": f"Executed '{command_text(cmd)}' successfully",
+        "output": ""
+    }]
 
-        cmd = linux_command(
+    def generate():
+        started = time.monotonic()
+        next_cmd = generate_step_command(user_input, steps, step_index + 1, assumed_results,
+                                         current_path, container_state, verbose=False)
+        return next_cmd, started, time.monotonic()
+
+    future = pipeline.submit(contextvars.copy_context().run, generate)
+    return {"future": future, "path": current_path, "state": container_state}
+
+
+def speculation_still_valid(speculation, execution_result, current_path, container_state):
+    if not execution_result["success"] or execution_result.get("failed_command"):
+        return False
+    if current_path != speculation["path"]:
+        return False
+    # New entries are what the step was expected to add; anything that vanished wasn't assumed
+    before, after = speculation["state"] or {}, container_state or {}
+    return all(set(before.get(key, [])) <= set(after.get(key, []))
+               for key in ("directories", "files", "python_packages"))
+
+
+def execute_plan_with_recovery(container, steps, user_input, current_path,
+                               step_results, messages, container_state, dependencies=None,
+                               model=GENERATOR_MODEL):
+    batch = None
+    if USE_BATCH_GENERATION and len(steps) > 1:
+        batch = linux_commands_batch(
             original_request=user_input,
-            current_step=step,
-            step_number=step_index,
-            total_steps=len(steps),
             all_steps=steps,
             previous_results=step_results,
             current_path=current_path,
@@ -204,71 +542,175 @@ def execute_plan_with_recovery(container, steps, user_input, current_path,
             container_state=container_state
         )
 
-        if not cmd:
-            print("❌ No command generated")
-            return False, current_path
-
-        execution_result = execute_step(container, cmd, current_path)
-        current_path = execution_result["new_path"]
-
-        if execution_result["success"]:
-            container_state = check_container_state(container, current_path)
-            step_results.append({
-                "step": step,
-                "command": cmd,
-                "result": f"Executed '{cmd}' successfully",
-                "output": execution_result["output"]
-            })
-            messages.append({"role": "assistant", "content": f"Executed '{cmd}' successfully"})
-        else:
-            print("\n🔧 Attempting error recovery...")
-
-            if attempt_error_recovery(container, execution_result, user_input, step,
-                                      current_path, step_results, messages, container_state):
-                container_state = check_container_state(container, current_path)
-                print(f"\n🔄 Retrying: {step}")
-                retry_result = execute_step(container, cmd, current_path)
-                current_path = retry_result["new_path"]
-
-                if retry_result["success"]:
-                    step_results.append({
-                        "step": step,
-                        "command": cmd,
-                        "result": f"Executed '{cmd}' successfully",
-                        "output": retry_result["output"]
-                    })
-                    messages.append({"role": "assistant", "content": f"Executed '{cmd}' successfully"})
-                    print("✅ Recovery successful")
+    # a step the batch left empty is generated in the sequential loop, which the waves do not do
+    if batch and all(batch) and USE_PLAN_DAG:
+        dependencies = parse_dependencies(dependencies, len(steps))
+        waves = schedule_waves(batch, dependencies, current_path) if dependencies else None
+        if waves and len(waves) < len(steps):
+            return execute_plan_waves(container, steps, batch, waves, user_input, current_path,
+                                      step_results, messages, container_state)
+
+    pipeline = ThreadPoolExecutor(max_workers=1) if USE_PIPELINING and len(steps) > 1 else None
+    pipeline_stats = {"speculated": 0, "used": 0, "discarded": 0, "overlap": 0.0}
+    speculation = None
+    ready = None
+
+    try:
+        for step_index, step in enumerate(steps, 1):
+            print(f"\n➡️ [{step_index}/{len(steps)}] {step}")
+
+            cmd = batch[step_index - 1] if batch else None
+            if not cmd and ready:
+                next_cmd, gen_started, gen_finished = ready["future"].result()
+                pipeline_stats["overlap"] += max(0.0, min(gen_finished, ready["exec_finished"])
+                                                 - max(gen_started, ready["exec_started"]))
+                if next_cmd:
+                    cmd = optimize_command_intelligently(next_cmd, container_state)
+                    pipeline_stats["used"] += 1
                 else:
-                    print("❌ Recovery failed")
-                    return False, current_path
+                    pipeline_stats["discarded"] += 1
+            ready = None
+
+            if cmd:
+                print(f"🤖 Command: {command_text(cmd)}")
             else:
-                print("❌ Could not recover from error")
+                cmd = generate_step_command(user_input, steps, step_index, step_results,
+                                            current_path, container_state, model=model)
+
+            if not cmd:
+                print("❌ No command generated")
                 return False, current_path
 
-    return True, current_path
+            cmd, container_state = prepare_command(
+                container, step, cmd, current_path, step_results, messages, container_state,
+                regenerate=lambda results: generate_step_command(user_input, steps, step_index, results,
+                                                                 current_path, container_state, model=model)
+            )
+
+            if pipeline and not batch and step_index < len(steps) and not command_text(cmd).startswith("cd "):
+                speculation = speculate_next_command(pipeline, user_input, steps, step_index, step,
+                                                     cmd, step_results, current_path, container_state)
+                pipeline_stats["speculated"] += 1
+
+            checkpoint = take_checkpoint(container, cmd, current_path)
+            exec_started = time.monotonic()
+            execution_result = execute_step(container, cmd, current_path)
+            exec_finished = time.monotonic()
+            current_path = execution_result["new_path"]
+
+            # The batch assumed every step succeeds; once that is false the rest is regenerated
+            if batch and (not execution_result["success"] or execution_result.get("failed_command")):
+                print("🔀 Execution diverged from the batched plan, generating remaining steps individually")
+                batch = None
+
+            if execution_result["success"]:
+                if checkpoint:
+                    checkpoints.discard(checkpoint)
+                container_state = state_tracker(container).update(command_text(cmd), current_path)
+                record_step(step, cmd, execution_result, step_results, messages)
+
+            if speculation:
+                if speculation_still_valid(speculation, execution_result, current_path, container_state):
+                    ready = dict(speculation, exec_started=exec_started, exec_finished=exec_finished)
+                else:
+                    pipeline_stats["discarded"] += 1
+                speculation = None
+
+            if not execution_result["success"]:
+                recovered, current_path, container_state = recover_and_retry(
+                    container, execution_result, user_input, step, cmd, current_path,
+                    step_results, messages, container_state, checkpoint
+                )
+                if not recovered:
+                    return False, current_path
 
+        return True, current_path
 
-def initialize_docker():
-    try:
-        client = docker.from_env()
-        client.ping()
-        print("✅ Docker connected")
+    finally:
+        if pipeline:
+            pipeline.shutdown(wait=False, cancel_futures=True)
+            if pipeline_stats["speculated"]:
+                print(f"⏩ Pipeline: {pipeline_stats['used']}/{pipeline_stats['speculated']} speculative "
+                      f"commands used, {pipeline_stats['discarded']} discarded, "
+                      f"{pipeline_stats['overlap']:.1f}s of generation overlapped with execution")
+
+
+def execute_plan_waves(container, steps, commands, waves, user_input, current_path,
+                       step_results, messages, container_state):
+    print(f"🧩 {len(steps)} steps in {len(waves)} waves")
+    commands = list(commands)
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_STEPS) as workers:
+        for wave_number, wave in enumerate(waves, 1):
+            # prerequisites run one at a time before the wave, never alongside it
+            for i in wave:
+                commands[i], container_state = prepare_command(container, steps[i], commands[i], current_path,
+                                                               step_results, messages, container_state)
+            wave_checkpoints = {i: take_checkpoint(container, commands[i], current_path) for i in wave}
+            if len(wave) == 1:
+                print(f"\n➡️ [{wave[0] + 1}/{len(steps)}] {steps[wave[0]]}")
+                print(f"🤖 Command: {command_text(commands[wave[0]])}")
+                results = {wave[0]: execute_step(container, commands[wave[0]], current_path)}
+            else:
+                print(f"\n🔀 Wave {wave_number}: steps {', '.join(str(i + 1) for i in wave)} in parallel")
+                futures = {i: workers.submit(contextvars.copy_context().run, execute_step,
+                                             container, commands[i], current_path, True)
+                           for i in wave}
+                results = {i: future.result() for i, future in futures.items()}
+                for i in wave:
+                    outcome = "✅ OK" if results[i]["success"] else \
+                        f"❌ Failed (exit {results[i]['exit_code']}): {results[i]['error']}"
+                    print(f"⚙️ [{i + 1}/{len(steps)}] {command_text(commands[i])}: {outcome}")
+
+            # Results are folded in plan order so history and recovery see a sequential run
+            for i in wave:
+                cmd, execution_result = commands[i], results[i]
+                current_path = execution_result["new_path"]
+                if execution_result["success"]:
+                    if wave_checkpoints[i]:
+                        checkpoints.discard(wave_checkpoints[i])
+                    container_state = state_tracker(container).update(command_text(cmd), current_path)
+                    record_step(steps[i], cmd, execution_result, step_results, messages)
+                    continue
+
+                recovered, current_path, container_state = recover_and_retry(
+                    container, execution_result, user_input, steps[i], cmd, current_path,
+                    step_results, messages, container_state, wave_checkpoints[i]
+                )
+                if not recovered:
+                    return False, current_path
 
+    return True, current_path
+
+
+def package_cache_volumes(client):
+    import docker
+    volumes = {}
+    for name, path in PACKAGE_CACHE_VOLUMES.items():
         try:
-            client.images.get(DOCKER_IMAGE)
-            print(f"✅ Image {DOCKER_IMAGE} found locally")
-        except docker.errors.ImageNotFound:
-            print(f"📥 Pulling {DOCKER_IMAGE}...")
-            client.images.pull(DOCKER_IMAGE)
-            print(f"✅ Image {DOCKER_IMAGE} pulled successfully")
+            client.volumes.get(name)
+        except docker.errors.NotFound:
+            client.volumes.create(name, labels={"ollamacontrol.cache": "packages"})
+            print(f"📦 Created shared cache volume {name}")
+        volumes[name] = {"bind": path, "mode": "rw"}
+    return volumes
 
-        container = client.containers.run(
-            DOCKER_IMAGE, "sleep infinity", tty=True, detach=True, remove=True
-        )
-        print(f"✅ Container {container.name} started")
 
-        setup_container(container)
+def container_pool(refresh_image=REFRESH_BASE_IMAGE, size=WARM_POOL_SIZE):
+    # docker and ollama are imported where they are first used, so --help and --check start instantly
+    import docker
+    client = docker.from_env()
+    client.ping()
+    print("✅ Docker connected")
+
+    image = provisioned_image(client, refresh=refresh_image)
+    run_options = {"volumes": package_cache_volumes(client)} if USE_SHARED_PACKAGE_CACHE else None
+    return get_pool(client, image, size, run_options)
+
+
+def initialize_docker(refresh_image=REFRESH_BASE_IMAGE):
+    try:
+        container = container_pool(refresh_image).acquire()
+        print(f"✅ Container {container.name} started")
         return container
 
     except Exception as e:
@@ -276,15 +718,99 @@ def initialize_docker():
         raise
 
 
+def handle_request(container, user_input, current_path, messages, record=None):
+    messages.append({"role": "user", "content": user_input})
+    del messages[:-MAX_HISTORY_MESSAGES]
+
+    print("🔍 Checking container state...")
+    container_state = state_tracker(container).current(current_path)
+
+    started = time.monotonic()
+    session = current_session.get() or container.name
+    past_runs = history.similar_successes(user_input)
+
+    route, model = router.route(user_input)
+    if route == "direct":
+        print(f"🚦 Simple request, skipping the planner ({model})")
+        plan = {"linuxcommand": [user_input], "depends_on": None}
+    else:
+        print("🤔 Planning...")
+        plan = linux_step_planning(user_input, current_path, messages, container_state, past_runs)
+
+    if not plan or not plan.get("linuxcommand"):
+        print("❌ No plan generated")
+        messages.pop()
+        history.record(session, container.name, user_input, current_path, None, [], False,
+                       time.monotonic() - started)
+        return current_path, False
+
+    steps, depends_on = coalesce_installs(plan["linuxcommand"], plan.get("depends_on"))
+    if len(steps) < len(plan["linuxcommand"]):
+        print(f"📦 Merged install steps: {len(plan['linuxcommand'])} → {len(steps)} steps")
+    print(f"\n📋 Plan ({len(steps)} steps):")
+    for i, step in enumerate(steps, 1):
+        print(f"  [{i}] {step}")
+
+    step_results = []
+    if record is not None:
+        record.update(plan=steps, depends_on=depends_on, steps=step_results)
+    plan_path = current_path
+    success, current_path = execute_plan_with_recovery(
+        container, steps, user_input, current_path, step_results, messages, container_state,
+        dependencies=depends_on, model=model
+    )
+    router.record_outcome(route, model, success)
+
+    if not success and route == "planner":
+        forget_plan(user_input, plan_path, container_state)
+    history.record(session, container.name, user_input, plan_path, steps, step_results, success,
+                   time.monotonic() - started)
+
+    print(f"\n{'✅ All steps completed successfully' if success else '⚠️ Execution failed'}")
+    return current_path, success
+
+
+def print_run_stats():
+    routes = router.summary()["routes"]
+    if routes:
+        print("🚦 Routes: " + ", ".join(f"{key} {stats['successes']}/{stats['runs']} ok"
+                                       for key, stats in sorted(routes.items())))
+    stats = rule_stats()
+    if stats["hits"]:
+        hits = ", ".join(f"{rule}={count}" for rule, count in sorted(stats["hits"].items()))
+        print(f"⚡ Fast-path rules: {hits} (model fallbacks: {stats['llm_fallbacks']})")
+    checks = check_stats()
+    if checks:
+        print("🔎 Caught before running: " + ", ".join(f"{name}={count}" for name, count in sorted(checks.items())))
+    for name, cache in (("plans", plan_cache), ("commands", command_cache)):
+        stats = cache.stats()
+        if stats["hits"] or stats["misses"]:
+            print(f"💾 Cache {name}: {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['entries']} entries")
+
+
 def main():
-    container = None
+    parser = argparse.ArgumentParser(description="Run Linux requests in a Docker container with Ollama")
+    parser.add_argument("--refresh-image", action="store_true", default=REFRESH_BASE_IMAGE,
+                        help="rebuild the provisioned base image")
+    parser.add_argument("--no-warm-up", action="store_true", help="load the models on first use instead")
+    args = parser.parse_args()
 
+    container = None
     try:
-        container = initialize_docker()
+        start_metrics_server()
+        # the container and the models come up side by side; only the container is waited for
+        startup = Startup()
+        if not args.no_warm_up:
+            warm_up_models(startup)
+        startup.start("Container", initialize_docker, args.refresh_image)
+        container = startup.wait("Container")
         current_path = "/"
         messages = []
 
-        print(f"\n🎉 Ready. Current directory: {current_path}")
+        print(f"\n🎉 Ready after {startup.elapsed():.1f}s. Current directory: {current_path}")
+        if startup.pending():
+            print(f"⏳ Still loading: {', '.join(startup.pending())}")
         print(f"📅 Current time: {get_current_time()} UTC")
         print(f"👤 User: {USER_LOGIN}")
 
@@ -296,30 +822,13 @@ def main():
             if not user_input.strip():
                 continue
 
-            messages.append({"role": "user", "content": user_input})
-
-            print("🔍 Checking container state...")
-            container_state = check_container_state(container, current_path)
-
-            print("🤔 Planning...")
-            plan = linux_step_planning(user_input, current_path, messages, container_state)
-
-            if not plan or not plan.get("linuxcommand"):
-                print("❌ No plan generated")
-                messages.pop()
-                continue
-
-            steps = plan["linuxcommand"]
-            print(f"\n📋 Plan ({len(steps)} steps):")
-            for i, step in enumerate(steps, 1):
-                print(f"  [{i}] {step}")
-
-            step_results = []
-            success, current_path = execute_plan_with_recovery(
-                container, steps, user_input, current_path, step_results, messages, container_state
-            )
-
-            print(f"\n{'✅ All steps completed successfully' if success else '⚠️ Execution failed'}")
+            with span("request", input=user_input) as request_span:
+                try:
+                    current_path, _ = handle_request(container, user_input, current_path, messages)
+                except KeyboardInterrupt:
+                    state_tracker(container).invalidate()
+                    print("\n🛑 Request cancelled")
+            print_request_summary(request_span)
 
     except KeyboardInterrupt:
         print("\n🛑 Interrupted by user")
@@ -329,10 +838,13 @@ def main():
         if container:
             print("\n🛑 Stopping container...")
             try:
+                close_session(container)
                 container.stop()
                 print("🗑️ Container stopped")
             except Exception as e:
                 print(f"⚠️ Error stopping container: {e}")
+        close_pools()
+        print_run_stats()
         print("👋 Goodbye")
 
 
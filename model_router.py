@@ -0,0 +1,95 @@
+import os
+import re
+import threading
+from llm_cache import CACHE_DIR, USE_DISK_CACHE, load_json, save_json
+
+PLANNER_MODEL = os.environ.get("OLLAMACONTROL_PLANNER_MODEL", "deepseek-r1:8b-0528-qwen3-fp16")
+GENERATOR_MODEL = os.environ.get("OLLAMACONTROL_GENERATOR_MODEL", "qwen2.5-coder:7b")
+# Optional smaller model tried first for requests that skip the planner
+SMALL_MODEL = os.environ.get("OLLAMACONTROL_SMALL_MODEL", "")
+USE_ROUTER = os.environ.get("OLLAMACONTROL_ROUTER", "1") != "0"
+
+# A direct route stays in use while its smoothed success rate is at least this
+MIN_SUCCESS_RATE = 0.7
+# Optimistic prior: a route starts as if it had succeeded this many times
+PRIOR_SUCCESSES = 3
+# Every Nth simple request retries a route that fell below the threshold
+EXPLORE_EVERY = 10
+LATENCY_SMOOTHING = 0.3
+SIMPLE_MAX_WORDS = 8
+
+SIMPLE_VERBS = {"ls", "pwd", "list", "show", "print", "display", "which", "whoami", "cat", "where",
+                "what", "date", "uname", "df", "du", "find", "check", "env", "whats", "view", "read"}
+MULTI_STEP = re.compile(r"\b(and|then|after|before|also)\b|[;,&|]")
+
+
+def classify(request):
+    """"simple" for one-shot lookups like "ls" or "show the files here", "complex" otherwise"""
+    words = re.findall(r"[\w'.-]+", request.lower())
+    if not words or len(words) > SIMPLE_MAX_WORDS or MULTI_STEP.search(request.lower()):
+        return "complex"
+    return "simple" if words[0].replace("'", "") in SIMPLE_VERBS else "complex"
+
+
+class ModelRouter:
+    """Sends simple requests straight to generation and learns which routes keep working"""
+
+    def __init__(self, persist=USE_DISK_CACHE):
+        self.path = os.path.join(CACHE_DIR, "router.json") if persist else None
+        self.models = {}
+        self.routes = {}
+        self._simple_seen = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def route(self, request):
+        """("direct", model) to skip the planner, ("planner", generator model) otherwise"""
+        if not USE_ROUTER or classify(request) != "simple":
+            return "planner", GENERATOR_MODEL
+
+        candidates = list(dict.fromkeys(m for m in (SMALL_MODEL, GENERATOR_MODEL) if m))
+        with self._lock:
+            self._simple_seen += 1
+            explore = self._simple_seen % EXPLORE_EVERY == 0
+            # the fastest healthy model wins; unmeasured models keep their configured order
+            candidates.sort(key=lambda m: self.models.get(m, {}).get("latency", 0.0))
+            for model in candidates:
+                if explore or self._success_rate(f"direct:{model}") >= MIN_SUCCESS_RATE:
+                    return "direct", model
+        return "planner", GENERATOR_MODEL
+
+    def record_call(self, model, seconds, ok):
+        with self._lock:
+            stats = self.models.setdefault(model, {"calls": 0, "errors": 0, "latency": seconds})
+            stats["calls"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["latency"] += LATENCY_SMOOTHING * (seconds - stats["latency"])
+
+    def record_outcome(self, route, model, success):
+        key = f"direct:{model}" if route == "direct" else route
+        with self._lock:
+            stats = self.routes.setdefault(key, {"runs": 0, "successes": 0})
+            stats["runs"] += 1
+            stats["successes"] += 1 if success else 0
+            self._save()
+
+    def summary(self):
+        with self._lock:
+            routes = {key: dict(stats, rate=round(self._success_rate(key), 2)) for key, stats in self.routes.items()}
+            models = {model: dict(stats) for model, stats in self.models.items()}
+        return {"routes": routes, "models": models}
+
+    def _success_rate(self, key):
+        stats = self.routes.get(key, {"runs": 0, "successes": 0})
+        return (stats["successes"] + PRIOR_SUCCESSES) / (stats["runs"] + PRIOR_SUCCESSES)
+
+    def _load(self):
+        data = load_json(self.path, "router stats") or {}
+        self.routes = data.get("routes", {})
+        self.models = data.get("models", {})
+
+    def _save(self):
+        save_json(self.path, {"routes": self.routes, "models": self.models}, "router stats")
+
+
+router = ModelRouter()
@@ -0,0 +1,72 @@
+import codecs
+import contextvars
+
+OUTPUT_HEAD_BYTES = 8 * 1024
+OUTPUT_TAIL_BYTES = 32 * 1024
+
+
+class OutputBuffer:
+    """Keeps the start and the end of a command's output plus byte counts"""
+
+    def __init__(self, head_bytes=OUTPUT_HEAD_BYTES, tail_bytes=OUTPUT_TAIL_BYTES):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+
+    @property
+    def dropped(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self):
+        head = self.head.decode('utf-8', errors='replace')
+        if not self.dropped:
+            return (head + self.tail.decode('utf-8', errors='replace')).strip()
+
+        tail = self.tail.decode('utf-8', errors='replace')
+        return f"{head}\n... [{self.dropped} bytes omitted] ...\n{tail}".strip()
+
+
+class StreamDecoder:
+    """Turns raw stream chunks into text without splitting multi-byte characters"""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def decode(self, data, final=False):
+        return self._decoder.decode(data, final)
+
+
+# Buffer that prints from the current request should go to instead of the terminal
+routed_output = contextvars.ContextVar("ollamacontrol_output", default=None)
+
+
+class RoutedStdout:
+    """Sends prints to routed_output when the current context sets one"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, text):
+        buffer = routed_output.get()
+        return (buffer if buffer is not None else self.fallback).write(text)
+
+    def flush(self):
+        self.fallback.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
@@ -0,0 +1,130 @@
+import posixpath
+import re
+from container_state import PACKAGE_COMMAND, FILE_VERBS, READ_ONLY_VERBS, simple_commands
+from file_writes import command_text
+
+# Change the shell itself, so later steps must run after them in the same session
+SHELL_STATE_VERBS = {"cd", "pushd", "popd", "export", "unset", "source", ".", "set", "alias",
+                     "declare", "typeset", "readonly", "shopt", "umask", "ulimit"}
+# Rewrite existing files in place, wherever their arguments point
+IN_PLACE_VERBS = {"chmod", "chown", "chgrp", "truncate", "patch", "perl", "setfacl"}
+FIND_ACTIONS = {"-delete", "-exec", "-execdir", "-ok", "-okdir", "-fprint", "-fprintf", "-fls"}
+REDIRECTS = {">", ">>", ">|", "&>", "&>>"}
+
+
+def parse_dependencies(raw, step_count):
+    """The planner's depends_on as 0-based sets, or None when it is missing or invalid.
+
+    Each entry lists the 1-based numbers of earlier steps; anything else
+    (forward references, wrong length) means the plan runs sequentially.
+    """
+    if not isinstance(raw, list) or len(raw) != step_count:
+        return None
+
+    dependencies = []
+    for index, entry in enumerate(raw):
+        if not isinstance(entry, list):
+            return None
+        parents = set()
+        for number in entry:
+            if isinstance(number, bool) or not isinstance(number, int) or not 1 <= number <= index:
+                return None
+            parents.add(number - 1)
+        dependencies.append(parents)
+    return dependencies
+
+
+def step_writes(cmd, current_path):
+    """Top-level entries under current_path a step writes, or None when it has to run on its own.
+
+    None covers anything this cannot bound: writes outside current_path,
+    in-place edits, changes to the shell's directory or environment, reads
+    of that environment (parallel steps run outside the session) and
+    commands it does not know.
+    """
+    commands = simple_commands(cmd)
+    if commands is None or re.search(r"\$[A-Za-z_{]", cmd):
+        return None
+
+    targets = set()
+    for words, _ in commands:
+        if words and words[0] == "sudo":
+            words = words[1:]
+        assignments = 0
+        while assignments < len(words) and re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", words[assignments]):
+            assignments += 1
+        if words and assignments == len(words):
+            # a bare assignment sets a shell variable
+            return None
+        words = words[assignments:]
+
+        args = []
+        i = 0
+        while i < len(words):
+            if words[i] in REDIRECTS and i + 1 < len(words):
+                targets.add(words[i + 1])
+                i += 2
+                continue
+            args.append(words[i])
+            i += 1
+        if not args:
+            continue
+
+        verb = posixpath.basename(args[0])
+        if verb in SHELL_STATE_VERBS or verb in IN_PLACE_VERBS:
+            return None
+        if verb == "sed" and any(a.startswith("-i") or a.startswith("--in-place") for a in args[1:]):
+            return None
+        if verb == "find" and FIND_ACTIONS & set(args[1:]):
+            return None
+        if verb in FILE_VERBS:
+            targets.update(a for a in args[1:] if not a.startswith("-"))
+        elif verb not in READ_ONLY_VERBS:
+            return None
+
+    tops = set()
+    for target in targets:
+        if target.isdigit() or target == "/dev/null":
+            continue
+        rel = posixpath.relpath(posixpath.normpath(posixpath.join(current_path, target)), current_path)
+        if rel == "." or rel.startswith(".."):
+            return None
+        tops.add(rel.split("/", 1)[0])
+    return tops
+
+
+def step_footprint(cmd, current_path):
+    """Top-level paths a command writes (None if it must run alone) and whether it uses a package manager"""
+    if not isinstance(cmd, str):
+        return None, False
+    return step_writes(cmd, current_path), bool(PACKAGE_COMMAND.search(f" {cmd} "))
+
+
+def conflicts(cmd, footprint, other_cmd, other_footprint):
+    writes, package = footprint
+    other_writes, other_package = other_footprint
+    if writes is None or other_writes is None:
+        return True
+    if package and other_package:
+        # apt and pip both take locks, so installs never overlap
+        return True
+    return (bool(writes & other_writes)
+            or any(path in other_cmd for path in writes)
+            or any(path in cmd for path in other_writes))
+
+
+def schedule_waves(commands, dependencies, current_path):
+    """Group step indexes into waves; steps in one wave neither depend on nor conflict with each other"""
+    commands = [command_text(cmd) for cmd in commands]
+    footprints = [step_footprint(cmd, current_path) for cmd in commands]
+    wave_of = []
+    for index, cmd in enumerate(commands):
+        after = set(dependencies[index])
+        after.update(j for j in range(index)
+                     if conflicts(cmd, footprints[index], commands[j], footprints[j]))
+        wave_of.append(max((wave_of[j] for j in after), default=-1) + 1)
+
+    waves = [[] for _ in range(max(wave_of, default=-1) + 1)]
+    for index, wave in enumerate(wave_of):
+        waves[wave].append(index)
+    return waves
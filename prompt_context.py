@@ -0,0 +1,149 @@
+import os
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("OLLAMACONTROL_PROMPT_TOKENS", "3000"))
+# Shares of the budget for the variable sections; the rest is the fixed rules and examples
+RESULTS_SHARE = 0.30
+STATE_SHARE = 0.20
+HISTORY_SHARE = 0.10
+PAST_RUNS_SHARE = 0.10
+KEEP_RECENT_RESULTS = 3
+OUTPUT_PREVIEW_CHARS = 300
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def section_budget(share):
+    return int(PROMPT_TOKEN_BUDGET * share)
+
+
+def truncate(text, max_chars):
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 1] + "…"
+
+
+def format_items(items, budget):
+    """Comma-joined list cut to the budget, saying how many entries were left out"""
+    if not items:
+        return "none"
+
+    shown, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item) + 1
+        if used + cost > budget:
+            break
+        shown.append(item)
+        used += cost
+
+    text = ", ".join(shown)
+    if len(shown) < len(items):
+        text += f" (+{len(items) - len(shown)} more)"
+    return text
+
+
+def build_previous_context(previous_results, budget=None, header="Previous steps completed"):
+    """Recent results verbatim, older ones squeezed into one summary line"""
+    if not previous_results:
+        return ""
+    budget = budget or section_budget(RESULTS_SHARE)
+
+    lines = []
+    used = 0
+    recent = previous_results[-KEEP_RECENT_RESULTS:]
+    for i, result in enumerate(reversed(recent)):
+        line = f"- {result['step']}: {result['command']} → {result['result']}"
+        if i == 0 and result.get("output"):
+            line += f"\n  output: {truncate(result['output'][-OUTPUT_PREVIEW_CHARS * 4:], OUTPUT_PREVIEW_CHARS)}"
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines.insert(0, line)
+        used += cost
+
+    older = previous_results[:len(previous_results) - len(lines)]
+    if older:
+        room = max((budget - used) * 4, 0)
+        # the most recent of the older commands matter most, so cut from the front
+        summary = "; ".join(r['command'] for r in older)
+        if len(summary) > room - 40:
+            summary = "…" + summary[-(room - 40):] if room > 80 else ""
+        lines.insert(0, f"- {len(older)} earlier steps" + (f": {summary}" if summary else " (omitted)"))
+
+    return f"\n{header}:\n" + "\n".join(lines) + "\n"
+
+
+def build_history_context(conversation_history, budget=None):
+    if not conversation_history:
+        return ""
+    budget = budget or section_budget(HISTORY_SHARE)
+
+    entries, used = [], 0
+    for msg in reversed(conversation_history[-6:]):
+        if 'role' not in msg:
+            continue
+        entry = f"- {msg['role']}: {truncate(msg['content'], 300)}"
+        cost = estimate_tokens(entry)
+        if used + cost > budget:
+            break
+        entries.insert(0, entry)
+        used += cost
+
+    if not entries:
+        return ""
+    return "Recent conversation:\n" + "\n".join(entries) + "\n\n"
+
+
+def build_past_runs_context(past_runs, budget=None):
+    """Earlier successful requests like this one and the commands that did them"""
+    if not past_runs:
+        return ""
+    budget = budget or section_budget(PAST_RUNS_SHARE)
+
+    entries, used = [], 0
+    for run in past_runs:
+        entry = f"- \"{truncate(run['request'], 120)}\" in {run['path']}: {truncate('; '.join(run['commands']), 300)}"
+        cost = estimate_tokens(entry)
+        if used + cost > budget:
+            break
+        entries.append(entry)
+        used += cost
+
+    if not entries:
+        return ""
+    return "Similar past requests that succeeded (reuse their approach when it fits):\n" + "\n".join(entries) + "\n\n"
+
+
+def state_lists(container_state, budget=None, query=None):
+    """directories/files/python_packages rendered within the state share of the budget.
+
+    With a query and an index, entries and packages named in the query come
+    first, wherever they are in the tree, instead of the alphabetical first few.
+    """
+    budget = budget or section_budget(STATE_SHARE)
+    directories = container_state.get('directories', [])
+    files = container_state.get('files', [])
+    packages = container_state.get('python_packages', [])
+    index = container_state.get('index')
+    if query and index is not None and container_state.get('path'):
+        relevant = index.relevant(container_state['path'], query, len(directories) + len(files))
+        directories = [p for p, kind in relevant if kind == "d"] + directories
+        files = [p for p, kind in relevant if kind == "f"] + files
+        directories, files = list(dict.fromkeys(directories)), list(dict.fromkeys(files))
+        packages = index.relevant_packages(packages, query)
+    return {
+        "directories": format_items(directories, budget * 3 // 10),
+        "files": format_items(files, budget * 4 // 10),
+        "python_packages": format_items(packages, budget * 3 // 10)
+    }
+
+
+def report_prompt(name, prompt):
+    tokens = estimate_tokens(prompt)
+    print(f"📏 {name} prompt: ~{tokens} tokens" + (" (over budget)" if tokens > PROMPT_TOKEN_BUDGET else ""))
+    return tokens
+
+
+def build_messages(prefix, context):
+    """Static instructions as the system message, everything call-specific in the user message after it"""
+    return [{"role": "system", "content": prefix}, {"role": "user", "content": context}]
@@ -0,0 +1,132 @@
+import os
+import re
+import shlex
+import threading
+from llm_cache import CACHE_DIR, USE_DISK_CACHE, load_json, save_json
+
+PYTHON_TOOLS = {"pytest", "flask", "django-admin", "black", "flake8", "pylint", "mypy", "isort",
+                "ruff", "uvicorn", "gunicorn", "jupyter", "ipython", "poetry", "pipenv", "tox"}
+PYTHON_PACKAGES = PYTHON_TOOLS | {"requests", "numpy", "pandas", "django", "fastapi", "pyyaml",
+                                  "scipy", "matplotlib", "pillow", "beautifulsoup4"}
+MODULE_PACKAGES = {"yaml": "pyyaml", "cv2": "opencv-python", "PIL": "pillow",
+                   "sklearn": "scikit-learn", "bs4": "beautifulsoup4", "dotenv": "python-dotenv"}
+APT_PACKAGES = {"git": "git", "curl": "curl", "wget": "wget", "make": "make", "gcc": "gcc",
+                "g++": "g++", "unzip": "unzip", "zip": "zip", "tree": "tree", "jq": "jq",
+                "vim": "vim", "less": "less", "ps": "procps", "pkill": "procps", "ping": "iputils-ping",
+                "ip": "iproute2", "node": "nodejs", "npm": "npm", "python3": "python3",
+                "python": "python-is-python3", "file": "file", "sqlite3": "sqlite3"}
+
+APT_INSTALL = "DEBIAN_FRONTEND=noninteractive apt-get install -y {}"
+ENSURE_PIP = "command -v pip3 >/dev/null || " + APT_INSTALL.format("python3-pip")
+
+
+def install_commands(name):
+    """Commands that provide a missing command, or None when it is not a known one"""
+    if name in ("pip", "pip3"):
+        return [APT_INSTALL.format("python3-pip")]
+    if name in PYTHON_TOOLS:
+        return [ENSURE_PIP, f"pip3 install {shlex.quote(name)}"]
+    if name in APT_PACKAGES:
+        return [APT_INSTALL.format(APT_PACKAGES[name])]
+    return None
+
+
+def _missing_command(match):
+    return install_commands(match["name"])
+
+
+def _unlocatable_package(match):
+    name = match["name"]
+    if name.lower() in PYTHON_PACKAGES:
+        return [ENSURE_PIP, f"pip3 install {shlex.quote(name)}"]
+    return ["DEBIAN_FRONTEND=noninteractive apt-get update -y"]
+
+
+def _missing_module(match):
+    module = match["name"].split(".")[0]
+    return [ENSURE_PIP, f"pip3 install {shlex.quote(MODULE_PACKAGES.get(module, module))}"]
+
+
+def _missing_parent(match):
+    parent = os.path.dirname(match["name"])
+    return [f"mkdir -p {shlex.quote(parent)}"] if parent else None
+
+
+# A missing cd target is left to the model: creating it would run the rest of the step in an empty directory
+BUILTIN_PATTERNS = [
+    ("command_not_found", r"(?:^|: )(?P<name>[\w.+-]+): (?:command )?not found", _missing_command),
+    ("unable_to_locate", r"E: Unable to locate package (?P<name>[\w.+-]+)", _unlocatable_package),
+    ("missing_module", r"No module named '?(?P<name>[\w.]+)'?", _missing_module),
+    ("redirect_missing", r"^bash: (?:line \d+: )?(?P<name>[^:\s]+/[^:\s/]+): No such file or directory",
+     _missing_parent),
+    # the apt archive is a volume shared by every container, lock file included
+    ("dpkg_lock", r"Could not get lock /var/(?:lib/dpkg|lib/apt/lists|cache/apt/archives)/lock",
+     lambda match: ["sleep 5"]),
+]
+COMPILED_PATTERNS = [(name, re.compile(pattern, re.MULTILINE), build)
+                     for name, pattern, build in BUILTIN_PATTERNS]
+
+
+def command_verb(command):
+    words = [w for w in command.split() if not re.match(r"^[A-Za-z_][A-Za-z0-9_]*=", w)]
+    return os.path.basename(words[0]) if words else ""
+
+
+def error_signature(error, exit_code, failed_command):
+    """Reduce an error to the parts that stay the same across occurrences"""
+    text = re.sub(r"bash: (?:eval: )?line \d+: ", "bash: ", error or "")
+    text = re.sub(r"\b0x[0-9a-f]+\b|\b\d+\b", "#", text)
+    text = " ".join(text.split())[:200]
+    return f"{command_verb(failed_command)}|{exit_code}|{text}"
+
+
+class RecoveryKnowledgeBase:
+    """Maps error signatures to recovery commands that already worked once"""
+
+    def __init__(self, persist=USE_DISK_CACHE):
+        self.path = os.path.join(CACHE_DIR, "recovery_kb.json") if persist else None
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def lookup(self, error, exit_code, failed_command):
+        signature = error_signature(error, exit_code, failed_command)
+        with self._lock:
+            entry = self.entries.get(signature)
+            if entry:
+                return signature, list(entry["commands"])
+
+        for name, pattern, build in COMPILED_PATTERNS:
+            match = pattern.search(error or "")
+            if match:
+                commands = build(match)
+                if commands:
+                    return f"{name}:{match['name'] if 'name' in pattern.groupindex else ''}", commands
+        return None, None
+
+    def learn(self, error, exit_code, failed_command, commands):
+        if not commands:
+            return
+        signature = error_signature(error, exit_code, failed_command)
+        with self._lock:
+            self.entries[signature] = {"commands": list(commands), "successes": 1, "failures": 0}
+            self._save()
+
+    def record_outcome(self, signature, success):
+        with self._lock:
+            entry = self.entries.get(signature)
+            if not entry:
+                return
+            entry["successes" if success else "failures"] += 1
+            if entry["failures"] > entry["successes"]:
+                del self.entries[signature]
+            self._save()
+
+    def _load(self):
+        self.entries = load_json(self.path, "recovery knowledge base") or {}
+
+    def _save(self):
+        save_json(self.path, self.entries, "recovery knowledge base", indent=1)
+
+
+recovery_kb = RecoveryKnowledgeBase()
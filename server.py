@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from main import container_pool, handle_request, state_tracker, get_current_time, warm_up_models
+from startup import Startup
+from shell_session import close_session
+from container_pool import close_pools
+from llm_scheduler import current_session, scheduler
+from tracing import span, print_request_summary, start_metrics_server
+from output_buffer import RoutedStdout, routed_output
+
+SERVER_HOST = os.environ.get("OLLAMACONTROL_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.environ.get("OLLAMACONTROL_SERVER_PORT", "8765"))
+MAX_SESSIONS = int(os.environ.get("OLLAMACONTROL_MAX_SESSIONS", "8"))
+SESSION_IDLE_TIMEOUT = int(os.environ.get("OLLAMACONTROL_SESSION_IDLE", "900"))
+REAP_INTERVAL = 30
+
+
+class Session:
+    def __init__(self, container):
+        self.id = uuid.uuid4().hex[:12]
+        self.container = container
+        self.current_path = "/"
+        self.messages = []
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        # set before the container stops, so requests still queued on lock do not run
+        self.closed = False
+
+    def describe(self):
+        return {
+            "session": self.id,
+            "container": self.container.name,
+            "path": self.current_path,
+            "messages": len(self.messages),
+            "idle_s": round(time.monotonic() - self.last_used, 1),
+            "busy": self.lock.locked()
+        }
+
+
+class SessionServer:
+    """One container, history and working directory per session; requests run on a worker pool"""
+
+    def __init__(self, pool, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.pool = pool
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        # sessions whose container is still being acquired, counted against max_sessions
+        self.starting = 0
+        # each session runs one request at a time; the extra workers cover speculation
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions * 2 + 2)
+
+    async def run_blocking(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, func, *args)
+
+    async def create_session(self):
+        if len(self.sessions) + self.starting >= self.max_sessions:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Too many sessions"}
+        self.starting += 1
+        try:
+            container = await self.run_blocking(self.pool.acquire)
+        finally:
+            self.starting -= 1
+        session = Session(container)
+        self.sessions[session.id] = session
+        print(f"🆕 Session {session.id} on {container.name}")
+        return HTTPStatus.CREATED, session.describe()
+
+    async def run_request(self, session, user_input):
+        async with session.lock:
+            if session.closed:
+                return HTTPStatus.GONE, {"error": "Session closed", "session": session.id}
+            session.last_used = time.monotonic()
+            started = time.perf_counter()
+            output, success = await self.run_blocking(self._run_request, session, user_input)
+            session.last_used = time.monotonic()
+
+        return HTTPStatus.OK, {
+            "session": session.id,
+            "path": session.current_path,
+            "success": success,
+            "duration_s": round(time.perf_counter() - started, 3),
+            "output": output
+        }
+
+    def _run_request(self, session, user_input):
+        buffer = io.StringIO()
+        routed_output.set(buffer)
+        current_session.set(session.id)
+        success = False
+        with span("request", input=user_input, session=session.id) as request_span:
+            try:
+                session.current_path, success = handle_request(
+                    session.container, user_input, session.current_path, session.messages
+                )
+            except Exception as e:
+                state_tracker(session.container).invalidate()
+                print(f"❌ Unexpected error: {e}")
+        print_request_summary(request_span)
+        return buffer.getvalue(), success
+
+    async def close_session(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.closed = True
+        async with session.lock:
+            await self.run_blocking(self._stop, session)
+        return True
+
+    def _stop(self, session):
+        try:
+            close_session(session.container)
+            session.container.stop()
+            print(f"🗑️ Session {session.id} closed, container {session.container.name} stopped")
+        except Exception as e:
+            print(f"⚠️ Error stopping container: {e}")
+
+    async def reap_idle(self):
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            now = time.monotonic()
+            for session in list(self.sessions.values()):
+                if not session.lock.locked() and now - session.last_used > self.idle_timeout:
+                    print(f"💤 Session {session.id} idle for {int(now - session.last_used)}s")
+                    await self.close_session(session.id)
+
+    async def dispatch(self, method, path, body):
+        parts = [p for p in path.split("/") if p]
+        if parts == ["sessions"] and method == "POST":
+            return await self.create_session()
+        if parts == ["sessions"] and method == "GET":
+            return HTTPStatus.OK, {"sessions": [s.describe() for s in self.sessions.values()],
+                                   "models": scheduler.stats()}
+
+        if len(parts) >= 2 and parts[0] == "sessions":
+            session = self.sessions.get(parts[1])
+            if session is None:
+                return HTTPStatus.NOT_FOUND, {"error": "Unknown session"}
+            if len(parts) == 2 and method == "GET":
+                return HTTPStatus.OK, session.describe()
+            if len(parts) == 2 and method == "DELETE":
+                await self.close_session(session.id)
+                return HTTPStatus.OK, {"session": session.id, "closed": True}
+            if parts[2:] == ["requests"] and method == "POST":
+                user_input = (json.loads(body or b"{}").get("input") or "").strip()
+                if not user_input:
+                    return HTTPStatus.BAD_REQUEST, {"error": "Missing input"}
+                return await self.run_request(session, user_input)
+
+        return HTTPStatus.NOT_FOUND, {"error": f"No route for {method} {path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1")
+            method, target, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            body = await reader.readexactly(length) if length else b""
+            status, payload = await self.dispatch(method.upper(), target.split("?", 1)[0], body)
+        except (ValueError, json.JSONDecodeError, asyncio.IncompleteReadError) as e:
+            status, payload = HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def shutdown(self):
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+        self.executor.shutdown(wait=False)
+
+
+async def serve(host, port, pool):
+    app = SessionServer(pool)
+    server = await asyncio.start_server(app.handle_connection, host, port)
+    reaper = asyncio.create_task(app.reap_idle())
+    print(f"\n🎉 Serving on http://{host}:{port} ({app.max_sessions} sessions max)")
+    print(f"📅 Current time: {get_current_time()} UTC")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        reaper.cancel()
+        await app.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve OllamaControl sessions over HTTP")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+
+    sys.stdout = RoutedStdout(sys.stdout)
+    try:
+        start_metrics_server()
+        startup = Startup()
+        warm_up_models(startup)
+        startup.start("Containers", container_pool)
+        pool = startup.wait("Containers")
+        asyncio.run(serve(args.host, args.port, pool))
+    except KeyboardInterrupt:
+        print("\n🛑 Interrupted by user")
+    finally:
+        close_pools()
+        print("👋 Goodbye")
+
+
+if __name__ == "__main__":
+    main()
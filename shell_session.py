@@ -0,0 +1,253 @@
+import shlex
+import socket
+import struct
+import threading
+import time
+import uuid
+from output_buffer import OutputBuffer, StreamDecoder
+
+STDOUT = 1
+STDERR = 2
+KILL_GRACE = 3
+
+KILL_TREE = (
+    '_oc_kill_tree() { local c; for c in $(grep -l "^PPid:[[:space:]]*$1$" /proc/[0-9]*/status '
+    '2>/dev/null | cut -d/ -f3); do _oc_kill_tree "$c"; kill -KILL "$c" 2>/dev/null; done; }; '
+    '_oc_kill_tree %d'
+)
+
+_sessions = {}
+_unavailable = set()
+_sessions_lock = threading.Lock()
+
+
+class ShellSessionError(Exception):
+    pass
+
+
+class ShellSession:
+    """Long-lived bash attached to a container, one framed command at a time"""
+
+    def __init__(self, container):
+        self.container = container
+        self.cwd = "/"
+        self._lock = threading.Lock()
+        self._token = uuid.uuid4().hex[:12]
+        self._counter = 0
+        self._pending = b""
+        self._closed = False
+
+        api = container.client.api
+        exec_id = api.exec_create(
+            container.id, ["bash", "--noprofile", "--norc"],
+            stdin=True, stdout=True, stderr=True, tty=False
+        )["Id"]
+        self._socket = api.exec_start(exec_id, socket=True)
+        # docker-py hands back a SocketIO wrapper on unix sockets
+        self._raw = getattr(self._socket, "_sock", self._socket)
+        self.shell_pid = int(self.run("echo $$")[1])
+
+    def run(self, command, current_path="/", on_output=None, timeout=None):
+        with self._lock:
+            if self._closed:
+                raise ShellSessionError("session is closed")
+
+            self._counter += 1
+            marker = f"__OC_{self._token}_{self._counter}__".encode()
+            # eval keeps the framing line parseable whatever the command contains,
+            # and still runs in this shell so cd/export carry over to the next command
+            script = (
+                f"__oc_cmd={shlex.quote(command)}\n"
+                f"cd -- {shlex.quote(current_path)} && eval \"$__oc_cmd\" </dev/null\n"
+                f"__oc_rc=$?; printf '\\n%s %d %s\\n' {marker.decode()} \"$__oc_rc\" \"$PWD\"; "
+                f"printf '\\n%s\\n' {marker.decode()} >&2\n"
+            )
+            self._send(script.encode())
+            return self._collect(marker, on_output, timeout)
+
+    def close(self):
+        self._closed = True
+        try:
+            self._send(b"exit\n")
+        except Exception:
+            pass
+        try:
+            self._socket.close()
+        except Exception:
+            pass
+
+    def _send(self, data):
+        try:
+            self._raw.sendall(data)
+        except OSError as e:
+            self._closed = True
+            raise ShellSessionError(f"write failed: {e}")
+
+    def _recv_frame(self, deadline=None):
+        while True:
+            if len(self._pending) >= 8:
+                stream, size = struct.unpack(">BxxxL", self._pending[:8])
+                if len(self._pending) >= 8 + size:
+                    payload = self._pending[8:8 + size]
+                    self._pending = self._pending[8 + size:]
+                    return stream, payload
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._raw.settimeout(remaining)
+            try:
+                chunk = self._raw.recv(65536)
+            except socket.timeout:
+                return None
+            finally:
+                if deadline is not None:
+                    self._raw.settimeout(None)
+
+            if not chunk:
+                self._closed = True
+                raise ShellSessionError("shell exited")
+            self._pending += chunk
+
+    def _collect(self, marker, on_output, timeout):
+        stdout = _FramedStream(b"\n" + marker + b" ", "stdout", on_output)
+        stderr = _FramedStream(b"\n" + marker + b"\n", "stderr", on_output)
+        deadline = time.monotonic() + timeout if timeout else None
+        stopped = None
+
+        while not (stdout.done and b"\n" in stdout.trailer and stderr.done):
+            try:
+                frame = self._recv_frame(deadline)
+            except KeyboardInterrupt:
+                if stopped:
+                    break
+                stopped = "cancelled"
+                deadline = self._stop_running()
+                continue
+            except ShellSessionError:
+                if stopped:
+                    break
+                raise
+
+            if frame is None:
+                if stopped:
+                    break
+                stopped = "timeout"
+                deadline = self._stop_running()
+                continue
+
+            stream, payload = frame
+            (stdout if stream == STDOUT else stderr).feed(payload)
+
+        stdout.finish()
+        stderr.finish()
+
+        exit_code = -1
+        if stdout.done and b"\n" in stdout.trailer:
+            exit_code_text, _, cwd = stdout.trailer.split(b"\n", 1)[0].decode().partition(" ")
+            exit_code = int(exit_code_text)
+            self.cwd = cwd or self.cwd
+
+        out, err = stdout.buffer.text(), stderr.buffer.text()
+        if stopped:
+            self.close()
+        if stopped == "cancelled":
+            raise KeyboardInterrupt
+        if stopped == "timeout":
+            err = f"{err}\nCommand timed out after {timeout}s".strip()
+            exit_code = 124
+        return exit_code, out, err
+
+    def _stop_running(self):
+        # The rest of a ; list would keep going after its child dies, so the shell
+        # goes too; the next command gets a fresh session
+        try:
+            self.container.exec_run(["bash", "-c", KILL_TREE % self.shell_pid])
+            self.container.exec_run(["kill", "-KILL", str(self.shell_pid)])
+        except Exception as e:
+            print(f"⚠️ Could not stop running command: {e}")
+        return time.monotonic() + KILL_GRACE
+
+
+class _FramedStream:
+    """One side of the session output, holding back bytes that could start the end marker"""
+
+    def __init__(self, tag, name, on_output):
+        self.tag = tag
+        self.name = name
+        self.on_output = on_output
+        self.buffer = OutputBuffer()
+        self.decoder = StreamDecoder()
+        self.pending = b""
+        self.trailer = b""
+        self.done = False
+
+    def feed(self, data):
+        if self.done:
+            self.trailer += data
+            return
+
+        self.pending += data
+        pos = self.pending.find(self.tag)
+        if pos != -1:
+            self._emit(self.pending[:pos])
+            self.trailer = self.pending[pos + len(self.tag):]
+            self.pending = b""
+            self.done = True
+            return
+
+        # only hold back a tail that could still grow into the marker
+        hold = self.pending.rfind(b"\n", max(len(self.pending) - len(self.tag) + 1, 0))
+        if hold == -1 or not self.tag.startswith(self.pending[hold:]):
+            hold = len(self.pending)
+        self._emit(self.pending[:hold])
+        self.pending = self.pending[hold:]
+
+    def finish(self):
+        if self.pending:
+            self._emit(self.pending)
+            self.pending = b""
+        if self.on_output:
+            text = self.decoder.decode(b"", final=True)
+            if text:
+                self.on_output(self.name, text)
+
+    def _emit(self, data):
+        if not data:
+            return
+        self.buffer.write(data)
+        if self.on_output:
+            text = self.decoder.decode(data)
+            if text:
+                self.on_output(self.name, text)
+
+
+def get_session(container):
+    """Return the shell session attached to this container, starting one if needed"""
+    key = getattr(container, "id", id(container))
+    with _sessions_lock:
+        if key in _unavailable:
+            return None
+
+        session = _sessions.get(key)
+        if session and not session._closed:
+            return session
+
+        try:
+            session = ShellSession(container)
+        except Exception as e:
+            print(f"⚠️ Shell session unavailable, using one exec per command: {e}")
+            _unavailable.add(key)
+            return None
+        _sessions[key] = session
+        return session
+
+
+def close_session(container):
+    key = getattr(container, "id", id(container))
+    with _sessions_lock:
+        session = _sessions.pop(key, None)
+        _unavailable.discard(key)
+    if session:
+        session.close()
@@ -0,0 +1,43 @@
+import threading
+import time
+from concurrent.futures import Future
+
+_print_lock = threading.Lock()
+
+
+class Startup:
+    """Brings components up side by side and reports each one as soon as it is ready"""
+
+    def __init__(self):
+        self.components = {}
+        self._started = time.perf_counter()
+
+    def start(self, name, func, *args):
+        future = Future()
+
+        def run():
+            try:
+                result = func(*args)
+            except BaseException as e:
+                with _print_lock:
+                    print(f"⚠️ {name} failed after {self.elapsed():.1f}s: {e}")
+                future.set_exception(e)
+            else:
+                with _print_lock:
+                    print(f"✅ {name} ready after {self.elapsed():.1f}s")
+                future.set_result(result)
+
+        # daemon threads, so a model that is still loading never holds up exit
+        threading.Thread(target=run, daemon=True, name=f"startup-{name}").start()
+        self.components[name] = future
+        return future
+
+    def wait(self, name):
+        """Result of the component, raising whatever it raised"""
+        return self.components[name].result()
+
+    def pending(self):
+        return [name for name, future in self.components.items() if not future.done()]
+
+    def elapsed(self):
+        return time.perf_counter() - self._started
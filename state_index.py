@@ -0,0 +1,171 @@
+import posixpath
+import re
+from collections import deque
+
+
+def package_key(name):
+    """pip treats "Foo_Bar", "foo-bar" and "foo.bar" as the same project"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def words(text):
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 2}
+
+
+class StateIndex:
+    """Every indexed path in the container with its type, size and mtime, plus packages and commands.
+
+    Paths are absolute. Existence checks are dict lookups; each directory's
+    children and each word of a file name map to their paths, so listing,
+    dropping a subtree or finding entries a request mentions never scans
+    the whole index. Top-level directories in pruned are left out when the
+    index is rooted at "/".
+    """
+
+    def __init__(self, pruned=()):
+        self.pruned = set(pruned)
+        self.entries = {}
+        self.children = {}
+        self.by_word = {}
+        self.roots = []
+        self.python_packages = {}
+        self.system_packages = set()
+        # names bash can run without a path: PATH executables, builtins, keywords, functions
+        self.executables = set()
+        self.truncated = False
+        # set while the container may have changed since the last probe
+        self.stale = False
+        self.probed_at = None
+
+    def covers(self, path):
+        roots = [root for root in self.roots if path == root or path.startswith(root.rstrip("/") + "/")]
+        return bool(roots) and not (roots == ["/"] and self._pruned(path))
+
+    def _pruned(self, path):
+        return path.strip("/").split("/", 1)[0] in self.pruned
+
+    def add_root(self, root):
+        self.remove_tree(root)
+        self.roots = [r for r in self.roots if not (r == root or r.startswith(root.rstrip("/") + "/"))]
+        self.roots.append(root)
+
+    def add(self, path, kind, size=0, mtime=0.0):
+        if path != "/" and self._pruned(path) and not self.covers(path):
+            return
+        self.entries[path] = (kind, size, mtime)
+        if path != "/":
+            self.children.setdefault(posixpath.dirname(path), set()).add(posixpath.basename(path))
+            for word in words(posixpath.basename(path)):
+                self.by_word.setdefault(word, set()).add(path)
+
+    def _forget(self, path):
+        if self.entries.pop(path, None) is None:
+            return
+        for word in words(posixpath.basename(path)):
+            paths = self.by_word.get(word)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self.by_word[word]
+
+    def remove_tree(self, path):
+        if path not in self.entries and path not in self.children:
+            return
+        self._forget(path)
+        if path != "/":
+            siblings = self.children.get(posixpath.dirname(path))
+            if siblings:
+                siblings.discard(posixpath.basename(path))
+        pending = [path]
+        while pending:
+            directory = pending.pop()
+            for name in self.children.pop(directory, ()):
+                child = posixpath.join(directory, name)
+                self._forget(child)
+                pending.append(child)
+
+    def exists(self, path, kind=None):
+        entry = self.entries.get(posixpath.normpath(path))
+        return entry is not None and (kind is None or entry[0] == kind)
+
+    def listdir(self, path):
+        return sorted(self.children.get(path, ()))
+
+    def walk(self, path, max_depth=None):
+        """(relative path, kind) under path, breadth first so shallow entries come first"""
+        found = []
+        queue = deque([(path, 0)])
+        while queue:
+            directory, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for name in self.listdir(directory):
+                child = posixpath.join(directory, name)
+                kind = self.entries[child][0]
+                found.append((posixpath.relpath(child, path), kind))
+                if kind == "d":
+                    queue.append((child, depth + 1))
+        return found
+
+    def named(self, name, kind=None):
+        """Indexed paths whose last component is name"""
+        keys = words(name)
+        if not keys:
+            return []
+        return sorted(p for p in self.by_word.get(min(keys), ())
+                      if posixpath.basename(p) == name and (kind is None or self.entries[p][0] == kind))
+
+    def has_python_package(self, name):
+        return package_key(name) in self.python_packages
+
+    def has_system_package(self, name):
+        return name.lower() in self.system_packages
+
+    def has_executable(self, name):
+        """True when the name resolves, or when the commands were never probed"""
+        return not self.executables or name in self.executables
+
+    def relevant(self, path, text, limit):
+        """Entries under path (relative, with kind) named like words in text, then its direct children"""
+        prefix = path.rstrip("/") + "/"
+        matches = set()
+        for word in words(text):
+            matches.update(p for p in self.by_word.get(word, ()) if p.startswith(prefix))
+        chosen = {}
+        # shallow matches first; each brings its parent directory so the model sees where it lives
+        for match in sorted(matches, key=lambda p: (p.count("/"), p)):
+            if len(chosen) >= limit:
+                break
+            parent = posixpath.dirname(match)
+            if parent != path:
+                chosen[parent] = None
+            chosen[match] = None
+        for name in self.listdir(path):
+            if len(chosen) >= limit:
+                break
+            chosen.setdefault(posixpath.join(path, name))
+        return [(posixpath.relpath(p, path), self.entries[p][0]) for p in list(chosen)[:limit]]
+
+    def relevant_packages(self, packages, text):
+        """Installed packages named in text first, the rest after"""
+        wanted = words(text)
+        return sorted(packages, key=lambda name: (not wanted & words(name), name))
+
+
+def state_index(container_state):
+    return container_state.get("index") if container_state else None
+
+
+def has_entry(container_state, path, kind=None):
+    """Whether path (relative to the state's directory, or absolute) exists, using the index when there is one"""
+    if not container_state:
+        return False
+    index = state_index(container_state)
+    if index is not None and container_state.get("path"):
+        return index.exists(posixpath.join(container_state["path"], path), kind)
+    listed = []
+    if kind in (None, "d"):
+        listed += container_state.get("directories", [])
+    if kind in (None, "f"):
+        listed += container_state.get("files", [])
+    return posixpath.normpath(path) in listed
@@ -0,0 +1,61 @@
+import pytest
+
+from command_check import fix_command_names, find_prerequisites
+from state_index import StateIndex
+
+
+@pytest.fixture
+def index():
+    index = StateIndex()
+    index.add_root("/app")
+    index.add("/app", "d")
+    index.add("/app/src", "d")
+    index.add("/app/src/pkg", "d")
+    index.executables = {"python3", "pip3", "ls", "echo", "cd", "mkdir", "["}
+    return index
+
+
+@pytest.mark.parametrize("cmd, expected", [
+    ("sudo ls && python x.py", "ls && python3 x.py"),
+    ("FOO=1 pip install flask", "FOO=1 pip3 install flask"),
+    ("if python x.py; then pip show y; fi", "if python3 x.py; then pip3 show y; fi"),
+    ("sudo -u nobody ls", "sudo -u nobody ls"),
+    ('echo "run; python x"', 'echo "run; python x"'),
+    ("echo 'sudo python x' > notes.txt", "echo 'sudo python x' > notes.txt"),
+])
+def test_fix_command_names(index, cmd, expected):
+    assert fix_command_names(cmd, index) == expected
+
+
+def test_cd_into_a_missing_directory_is_rejected(index):
+    cmd, prerequisites, problem = find_prerequisites("cd nothere && ls", "/app", index)
+    assert prerequisites == []
+    assert "nothere" in problem
+
+
+def test_missing_cd_targets_are_not_rejected_from_a_stale_index(index):
+    index.stale = True
+    assert find_prerequisites("cd nothere && ls", "/app", index) == ("cd nothere && ls", [], None)
+
+
+def test_missing_cd_targets_outside_the_working_tree_are_not_rejected(index):
+    index.roots.append("/")
+    assert find_prerequisites("cd /srv/app", "/app", index) == ("cd /srv/app", [], None)
+
+
+def test_cd_to_a_directory_elsewhere_in_the_tree_is_fixed(index):
+    cmd, prerequisites, problem = find_prerequisites("cd pkg && ls", "/app", index)
+    assert (cmd, prerequisites, problem) == ("cd src/pkg && ls", [], None)
+
+
+@pytest.mark.parametrize("cmd", [
+    "if [ -d x ]; then cd x; fi",
+    "[ -d x ] || mkdir x; (cd x && ls)",
+    "for d in a b; do cd $d; done",
+])
+def test_conditions_and_subshells_are_not_followed(index, cmd):
+    assert find_prerequisites(cmd, "/app", index) == (cmd, [], None)
+
+
+def test_missing_redirect_parent_is_created_first(index):
+    assert find_prerequisites("echo hi > out/a.txt", "/app", index) == ("echo hi > out/a.txt", ["mkdir -p out"], None)
@@ -0,0 +1,81 @@
+import pytest
+
+from command_rules import translate_step, coalesce_installs
+from state_index import StateIndex
+
+
+def state_with(path, entries):
+    index = StateIndex()
+    index.add_root(path)
+    for entry, kind in entries:
+        index.add(f"{path}/{entry}", kind)
+    return {"path": path, "index": index, "directories": [], "files": [], "python_packages": []}
+
+
+@pytest.mark.parametrize("step, expected", [
+    ("Install flask using pip3", "pip3 install flask"),
+    ("Install flask, requests and pytest using pip3", "pip3 install flask requests pytest"),
+    ("Install the flask package with pip", "pip3 install flask"),
+    ("Install 'flask==3.0' using pip3", None),
+    ("Install flask==3.0 using pip3", "pip3 install flask==3.0"),
+    ("Install git system package", "DEBIAN_FRONTEND=noninteractive apt-get install -y git"),
+    ("Install curl and git system packages.", "DEBIAN_FRONTEND=noninteractive apt-get install -y curl git"),
+    ("Check if flask is installed", "command -v flask || pip3 show flask"),
+    ("Run pytest", "python3 -m pytest"),
+    ("Run pytest on tests directory", "python3 -m pytest tests/"),
+    ("Run pytest on tests/test_main.py", "python3 -m pytest tests/test_main.py"),
+    ("Navigate to /opt/app", "cd /opt/app"),
+    ("Navigate to ~", "cd /root"),
+    ("Navigate to ~/project", "cd /root/project"),
+])
+def test_templated_steps(step, expected):
+    assert translate_step(step)[1] == expected
+
+
+@pytest.mark.parametrize("step", [
+    "Install python packages using pip3",
+    "Install requirements using pip3",
+    "Install dependencies with pip",
+    "Install required system packages",
+    "Install flask and requirements using pip3",
+    "Navigate to project directory",
+    "Navigate to ~otheruser",
+    "Create a Flask app",
+])
+def test_role_words_and_unknown_steps_go_to_the_model(step):
+    assert translate_step(step) == (None, None)
+
+
+def test_navigate_uses_the_index_for_relative_paths():
+    state = state_with("/app", [("src", "d")])
+    assert translate_step("Navigate to src", state)[1] == "cd src"
+    assert translate_step("Navigate to docs", state)[1] is None
+
+
+def test_pytest_keeps_known_files_as_files():
+    state = state_with("/app", [("tests", "d"), ("checks", "f")])
+    assert translate_step("Run pytest on tests", state)[1] == "python3 -m pytest tests/"
+    assert translate_step("Run pytest on checks", state)[1] == "python3 -m pytest checks"
+
+
+def test_coalesce_merges_consecutive_installs_and_remaps_dependencies():
+    steps = ["Install flask using pip3", "Install pytest using pip3", "Create app.py",
+             "Install git system package", "Install curl system package"]
+    merged, depends_on = coalesce_installs(steps, [[], [1], [2], [], [4]])
+    assert merged == ["Install flask, pytest using pip3", "Create app.py", "Install git, curl system packages"]
+    assert depends_on == [[], [1], []]
+    assert translate_step(merged[0])[1] == "pip3 install flask pytest"
+
+
+def test_coalesce_leaves_role_word_steps_alone():
+    steps = ["Install flask using pip3", "Install requirements using pip3", "Install pytest using pip3"]
+    merged, depends_on = coalesce_installs(steps, [[], [1], [2]])
+    assert merged == steps
+    assert depends_on == [[], [1], [2]]
+
+
+def test_coalesce_passes_through_malformed_dependencies():
+    steps = ["Install flask using pip3", "Install pytest using pip3"]
+    merged, depends_on = coalesce_installs(steps, "bogus")
+    assert merged == ["Install flask, pytest using pip3"]
+    assert depends_on == "bogus"
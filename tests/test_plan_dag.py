@@ -0,0 +1,63 @@
+import pytest
+
+from plan_dag import parse_dependencies, schedule_waves
+
+
+@pytest.mark.parametrize("raw, count, expected", [
+    ([[], [1], [1, 2]], 3, [set(), {0}, {0, 1}]),
+    ([[], []], 2, [set(), set()]),
+    (None, 2, None),
+    ([[]], 2, None),
+    ([[], [2]], 2, None),
+    ([[], [0]], 2, None),
+    ([[], [True]], 2, None),
+    ([[], "1"], 2, None),
+])
+def test_parse_dependencies(raw, count, expected):
+    assert parse_dependencies(raw, count) == expected
+
+
+def independent(count):
+    return [set() for _ in range(count)]
+
+
+def test_independent_writes_share_a_wave():
+    assert schedule_waves(["mkdir src", "mkdir tests"], independent(2), "/app") == [[0, 1]]
+
+
+def test_declared_dependencies_are_kept():
+    assert schedule_waves(["mkdir src", "mkdir tests"], [set(), {0}], "/app") == [[0], [1]]
+
+
+def test_reading_what_another_step_writes_waits_for_it():
+    waves = schedule_waves(["touch a.txt", "touch b.txt", "cat a.txt b.txt"], independent(3), "/app")
+    assert waves == [[0, 1], [2]]
+
+
+def test_installs_never_overlap():
+    waves = schedule_waves(["pip3 install flask", "apt-get install -y git"], independent(2), "/app")
+    assert waves == [[0], [1]]
+
+
+@pytest.mark.parametrize("commands", [
+    ["mkdir -p /opt/app", "touch /opt/app/x"],
+    ["export FOO=bar", "echo $FOO > a.txt"],
+    ["find . -name '*.pyc' -delete", "ls"],
+    ["sed -i s/a/b/ x.py", "cat x.py"],
+    ["chmod +x run.sh", "./run.sh"],
+    ["cd src", "touch a.txt"],
+])
+def test_steps_it_cannot_bound_run_alone(commands):
+    assert schedule_waves(commands, independent(2), "/app") == [[0], [1]]
+
+
+def test_missing_commands_run_alone():
+    # pytest's stdin raises when read, as shlex would do for None
+    waves = schedule_waves(["mkdir src", None, "mkdir tests"], independent(3), "/app")
+    assert waves == [[0], [1], [2]]
+
+
+def test_file_writes_are_placed_by_their_paths():
+    write = {"write_files": [{"path": "src/main.py", "content": "", "mode": "644"}]}
+    waves = schedule_waves(["mkdir tests", write, "cat src/main.py"], independent(3), "/app")
+    assert waves == [[0, 1], [2]]
@@ -0,0 +1,133 @@
+import shutil
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+import pytest
+
+from shell_session import ShellSession
+
+pytestmark = pytest.mark.skipif(not shutil.which("bash"), reason="needs a local bash")
+
+
+class StandInSocket:
+    """A local bash behind a socketpair, framed the way Docker's exec/attach stream is"""
+
+    def __init__(self, cmd):
+        self.client, self.server = socket.socketpair()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self.send_lock = threading.Lock()
+        threading.Thread(target=self._pump_stdin, daemon=True).start()
+        threading.Thread(target=self._pump_output, args=(self.process.stdout, 1), daemon=True).start()
+        threading.Thread(target=self._pump_output, args=(self.process.stderr, 2), daemon=True).start()
+
+    def _pump_stdin(self):
+        try:
+            while True:
+                data = self.server.recv(65536)
+                if not data:
+                    break
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+        except OSError:
+            pass
+        finally:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def _pump_output(self, pipe, stream):
+        for chunk in iter(lambda: pipe.read1(65536), b""):
+            with self.send_lock:
+                try:
+                    self.server.sendall(struct.pack(">BxxxL", stream, len(chunk)) + chunk)
+                except OSError:
+                    return
+        if stream == 1:
+            self.process.wait()
+            self.server.close()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.client.close()
+
+
+class StandInAPI:
+    def __init__(self):
+        self.execs = {}
+        self.streams = []
+
+    def exec_create(self, container_id, cmd, **kwargs):
+        exec_id = f"exec{len(self.execs)}"
+        self.execs[exec_id] = cmd
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id, socket=False):
+        stream = StandInSocket(self.execs[exec_id])
+        self.streams.append(stream)
+        return stream.client
+
+
+class StandInContainer:
+    id = "stand-in"
+
+    def __init__(self):
+        self.client = type("Client", (), {})()
+        self.client.api = StandInAPI()
+
+    def exec_run(self, cmd, **kwargs):
+        result = subprocess.run(cmd, capture_output=True)
+        return result.returncode, result.stdout
+
+
+@pytest.fixture
+def session():
+    container = StandInContainer()
+    session = ShellSession(container)
+    yield session
+    session.close()
+    for stream in container.client.api.streams:
+        stream.close()
+
+
+def test_frames_stdout_stderr_and_exit_code(session, tmp_path):
+    code, out, err = session.run("echo out; echo err >&2; exit_with() { return $1; }; exit_with 3",
+                                 str(tmp_path))
+    assert (code, out, err) == (3, "out", "err")
+
+
+def test_output_without_trailing_newline_and_marker_lookalikes(session, tmp_path):
+    code, out, _ = session.run("printf 'no newline'; printf '\\n__OC_'", str(tmp_path))
+    assert code == 0
+    assert out == "no newline\n__OC_"
+
+
+def test_streams_output_as_it_arrives(session, tmp_path):
+    chunks = []
+    session.run("echo one; echo two >&2", str(tmp_path), on_output=lambda name, text: chunks.append(name))
+    assert set(chunks) == {"stdout", "stderr"}
+
+
+def test_cwd_and_env_carry_over(session, tmp_path):
+    (tmp_path / "sub").mkdir()
+    code, _, _ = session.run("cd sub && export GREETING=hello", str(tmp_path))
+    assert code == 0
+    assert session.cwd == str(tmp_path / "sub")
+
+    code, out, _ = session.run("echo $GREETING", session.cwd)
+    assert (code, out) == (0, "hello")
+
+
+def test_timeout_kills_the_command_and_the_shell(session, tmp_path):
+    started = time.monotonic()
+    code, _, err = session.run("sleep 30", str(tmp_path), timeout=1)
+    assert code == 124
+    assert "timed out" in err
+    assert time.monotonic() - started < 10
+    assert session._closed
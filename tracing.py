@@ -0,0 +1,187 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from llm_cache import CACHE_DIR
+
+TRACE_FILE = os.environ.get("OLLAMACONTROL_TRACE_FILE", os.path.join(CACHE_DIR, "traces.jsonl"))
+METRICS_PORT = int(os.environ.get("OLLAMACONTROL_METRICS_PORT", "0"))
+
+_current = contextvars.ContextVar("ollamacontrol_span", default=None)
+_export_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_span_totals = defaultdict(lambda: [0, 0.0])
+_model_totals = defaultdict(lambda: defaultdict(int))
+
+
+class Span:
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.duration = None
+        self.finished = []
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+        if self.root is not self:
+            self.root.finished.append(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs
+        }
+
+
+@contextmanager
+def span(name, **attrs):
+    current = Span(name, attrs, _current.get())
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.finish()
+        _current.reset(token)
+        _record(current)
+
+
+def traced(name, describe=None):
+    """Run the function inside a span; describe(result) adds attributes from its return value"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                if describe:
+                    try:
+                        current.attrs.update(describe(result))
+                    except Exception:
+                        pass
+                return result
+        return wrapper
+    return decorator
+
+
+def annotate(**attrs):
+    current = _current.get()
+    if current:
+        current.attrs.update(attrs)
+
+
+def current_span():
+    return _current.get()
+
+
+def _record(finished):
+    with _metrics_lock:
+        totals = _span_totals[finished.name]
+        totals[0] += 1
+        totals[1] += finished.duration
+        model = finished.attrs.get("model")
+        if model and finished.name == "ollama.chat":
+            for key in ("prompt_tokens", "eval_tokens"):
+                _model_totals[model][key] += finished.attrs.get(key) or 0
+            _model_totals[model]["calls"] += 1
+
+    if not TRACE_FILE:
+        return
+    try:
+        with _export_lock:
+            os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(finished.to_dict(), default=str) + "\n")
+    except OSError:
+        pass
+
+
+def print_request_summary(request_span):
+    """One line per span name under this request, slowest first"""
+    by_name = defaultdict(lambda: [0, 0.0])
+    tokens = defaultdict(lambda: [0, 0])
+    prompt_cache = defaultdict(lambda: [0, 0])
+    latency = defaultdict(list)
+    for finished in request_span.finished:
+        by_name[finished.name][0] += 1
+        by_name[finished.name][1] += finished.duration
+        if finished.name == "ollama.chat":
+            tokens[finished.attrs.get("model")][0] += finished.attrs.get("prompt_tokens") or 0
+            tokens[finished.attrs.get("model")][1] += finished.attrs.get("eval_tokens") or 0
+            if finished.attrs.get("prompt_estimate"):
+                prompt_cache[finished.attrs.get("model")][0] += finished.attrs["prompt_estimate"]
+                prompt_cache[finished.attrs.get("model")][1] += finished.attrs["cached_tokens"]
+            if finished.attrs.get("json_ms") is not None:
+                latency[finished.attrs.get("model")].append(
+                    (finished.attrs.get("ttft_ms") or 0, finished.attrs["json_ms"]))
+
+    print(f"\n⏱️ Request took {request_span.duration:.2f}s")
+    for name, (count, total) in sorted(by_name.items(), key=lambda item: -item[1][1]):
+        print(f"  {name:<22} {count:>3}x {total:>7.2f}s")
+    for model, (prompt_tokens, eval_tokens) in tokens.items():
+        print(f"  🤖 {model}: {prompt_tokens} prompt tokens, {eval_tokens} generated tokens")
+    for model, (estimate, cached) in prompt_cache.items():
+        print(f"  🧮 {model}: ~{cached * 100 // max(estimate, 1)}% of prompt tokens served from cache")
+    for model, calls in latency.items():
+        print(f"  ⚡ {model}: first token {sum(t for t, _ in calls) / len(calls):.0f} ms, "
+              f"valid JSON {sum(j for _, j in calls) / len(calls):.0f} ms on average")
+
+
+def prometheus_metrics():
+    lines = ["# TYPE ollamacontrol_span_seconds summary"]
+    with _metrics_lock:
+        for name, (count, total) in sorted(_span_totals.items()):
+            lines.append(f'ollamacontrol_span_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'ollamacontrol_span_seconds_count{{span="{name}"}} {count}')
+        lines.append("# TYPE ollamacontrol_model_tokens_total counter")
+        for model, totals in sorted(_model_totals.items()):
+            for key in ("prompt_tokens", "eval_tokens"):
+                lines.append(f'ollamacontrol_model_tokens_total{{model="{model}",kind="{key}"}} {totals[key]}')
+        lines.append("# TYPE ollamacontrol_model_calls_total counter")
+        for model, totals in sorted(_model_totals.items()):
+            lines.append(f'ollamacontrol_model_calls_total{{model="{model}"}} {totals["calls"]}')
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port=METRICS_PORT):
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            payload = prometheus_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics on http://127.0.0.1:{port}/metrics")
+    return server